@@ -0,0 +1,198 @@
+"""
+Admission control for the expensive endpoints.
+
+Each endpoint class has a concurrency limit with a bounded wait queue, and
+every wallet has a token bucket per endpoint class. A request is shed before
+it starts any work when:
+
+    503  the queue is full, or the estimated wait (queue position x EWMA of
+         recent service times / concurrency) exceeds the endpoint's budget,
+         or a slot did not free up within that budget
+    429  the wallet's bucket is empty (Retry-After: time to the next token)
+
+Capacity is checked first, so a request shed with 503 keeps its token.
+
+Limits come from ADMISSION_<NAME>_{CONCURRENCY,QUEUE,MAX_WAIT,PER_MINUTE,BURST}.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.metrics import metrics
+
+load_dotenv()
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_MAX_WALLETS = int(os.getenv("ADMISSION_MAX_WALLETS", "50000"))
+EWMA_ALPHA = 0.2
+
+
+def _limits(name: str, concurrency: int, queue: int, max_wait: float, per_minute: float, burst: int) -> dict:
+    prefix = f"ADMISSION_{name.upper()}_"
+    return {
+        "concurrency": int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        "queue": int(os.getenv(prefix + "QUEUE", str(queue))),
+        "max_wait": float(os.getenv(prefix + "MAX_WAIT", str(max_wait))),
+        "per_minute": float(os.getenv(prefix + "PER_MINUTE", str(per_minute))),
+        "burst": int(os.getenv(prefix + "BURST", str(burst))),
+    }
+
+
+DEFAULT_LIMITS = {
+    "auth": _limits("auth", concurrency=8, queue=32, max_wait=2.0, per_minute=30, burst=10),
+    "auth_stream": _limits("auth_stream", concurrency=4, queue=8, max_wait=3.0, per_minute=10, burst=3),
+    "enroll": _limits("enroll", concurrency=2, queue=8, max_wait=10.0, per_minute=3, burst=2),
+    "upload": _limits("upload", concurrency=4, queue=8, max_wait=10.0, per_minute=6, burst=3),
+    "email": _limits("email", concurrency=16, queue=64, max_wait=2.0, per_minute=5, burst=3),
+    "email_verify": _limits("email_verify", concurrency=16, queue=64, max_wait=2.0, per_minute=6, burst=3),
+}
+
+
+def _reject(status: int, detail: str, retry_after: float):
+    raise HTTPException(
+        status_code=status,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class TokenBuckets:
+    """Per-wallet token buckets (LRU-bounded so idle wallets are forgotten)."""
+
+    def __init__(self, per_minute: float, burst: int, max_wallets: int = ADMISSION_MAX_WALLETS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_wallets = max_wallets
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def take(self, wallet: str) -> float:
+        """Consume a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(wallet)
+        if bucket is None:
+            bucket = self._buckets[wallet] = [float(self.burst), now]
+            while len(self._buckets) > self.max_wallets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(wallet)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate if self.rate > 0 else 60.0
+
+
+class EndpointLimiter:
+    """Concurrency slots + bounded queue with an EWMA service-time wait estimate."""
+
+    def __init__(self, name: str, concurrency: int, queue: int, max_wait: float, per_minute: float, burst: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = queue
+        self.max_wait = max_wait
+        self.buckets = TokenBuckets(per_minute, burst)
+        self._slots = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_ewma = 0.0
+
+    def estimated_wait(self) -> float:
+        if self.in_flight < self.concurrency:
+            return 0.0
+        return (self.waiting + 1) * self.service_ewma / self.concurrency
+
+    def _gauges(self):
+        metrics.set_gauge(f"admission.{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"admission.{self.name}.waiting", self.waiting)
+        metrics.set_gauge(f"admission.{self.name}.est_wait_s", round(self.estimated_wait(), 3))
+
+    @asynccontextmanager
+    async def admit(self, wallet: str = None):
+        # Capacity first: a request shed with 503 must not cost the wallet a token
+        estimate = self.estimated_wait()
+        if self.in_flight >= self.concurrency and self.waiting >= self.max_queue:
+            metrics.incr(f"admission.{self.name}.shed_queue")
+            _reject(503, "Server busy, try again shortly", max(estimate, self.service_ewma))
+        if estimate > self.max_wait:
+            metrics.incr(f"admission.{self.name}.shed_wait")
+            _reject(503, "Server busy, try again shortly", estimate)
+
+        if wallet:
+            retry_after = self.buckets.take(wallet)
+            if retry_after:
+                metrics.incr(f"admission.{self.name}.rate_limited")
+                _reject(429, "Too many requests for this wallet", retry_after)
+
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self._gauges()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            metrics.incr(f"admission.{self.name}.shed_timeout")
+            _reject(503, "Server busy, try again shortly", self.estimated_wait())
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        metrics.observe(f"admission.{self.name}.queue_wait", started - queued_at)
+        metrics.incr(f"admission.{self.name}.admitted")
+        self.in_flight += 1
+        self._gauges()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.service_ewma = elapsed if not self.service_ewma else (
+                EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.service_ewma
+            )
+            self.in_flight -= 1
+            self._slots.release()
+            self._gauges()
+
+
+class AdmissionController:
+    """One limiter per endpoint class; a no-op when ADMISSION_ENABLED is false."""
+
+    def __init__(self, limits: Dict[str, dict] = DEFAULT_LIMITS, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.limits = limits
+        self.limiters = {name: EndpointLimiter(name, **cfg) for name, cfg in limits.items()}
+
+    @asynccontextmanager
+    async def admit(self, name: str, wallet: str = None):
+        if not self.enabled:
+            yield
+            return
+        async with self.limiters[name].admit(wallet):
+            yield
+
+    async def run(self, name: str, wallet: str, fn: Callable[[], Awaitable]):
+        async with self.admit(name, wallet):
+            return await fn()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "endpoints": {
+                name: {
+                    **self.limits[name],
+                    "in_flight": limiter.in_flight,
+                    "waiting": limiter.waiting,
+                    "service_ewma_s": round(limiter.service_ewma, 3),
+                    "est_wait_s": round(limiter.estimated_wait(), 3),
+                }
+                for name, limiter in self.limiters.items()
+            },
+        }
+
+
+# Global instance
+admission = AdmissionController()
@@ -0,0 +1,454 @@
+"""
+Offline batch ingestion of document scans and face enrollments.
+
+    python -m app.batch_ingest --manifest scans.jsonl --run-dir runs/acme
+    python -m app.batch_ingest --dir scans/ --kind document --wallet 0x... --ipfs local --chain local
+
+Items flow from a reader thread through worker processes (document: decode,
+extract, encrypt + IPFS; face: liveness + embedding) to a single writer in
+this process that owns the VectorStore, doc_store and the checkpoint file.
+Queues are bounded, so a slow stage throttles the ones before it. Finished
+items are checkpointed, so a rerun with the same --run-dir resumes. At the
+end one Merkle root over every item is committed on-chain.
+
+Manifest lines (JSONL, or CSV with a header):
+    {"path": "a.jpg", "kind": "document", "wallet": "0x...", "document": "Pan Card"}
+    {"path": "b.jpg", "kind": "face", "wallet": "0x..."}
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# How often the writer checks for workers that died without finishing
+WORKER_POLL_SECONDS = 5.0
+# Shared buffer per worker holding the key of the item it is working on
+CURRENT_KEY_BYTES = 8192
+
+
+# ==================== INPUT ====================
+
+def iter_manifest(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_directory(directory: str, kind: str, wallet: str, document: str) -> Iterator[dict]:
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield {"path": os.path.join(directory, name), "kind": kind, "wallet": wallet, "document": document}
+
+
+def _item_key(item: dict) -> str:
+    return f"{item['kind']}:{item['wallet'].lower()}:{os.path.abspath(item['path'])}"
+
+
+# ==================== WORKERS ====================
+
+def _process_document(task: dict, state: dict) -> dict:
+    from app.image_ingest import decode_image
+    from app.imageParser import extract_document
+    from app.fileUpload import upload_identity_document
+
+    timings = {}
+    t0 = time.perf_counter()
+    with open(task["path"], "rb") as f:
+        im = decode_image(f.read())
+    timings["read"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    extraction = extract_document(im, task.get("document"))
+    del im
+    timings["extract"] = time.perf_counter() - t0
+    if not extraction["fields"]:
+        raise ValueError("Failed to extract data from document")
+
+    t0 = time.perf_counter()
+    upload = upload_identity_document(
+        extracted_data=extraction["fields"],
+        doc_type=extraction["document_type"],
+        wallet_address=task["wallet"]
+    )
+    timings["encrypt_upload"] = time.perf_counter() - t0
+
+    return {
+        "ipfs_cid": upload["ipfs_cid"],
+        "key": upload["key"],
+        "document_type": extraction["document_type"],
+        "timestamp": upload["metadata"]["timestamp"],
+        "timings": timings,
+    }
+
+
+def _process_face(task: dict, state: dict) -> dict:
+    from app.face_quality import quality_failure_message
+    from app.image_ingest import decode_image, FACE_DECODE_MAX_SIDE
+
+    if "face" not in state:
+        from app.face_pipeline import FacePipeline
+        from app.runtime_config import FACE_DEVICE
+        state["face"] = FacePipeline(device=FACE_DEVICE)
+    pipeline = state["face"]
+
+    timings = {}
+    t0 = time.perf_counter()
+    with open(task["path"], "rb") as f:
+        image_bgr = decode_image(f.read(), max_side=FACE_DECODE_MAX_SIDE)
+    timings["read"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    aligned, box, _prob, landmarks = pipeline.detect_face(image_bgr)
+    if aligned is None:
+        raise ValueError("No face detected")
+    quality = pipeline.assess_quality(image_bgr, box, landmarks)
+    timings["detect"] = time.perf_counter() - t0
+    if not quality["ok"]:
+        raise ValueError(quality_failure_message(quality))
+
+    t0 = time.perf_counter()
+    liveness = pipeline.check_liveness_from_bgr(image_bgr, enforce_detection=False)
+    timings["liveness"] = time.perf_counter() - t0
+    if not liveness["is_live"]:
+        raise ValueError("Liveness check failed")
+
+    t0 = time.perf_counter()
+    emb = pipeline.embed(aligned)
+    timings["embed"] = time.perf_counter() - t0
+
+    return {"embedding": emb.astype("float32").tolist(), "timings": timings}
+
+
+def _worker_main(task_q, result_q, threads: int, current):
+    # Keep each worker to its share of the cores
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "CPUS_PER_WORKER"):
+        os.environ[var] = str(threads)
+    os.environ.setdefault("OCR_WORKERS", "1")
+
+    state: dict = {}
+    while True:
+        task = task_q.get()
+        if task is None:
+            result_q.put(None)
+            return
+        # Read by the writer if this process dies mid-item (OOM, native crash)
+        current.value = task["key"].encode("utf-8")[:CURRENT_KEY_BYTES - 1]
+        try:
+            if task["kind"] == "document":
+                out = _process_document(task, state)
+            elif task["kind"] == "face":
+                out = _process_face(task, state)
+            else:
+                raise ValueError(f"Unknown kind: {task['kind']}")
+        except Exception as e:
+            out = {"error": f"{type(e).__name__}: {e}", "timings": {}}
+        out.update({"key": task["key"], "kind": task["kind"], "wallet": task["wallet"].lower()})
+        result_q.put(out)
+        current.value = b""
+
+
+# ==================== WRITER ====================
+
+class StageStats:
+    """Per-stage busy time and counts, for throughput reporting."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.done = 0
+        self.failed = 0
+
+    def add(self, timings: dict):
+        for stage, seconds in timings.items():
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def report(self) -> dict:
+        wall = time.perf_counter() - self.started
+        stages = {}
+        for stage, values in self.stages.items():
+            busy = sum(values)
+            stages[stage] = {
+                "count": len(values),
+                "mean_ms": round(1000 * busy / len(values), 1),
+                "items_per_s_per_worker": round(len(values) / busy, 2) if busy else None,
+            }
+        return {
+            "wall_seconds": round(wall, 1),
+            "done": self.done,
+            "failed": self.failed,
+            "items_per_s": round(self.done / wall, 2) if wall else 0.0,
+            "stages": stages,
+        }
+
+
+class Checkpoint:
+    """Append-only JSONL of completed items; flushed only after state is persisted."""
+
+    def __init__(self, run_dir: str):
+        self.path = os.path.join(run_dir, "checkpoint.jsonl")
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        self._pending: List[dict] = []
+
+    def add(self, entry: dict):
+        self.entries[entry["key"]] = entry
+        self._pending.append(entry)
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in self._pending:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = []
+
+
+def _write_result(result: dict, store, doc_store, run_id: str) -> dict:
+    """Apply one worker result to local state; returns its checkpoint entry."""
+    import numpy as np
+    from web3 import Web3
+    from app.utils.hashing import build_commitment
+
+    wallet = result["wallet"]
+    if result["kind"] == "document":
+        doc_store.add_document(wallet, {
+            "ipfs_cid": result["ipfs_cid"],
+            "key": result["key"],
+            "document_type": result["document_type"],
+            "timestamp": result["timestamp"],
+            "batch_run": run_id,
+        }, persist=False)
+        leaf = bytes(Web3.keccak(text=result["ipfs_cid"]))
+        return {"key": result["key"], "kind": "document", "wallet": wallet, "ipfs_cid": result["ipfs_cid"], "leaf": leaf.hex()}
+
+    old_rec = store.get_wallet_record(wallet)
+    if old_rec and old_rec.get("user_id"):
+        store.delete_vector(old_rec["user_id"], persist=False)
+    user_id = str(uuid.uuid4())
+    digest = store.add_vector(user_id, np.asarray(result["embedding"], dtype=np.float32), persist=False)
+    commitment_hash, salt = build_commitment(digest)
+    store.bind_wallet_single(wallet, user_id, digest, salt, persist=False)
+    leaf = bytes.fromhex(commitment_hash.removeprefix("0x"))
+    return {"key": result["key"], "kind": "face", "wallet": wallet, "user_id": user_id, "leaf": leaf.hex()}
+
+
+def _commit_run(checkpoint: Checkpoint, run_dir: str, run_id: str, chain: str, doc_store) -> dict:
+    """Commit one Merkle root over every checkpointed item."""
+    from app.utils.hashing import merkle_root_and_proofs
+
+    entries = sorted(checkpoint.entries.values(), key=lambda e: e["key"])
+    if not entries:
+        return {}
+    root, proofs = merkle_root_and_proofs([bytes.fromhex(e["leaf"]) for e in entries])
+
+    commitment_path = os.path.join(run_dir, "commitment.json")
+    if os.path.exists(commitment_path):
+        with open(commitment_path, "r") as f:
+            previous = json.load(f)
+        if previous.get("merkle_root") == root.hex():
+            print("Run already committed with the same root; skipping transaction")
+            return previous
+
+    if chain == "local":
+        from app.blockchain.local_chain import LocalChain
+        tx = LocalChain().set_global_commitment_hash(root)
+    else:
+        from app.blockchain.identity_docs.service import set_global_commitment_hash
+        tx = set_global_commitment_hash(root)
+    if not tx.get("success"):
+        raise RuntimeError(f"Batch commitment failed: {tx.get('error')}")
+
+    by_cid = {}
+    items = {}
+    for entry, proof in zip(entries, proofs):
+        items[entry["key"]] = {"leaf": entry["leaf"], "proof": proof}
+        if entry["kind"] == "document":
+            by_cid[entry["ipfs_cid"]] = proof
+
+    # Attach the proof and transaction to every document record of the run
+    for docs in doc_store.documents.values():
+        for doc in docs:
+            if doc.get("ipfs_cid") in by_cid:
+                doc.update({
+                    "merkle_root": root.hex(),
+                    "merkle_proof": by_cid[doc["ipfs_cid"]],
+                    "transaction_hash": tx["transaction_hash"],
+                    "block_number": tx["block_number"],
+                })
+    doc_store.save()
+
+    commitment = {
+        "run_id": run_id,
+        "merkle_root": root.hex(),
+        "transaction_hash": tx["transaction_hash"],
+        "block_number": tx["block_number"],
+        "items": items,
+    }
+    with open(commitment_path, "w") as f:
+        json.dump(commitment, f, indent=2)
+    return commitment
+
+
+# ==================== MAIN ====================
+
+def run(args) -> dict:
+    os.makedirs(args.run_dir, exist_ok=True)
+    if args.ipfs == "local":
+        os.environ["IPFS_BACKEND"] = "local"
+
+    from app.sharded_storage import open_vector_store
+    from app.document_storage import doc_store
+
+    run_id = os.path.basename(os.path.abspath(args.run_dir))
+    checkpoint = Checkpoint(args.run_dir)
+    store = open_vector_store(dim=512, use_cosine=True)
+    stats = StageStats()
+
+    if args.manifest:
+        items = iter_manifest(args.manifest)
+    else:
+        items = iter_directory(args.dir, args.kind, args.wallet, args.document)
+
+    ctx = mp.get_context("spawn")
+    task_q = ctx.Queue(maxsize=args.queue_size)
+    result_q = ctx.Queue(maxsize=args.queue_size)
+    current = [ctx.Array("c", CURRENT_KEY_BYTES, lock=False) for _ in range(args.workers)]
+    workers = [
+        ctx.Process(target=_worker_main, args=(task_q, result_q, args.threads_per_worker, current[i]), daemon=True)
+        for i in range(args.workers)
+    ]
+    for p in workers:
+        p.start()
+
+    submitted = {"count": 0, "skipped": 0}
+
+    def produce():
+        for item in items:
+            item["key"] = _item_key(item)
+            if item["key"] in checkpoint.entries:
+                submitted["skipped"] += 1
+                continue
+            task_q.put(item)  # blocks when workers fall behind
+            submitted["count"] += 1
+        for _ in workers:
+            task_q.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    errors_path = os.path.join(args.run_dir, "errors.jsonl")
+    finished_workers = 0
+    crashed = set()
+    since_flush = 0
+    last_report = time.perf_counter()
+    with open(errors_path, "a", encoding="utf-8") as errors:
+        while finished_workers < len(workers):
+            try:
+                result = result_q.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                # A worker killed mid-item never sends its None: count it as
+                # finished and record its item as failed, so a rerun retries it
+                for i, p in enumerate(workers):
+                    if i in crashed or p.is_alive() or p.exitcode == 0:
+                        continue
+                    crashed.add(i)
+                    finished_workers += 1
+                    key = current[i].value.decode("utf-8", "replace")
+                    print(f"❌ Worker {p.pid} exited with code {p.exitcode} (item: {key or 'none'})")
+                    if key:
+                        stats.failed += 1
+                        errors.write(json.dumps({"key": key, "error": f"Worker exited with code {p.exitcode}"}) + "\n")
+                        errors.flush()
+                continue
+            if result is None:
+                finished_workers += 1
+                continue
+
+            stats.add(result.get("timings", {}))
+            if "error" in result:
+                stats.failed += 1
+                errors.write(json.dumps({"key": result["key"], "error": result["error"]}) + "\n")
+                errors.flush()
+            else:
+                t0 = time.perf_counter()
+                checkpoint.add(_write_result(result, store, doc_store, run_id))
+                stats.add({"write": time.perf_counter() - t0})
+                stats.done += 1
+                since_flush += 1
+
+            if since_flush >= args.checkpoint_every:
+                store.persist()
+                doc_store.save()
+                checkpoint.flush()
+                since_flush = 0
+
+            if time.perf_counter() - last_report >= args.report_every:
+                last_report = time.perf_counter()
+                r = stats.report()
+                print(f"[{r['wall_seconds']}s] done={r['done']} failed={r['failed']} "
+                      f"queued={submitted['count']} resumed={submitted['skipped']} rate={r['items_per_s']}/s")
+
+    store.persist()
+    doc_store.save()
+    checkpoint.flush()
+    for p in workers:
+        p.join()
+
+    report = stats.report()
+    report["resumed"] = submitted["skipped"]
+    if not args.no_commit:
+        commitment = _commit_run(checkpoint, args.run_dir, run_id, args.chain, doc_store)
+        report["merkle_root"] = commitment.get("merkle_root")
+        report["transaction_hash"] = commitment.get("transaction_hash")
+
+    with open(os.path.join(args.run_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch ingestion of document scans and face enrollments")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="JSONL or CSV manifest of items")
+    source.add_argument("--dir", help="Directory of images (requires --kind and --wallet)")
+    parser.add_argument("--kind", choices=["document", "face"], default="document")
+    parser.add_argument("--wallet", help="Wallet for every image in --dir")
+    parser.add_argument("--document", default="auto", help="Document type for --dir (default: auto-detect)")
+    parser.add_argument("--run-dir", required=True, help="Directory for checkpoint, errors and report")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=16, help="Bound on in-flight items per queue")
+    parser.add_argument("--checkpoint-every", type=int, default=50)
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--ipfs", choices=["cli", "local"], default="cli")
+    parser.add_argument("--chain", choices=["sepolia", "local"], default="sepolia")
+    parser.add_argument("--no-commit", action="store_true", help="Skip the on-chain batch commitment")
+    args = parser.parse_args()
+
+    if args.dir and not args.wallet:
+        parser.error("--dir requires --wallet")
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
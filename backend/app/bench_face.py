@@ -0,0 +1,131 @@
+"""
+Face pipeline throughput benchmark across worker counts.
+
+    python -m app.bench_face --images images/ --workers 1,2,4 --seconds 30
+    python -m app.bench_face --images images/ --workers 1,2,4,8 --pin --liveness
+
+For each worker count N, N processes are spawned the way uvicorn workers
+would run: each gets cores/N threads for every pool (see app.runtime_config)
+and, with --pin, its own slice of CPUs. All workers start together and run
+align + embed (and liveness with --liveness) over the images for a fixed
+time. Throughput should grow close to linearly with N; with unpinned
+default pools it flattens early from oversubscription.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from typing import List
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _worker(paths, env, seconds, liveness, barrier, result_q):
+    os.environ.update(env)
+    from app.face_pipeline import FacePipeline
+    from app.image_ingest import decode_image, FACE_DECODE_MAX_SIDE
+
+    pipeline = FacePipeline(device=env.get("FACE_DEVICE", "cpu"))
+    pipeline.warmup(rounds=1)
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(decode_image(f.read(), max_side=FACE_DECODE_MAX_SIDE))
+
+    barrier.wait()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        image_bgr = frames[i % len(frames)]
+        i += 1
+        start = time.perf_counter()
+        if liveness:
+            pipeline.check_liveness_from_bgr(image_bgr, enforce_detection=False)
+        aligned = pipeline.align(image_bgr)
+        if aligned is not None:
+            pipeline.embed(aligned)
+        latencies.append(time.perf_counter() - start)
+    result_q.put({"runtime": pipeline.runtime, "latencies": latencies})
+
+
+def run_level(paths, workers: int, args) -> dict:
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    threads = max(1, cores // workers)
+    env = {
+        "WEB_CONCURRENCY": str(workers),
+        "CPUS_PER_WORKER": str(threads),
+        "OMP_NUM_THREADS": str(threads),
+        "MKL_NUM_THREADS": str(threads),
+        "CPU_AFFINITY": "auto" if args.pin else "",
+        "FACE_DEVICE": args.device,
+        "WARMUP_ON_STARTUP": "false",
+    }
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    result_q = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(paths, env, args.seconds, args.liveness, barrier, result_q))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    results = [result_q.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    latencies = [t for r in results for t in r["latencies"]]
+    return {
+        "workers": workers,
+        "threads_per_worker": threads,
+        "pinned": [r["runtime"]["affinity"] for r in results] if args.pin else None,
+        "images": len(latencies),
+        "images_per_s": round(len(latencies) / args.seconds, 2),
+        "p50_ms": round(1000 * _percentile(latencies, 0.50), 1),
+        "p95_ms": round(1000 * _percentile(latencies, 0.95), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face pipeline throughput vs worker count")
+    parser.add_argument("--images", required=True, help="Directory of face images")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Measured time per level")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own CPU slice")
+    parser.add_argument("--liveness", action="store_true", help="Include DeepFace liveness per image")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    paths = [
+        os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    if not paths:
+        parser.error(f"No images in {args.images}")
+
+    levels = []
+    for workers in (int(w) for w in args.workers.split(",")):
+        level = run_level(paths, workers, args)
+        base = levels[0] if levels else level
+        level["scaling_efficiency"] = round(
+            level["images_per_s"] / (base["images_per_s"] * workers / base["workers"]), 2
+        ) if base["images_per_s"] else None
+        levels.append(level)
+        print(json.dumps(level))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"pin": args.pin, "liveness": args.liveness, "levels": levels}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
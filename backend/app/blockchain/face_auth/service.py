@@ -1,22 +1,30 @@
 import json
 import os
 from web3 import Web3
-from ..client import w3, account
+from ..local_chain import CHAIN_BACKEND
 
 FACE_AUTH_CONTRACT_ADDRESS = os.getenv("FACE_AUTH_CONTRACT_ADDRESS")
 SEPOLIA_CHAIN_ID = 11155111
 
 # Load ABI
-with open("app/blockchain/face_auth/abi.json", "r", encoding="utf-8") as f:
+with open(os.path.join(os.path.dirname(__file__), "abi.json"), "r", encoding="utf-8") as f:
     ABI = json.load(f)
 
-face_auth_contract = w3.eth.contract(
-    address=Web3.to_checksum_address(FACE_AUTH_CONTRACT_ADDRESS),
-    abi=ABI
-)
+if CHAIN_BACKEND == "local":
+    from ..local_chain import local_chain
+else:
+    from ..client import w3, account
+
+    face_auth_contract = w3.eth.contract(
+        address=Web3.to_checksum_address(FACE_AUTH_CONTRACT_ADDRESS),
+        abi=ABI
+    )
 
 def set_face_commitment(commitment_hex: str) -> str:
     """Set face authentication commitment."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.set_face_commitment(commitment_hex)
+
     nonce = w3.eth.get_transaction_count(account.address, "pending")
     
     base_fee = w3.eth.gas_price
@@ -42,6 +50,8 @@ def set_face_commitment(commitment_hex: str) -> str:
 
 def get_face_commitment(wallet_address: str) -> str:
     """Read face commitment from contract."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.get_face_commitment(wallet_address)
     value = face_auth_contract.functions.getCommitment(
         Web3.to_checksum_address(wallet_address)
     ).call()
@@ -1,7 +1,7 @@
 import json
 import os
 from web3 import Web3
-from ..client import w3, account
+from ..local_chain import CHAIN_BACKEND
 
 IDENTITY_DOC_CONTRACT_ADDRESS = os.getenv("IDENTITY_DOC_CONTRACT_ADDRESS")
 SEPOLIA_CHAIN_ID = 11155111
@@ -24,17 +24,31 @@ IDENTITY_ABI = [
     }
 ]
 
-identity_contract = w3.eth.contract(
-    address=Web3.to_checksum_address(IDENTITY_DOC_CONTRACT_ADDRESS),
-    abi=IDENTITY_ABI
-)
+if CHAIN_BACKEND == "local":
+    from ..local_chain import local_chain
+else:
+    from ..client import w3, account
+
+    identity_contract = w3.eth.contract(
+        address=Web3.to_checksum_address(IDENTITY_DOC_CONTRACT_ADDRESS),
+        abi=IDENTITY_ABI
+    )
 
 def set_identity_commitment(ipfs_cid: str) -> dict:
     """Store IPFS CID hash on blockchain."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.set_identity_commitment(ipfs_cid)
+    # Convert CID to bytes32
+    result = set_global_commitment_hash(w3.keccak(text=ipfs_cid))
+    if result["success"]:
+        result["ipfs_cid"] = ipfs_cid
+    return result
+
+def set_global_commitment_hash(commitment_hash: bytes) -> dict:
+    """Store a raw bytes32 commitment (e.g. a batch Merkle root) on blockchain."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.set_global_commitment_hash(commitment_hash)
     try:
-        # Convert CID to bytes32
-        commitment_hash = w3.keccak(text=ipfs_cid)
-        
         nonce = w3.eth.get_transaction_count(account.address, "pending")
         
         base_fee = w3.eth.gas_price
@@ -61,7 +75,6 @@ def set_identity_commitment(ipfs_cid: str) -> dict:
             "transaction_hash": receipt.transactionHash.hex(),
             "block_number": receipt['blockNumber'],
             "gas_used": receipt['gasUsed'],
-            "ipfs_cid": ipfs_cid,
             "commitment_hash": commitment_hash.hex()
         }
     
@@ -73,6 +86,8 @@ def set_identity_commitment(ipfs_cid: str) -> dict:
 
 def get_identity_commitment() -> str:
     """Retrieve current commitment hash from blockchain."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.get_identity_commitment()
     try:
         commitment_hash = identity_contract.functions.getGlobalCommitment().call()
         return commitment_hash.hex()
@@ -81,6 +96,8 @@ def get_identity_commitment() -> str:
 
 def verify_identity_commitment(ipfs_cid: str) -> bool:
     """Verify if IPFS CID matches blockchain commitment."""
+    if CHAIN_BACKEND == "local":
+        return local_chain.verify_identity_commitment(ipfs_cid)
     try:
         current_hash = identity_contract.functions.getGlobalCommitment().call()
         cid_hash = w3.keccak(text=ipfs_cid)
@@ -0,0 +1,353 @@
+"""
+Local index of our contracts' commitment events.
+
+    python -m app.blockchain.indexer                 # sync once up to the head
+    python -m app.blockchain.indexer --follow        # keep following new blocks
+    python -m app.blockchain.indexer --find 0x<commitment>
+
+Events from the FaceAuthCommitment and GlobalIdentityCommitment contracts
+(abi.json of each service) are pulled with batched eth_getLogs over both
+addresses at once and stored in a SQLite table indexed by commitment. The
+checkpoint is written in the same transaction as each batch, so an
+interrupted sync resumes from the last finished batch and a repeated batch
+is a no-op. Batches shrink when the node rejects a range as too large and
+grow back afterwards. Only blocks INDEXER_CONFIRMATIONS behind the head are
+indexed, which keeps reorged logs out.
+
+With CHAIN_BACKEND=local the same code reads LocalChain.get_logs(), so the
+indexer can be exercised without a node.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+from .local_chain import CHAIN_BACKEND, FACE_AUTH_ADDRESS, IDENTITY_DOC_ADDRESS
+
+load_dotenv()
+INDEXER_DB_PATH = os.getenv("INDEXER_DB_PATH", os.path.join("data", "chain_index.sqlite3"))
+# First block to scan: the earlier of the two contract deployment blocks
+INDEXER_START_BLOCK = int(os.getenv("INDEXER_START_BLOCK", "0"))
+INDEXER_BATCH_BLOCKS = int(os.getenv("INDEXER_BATCH_BLOCKS", "2000"))
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "6"))
+INDEXER_POLL_SECONDS = float(os.getenv("INDEXER_POLL_SECONDS", "15"))
+# Follow the chain from inside the API process (otherwise run the CLI with --follow)
+INDEXER_FOLLOW = os.getenv("INDEXER_FOLLOW", "false").lower() in ("1", "true", "yes")
+
+_CHECKPOINT = "commitments"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    contract     TEXT NOT NULL,
+    event        TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    tx_hash      TEXT NOT NULL,
+    log_index    INTEGER NOT NULL,
+    sender       TEXT,
+    commitment   TEXT,
+    timestamp    INTEGER,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_commitment ON events (commitment);
+CREATE INDEX IF NOT EXISTS events_block ON events (contract, event, block_number);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name         TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL
+);
+"""
+
+
+def _hex(value) -> Optional[str]:
+    """Lower-case hex without 0x, the form the services return commitments in."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return str(value).lower().removeprefix("0x")
+
+
+class LocalLogSource:
+    """Logs from a LocalChain (CHAIN_BACKEND=local)."""
+
+    confirmations = 0
+
+    def __init__(self, chain, reload: bool = False):
+        self.chain = chain
+        # A separate indexer process re-reads the ledger file the API writes
+        self.reload = reload
+        self.contracts = {FACE_AUTH_ADDRESS.lower(): "face_auth", IDENTITY_DOC_ADDRESS.lower(): "identity_docs"}
+
+    def head(self) -> int:
+        if self.reload:
+            self.chain.load()
+        return self.chain.block_number
+
+    def get_logs(self, from_block: int, to_block: int) -> List[dict]:
+        events = []
+        for log in self.chain.get_logs(from_block, to_block):
+            contract = self.contracts.get(log["address"].lower())
+            if contract is None:
+                continue
+            args = log["args"]
+            events.append({
+                "contract": contract,
+                "event": log["event"],
+                "block_number": log["blockNumber"],
+                "tx_hash": _hex(log["transactionHash"]),
+                "log_index": log["logIndex"],
+                "sender": args.get("user"),
+                "commitment": _hex(args.get("commitment") or args.get("commitmentHash")),
+                "timestamp": args.get("timestamp", log.get("timestamp")),
+            })
+        return events
+
+
+class RpcLogSource:
+    """Logs from the RPC node, decoded with the contracts' abi.json events."""
+
+    def __init__(self, w3, confirmations: int = INDEXER_CONFIRMATIONS):
+        from web3 import Web3
+
+        self.w3 = w3
+        self.confirmations = confirmations
+        self.contracts = {}
+        self.addresses = []
+        self._decoders = {}
+        here = os.path.dirname(__file__)
+        for name, env in (("face_auth", "FACE_AUTH_CONTRACT_ADDRESS"), ("identity_docs", "IDENTITY_DOC_CONTRACT_ADDRESS")):
+            with open(os.path.join(here, name, "abi.json"), "r", encoding="utf-8") as f:
+                abi = json.load(f)
+            address = Web3.to_checksum_address(os.getenv(env))
+            contract = w3.eth.contract(address=address, abi=abi)
+            self.contracts[address.lower()] = name
+            self.addresses.append(address)
+            for item in abi:
+                if item["type"] == "event":
+                    signature = f"{item['name']}({','.join(i['type'] for i in item['inputs'])})"
+                    topic = _hex(Web3.keccak(text=signature))
+                    self._decoders[(address.lower(), topic)] = getattr(contract.events, item["name"])()
+
+    def head(self) -> int:
+        return self.w3.eth.block_number
+
+    def get_logs(self, from_block: int, to_block: int) -> List[dict]:
+        events = []
+        for log in self.w3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block, "address": self.addresses}):
+            address = log["address"].lower()
+            decoder = self._decoders.get((address, _hex(log["topics"][0]))) if log["topics"] else None
+            if decoder is None:
+                continue
+            decoded = decoder.process_log(log)
+            args = decoded["args"]
+            events.append({
+                "contract": self.contracts[address],
+                "event": decoded["event"],
+                "block_number": decoded["blockNumber"],
+                "tx_hash": _hex(decoded["transactionHash"]),
+                "log_index": decoded["logIndex"],
+                "sender": args["user"].lower() if "user" in args else None,
+                "commitment": _hex(args.get("commitment") or args.get("commitmentHash") or args.get("oldCommitmentHash")),
+                "timestamp": args.get("timestamp"),
+            })
+        return events
+
+
+def default_source(reload: bool = False):
+    if CHAIN_BACKEND == "local":
+        from .local_chain import LocalChain, local_chain
+        return LocalLogSource(LocalChain() if reload else local_chain, reload=reload)
+    from .client import w3
+    return RpcLogSource(w3)
+
+
+class ChainIndexer:
+    """Batched, checkpointed event sync into SQLite, plus local lookups."""
+
+    def __init__(
+        self,
+        source=None,
+        path: str = INDEXER_DB_PATH,
+        start_block: int = INDEXER_START_BLOCK,
+        batch_blocks: int = INDEXER_BATCH_BLOCKS,
+        poll_seconds: float = INDEXER_POLL_SECONDS
+    ):
+        self._source = source
+        self.path = path
+        self.start_block = start_block
+        self.max_batch = batch_blocks
+        self.batch = batch_blocks
+        self.poll_seconds = poll_seconds
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def source(self):
+        # Built on first use so importing this module never opens an RPC connection
+        if self._source is None:
+            self._source = default_source()
+        return self._source
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # ---- sync ----
+
+    def checkpoint(self) -> int:
+        """Last block fully indexed (start_block - 1 before the first sync)."""
+        row = self._conn().execute("SELECT block_number FROM checkpoints WHERE name = ?", (_CHECKPOINT,)).fetchone()
+        return row[0] if row else self.start_block - 1
+
+    def _store_batch(self, events: List[dict], to_block: int):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO events (contract, event, block_number, tx_hash, log_index, sender, commitment, timestamp) "
+                "VALUES (:contract, :event, :block_number, :tx_hash, :log_index, :sender, :commitment, :timestamp)",
+                events
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (name, block_number) VALUES (?, ?)", (_CHECKPOINT, to_block)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sync(self, to_block: Optional[int] = None) -> dict:
+        """Index every confirmed block after the checkpoint; returns what was done."""
+        with self._sync_lock:
+            start = time.perf_counter()
+            target = self.source.head() - self.source.confirmations
+            if to_block is not None:
+                target = min(target, to_block)
+            from_block = self.checkpoint() + 1
+            events = batches = 0
+            while from_block <= target:
+                end = min(target, from_block + self.batch - 1)
+                try:
+                    logs = self.source.get_logs(from_block, end)
+                except Exception as e:
+                    # Providers cap the block range or result count of eth_getLogs
+                    if self.batch == 1:
+                        raise
+                    self.batch = max(1, self.batch // 2)
+                    metrics.incr("indexer.batch_shrunk")
+                    print(f"⚠️ eth_getLogs {from_block}-{end} failed ({e}); batch now {self.batch} blocks")
+                    continue
+                self._store_batch(logs, end)
+                events += len(logs)
+                batches += 1
+                from_block = end + 1
+                self.batch = min(self.max_batch, self.batch * 2)
+            elapsed = time.perf_counter() - start
+            metrics.observe("indexer.sync", elapsed)
+            metrics.incr("indexer.events", events)
+            metrics.set_gauge("indexer.block", self.checkpoint())
+            return {"events": events, "batches": batches, "block": self.checkpoint(), "seconds": round(elapsed, 3)}
+
+    def _follow_loop(self):
+        while not self._stop.is_set():
+            try:
+                result = self.sync()
+                if result["events"]:
+                    print(f"✅ Indexed {result['events']} events up to block {result['block']}")
+            except Exception as e:
+                metrics.incr("indexer.errors")
+                print(f"⚠️ Chain index sync failed: {e}")
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        """Follow the chain in a daemon thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._follow_loop, name="chain-indexer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ---- lookups ----
+
+    def find_commitment(self, commitment, event: Optional[str] = None) -> List[dict]:
+        """Every indexed event carrying this bytes32 commitment, oldest first."""
+        query = "SELECT * FROM events WHERE commitment = ?"
+        params = [_hex(commitment)]
+        if event:
+            query += " AND event = ?"
+            params.append(event)
+        rows = self._conn().execute(query + " ORDER BY block_number, log_index", params).fetchall()
+        return [dict(r) for r in rows]
+
+    def global_commitment_at(self, block_number: int) -> Optional[dict]:
+        """The GlobalCommitmentSet event in force at block_number, if indexed."""
+        row = self._conn().execute(
+            "SELECT * FROM events WHERE event = 'GlobalCommitmentSet' AND block_number <= ? "
+            "ORDER BY block_number DESC, log_index DESC LIMIT 1",
+            (block_number,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def events_at(self, block_number: int, commitment, event: Optional[str] = None) -> List[dict]:
+        """
+        Events carrying this commitment in one block, read from the chain
+        rather than the index: a lookup for callers that know the block
+        (batch records store it) when the index is not following the chain.
+        """
+        commitment = _hex(commitment)
+        return [
+            e for e in self.source.get_logs(block_number, block_number)
+            if e["commitment"] == commitment and (event is None or e["event"] == event)
+        ]
+
+    def status(self) -> dict:
+        count = self._conn().execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        return {"block": self.checkpoint(), "events": count, "following": self._thread is not None}
+
+
+# Global instance
+chain_indexer = ChainIndexer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index commitment events into SQLite")
+    parser.add_argument("--follow", action="store_true", help="Keep polling for new blocks")
+    parser.add_argument("--to-block", type=int, help="Stop at this block")
+    parser.add_argument("--find", help="Print the events for a commitment and exit")
+    args = parser.parse_args()
+
+    if args.find:
+        print(json.dumps(ChainIndexer().find_commitment(args.find), indent=2))
+        return
+    indexer = ChainIndexer(source=default_source(reload=True))
+    print(json.dumps(indexer.sync(args.to_block)))
+    if args.follow:
+        indexer.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            indexer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+In-process stand-in for the Sepolia contracts.
+
+Mirrors the FaceAuthCommitment and GlobalIdentityCommitment functions the
+services call, keeps a small block/transaction/event ledger in a JSON file,
+and returns receipts shaped like the real service results. Used for offline
+batch runs, load tests and indexer tests; never for production.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from web3 import Web3
+
+load_dotenv()
+# rpc: Sepolia through blockchain/client.py; local: the in-process chain below
+CHAIN_BACKEND = os.getenv("CHAIN_BACKEND", "rpc").lower()
+# Empty keeps the ledger in memory only (load tests)
+LOCAL_CHAIN_FILE = os.getenv("LOCAL_CHAIN_FILE", os.path.join("data", "local_chain.json"))
+LOCAL_ACCOUNT = "0x" + "00" * 19 + "01"
+FACE_AUTH_ADDRESS = "0x" + "fa" * 20
+IDENTITY_DOC_ADDRESS = "0x" + "1d" * 20
+LOCAL_GAS_USED = 45000
+ZERO_BYTES32 = b"\x00" * 32
+
+
+class LocalChain:
+    """One block per transaction, persisted after every write."""
+
+    def __init__(self, storage_file: str = LOCAL_CHAIN_FILE, block_time: float = 0.0):
+        self.storage_file = storage_file
+        self.block_time = block_time
+        self._lock = threading.Lock()
+        self.blocks: List[dict] = []
+        self.face_commitments: Dict[str, str] = {}
+        self.global_commitment: str = ZERO_BYTES32.hex()
+        self.load()
+
+    def load(self):
+        if self.storage_file and os.path.exists(self.storage_file):
+            with open(self.storage_file, "r") as f:
+                state = json.load(f)
+            self.blocks = state.get("blocks", [])
+            self.face_commitments = state.get("face_commitments", {})
+            self.global_commitment = state.get("global_commitment", ZERO_BYTES32.hex())
+
+    def save(self):
+        if not self.storage_file:
+            return
+        os.makedirs(os.path.dirname(self.storage_file) or ".", exist_ok=True)
+        tmp = self.storage_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "blocks": self.blocks,
+                "face_commitments": self.face_commitments,
+                "global_commitment": self.global_commitment,
+            }, f)
+        os.replace(tmp, self.storage_file)
+
+    @property
+    def block_number(self) -> int:
+        return len(self.blocks)
+
+    def _transact(self, to: str, function: str, args: dict, event: Optional[dict]) -> dict:
+        """Mine a block holding one transaction and return its receipt."""
+        if self.block_time:
+            time.sleep(self.block_time)
+        with self._lock:
+            number = len(self.blocks) + 1
+            tx_hash = Web3.keccak(text=f"{number}:{to}:{function}:{json.dumps(args, sort_keys=True)}:{time.time_ns()}").hex()
+            timestamp = int(time.time())
+            logs = []
+            if event:
+                logs.append({
+                    "address": to,
+                    "event": event["name"],
+                    "args": event["args"],
+                    "blockNumber": number,
+                    "transactionHash": tx_hash,
+                    "logIndex": 0,
+                })
+            self.blocks.append({
+                "number": number,
+                "timestamp": timestamp,
+                "transactions": [{
+                    "hash": tx_hash,
+                    "from": LOCAL_ACCOUNT,
+                    "to": to,
+                    "function": function,
+                    "args": args,
+                    "status": 1,
+                    "gasUsed": LOCAL_GAS_USED,
+                    "logs": logs,
+                }],
+            })
+            self.save()
+        return {"transactionHash": tx_hash, "blockNumber": number, "gasUsed": LOCAL_GAS_USED, "timestamp": timestamp}
+
+    # ---- FaceAuthCommitment ----
+
+    def set_face_commitment(self, commitment_hex: str) -> str:
+        commitment = Web3.to_bytes(hexstr=commitment_hex).rjust(32, b"\x00").hex()
+        self.face_commitments[LOCAL_ACCOUNT] = commitment
+        receipt = self._transact(
+            FACE_AUTH_ADDRESS, "setCommitment", {"commitment": commitment},
+            {"name": "CommitmentSet", "args": {"user": LOCAL_ACCOUNT, "commitment": commitment}}
+        )
+        return receipt["transactionHash"]
+
+    def get_face_commitment(self, wallet_address: str) -> str:
+        return self.face_commitments.get(wallet_address.lower(), ZERO_BYTES32.hex())
+
+    # ---- GlobalIdentityCommitment ----
+
+    def set_global_commitment_hash(self, commitment_hash: bytes) -> dict:
+        commitment = bytes(commitment_hash).hex()
+        self.global_commitment = commitment
+        receipt = self._transact(
+            IDENTITY_DOC_ADDRESS, "setGlobalCommitment", {"_commitment": commitment},
+            {"name": "GlobalCommitmentSet", "args": {"commitmentHash": commitment, "timestamp": int(time.time())}}
+        )
+        return {
+            "success": True,
+            "transaction_hash": receipt["transactionHash"],
+            "block_number": receipt["blockNumber"],
+            "gas_used": receipt["gasUsed"],
+            "commitment_hash": commitment,
+        }
+
+    def set_identity_commitment(self, ipfs_cid: str) -> dict:
+        result = self.set_global_commitment_hash(Web3.keccak(text=ipfs_cid))
+        result["ipfs_cid"] = ipfs_cid
+        return result
+
+    def get_identity_commitment(self) -> str:
+        return self.global_commitment
+
+    def verify_identity_commitment(self, ipfs_cid: str) -> bool:
+        return self.global_commitment == Web3.keccak(text=ipfs_cid).hex()
+
+    # ---- Log access for indexers ----
+
+    def get_logs(self, from_block: int, to_block: int, address: Optional[str] = None) -> List[dict]:
+        logs = []
+        for block in self.blocks[max(0, from_block - 1):to_block]:
+            for tx in block["transactions"]:
+                for log in tx["logs"]:
+                    if address is None or log["address"].lower() == address.lower():
+                        logs.append({**log, "timestamp": block["timestamp"]})
+        return logs
+
+
+# Global instance, used by the services when CHAIN_BACKEND=local
+local_chain = LocalChain()
@@ -0,0 +1,195 @@
+"""
+Offline sweep for the same face enrolled under several wallets.
+
+    python -m app.dedup_sweep --run-dir runs/dedup-2026-10 --threshold 0.6
+    python -m app.dedup_sweep --run-dir runs/dedup-2026-10 --memory-mb 4096
+
+The gallery (single store, local shards or shard servers, as configured for
+the API) is exported once into <run-dir>/gallery.npy, a memory-mapped float32
+matrix of unit vectors, with the user_ids in ids.json. Cosine similarities are
+then computed block by block over the upper triangle of the N x N matrix with
+BLAS matrix products (multi-threaded; OMP_NUM_THREADS/OPENBLAS_NUM_THREADS
+set the thread count). The block size is derived from --memory-mb, so memory
+stays flat whatever the gallery size.
+
+Every pair at or above the threshold is appended to pairs.jsonl together with
+the wallets bound to each user_id. state.json is rewritten after each row of
+blocks, so a rerun with the same --run-dir resumes where it stopped; pairs
+written after the last checkpoint are dropped and recomputed.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+SIM_THRESHOLD = float(os.getenv("SIM_THRESHOLD", "0.6"))
+
+EXPORT_CHUNK = 16384
+
+
+def block_size_for(memory_mb: float, dim: int) -> int:
+    """
+    Largest square block whose working set fits the budget: two blocks of
+    vectors (8 * dim bytes per row) plus the float32 score tile and its
+    boolean mask (5 bytes per cell).
+    """
+    budget = memory_mb * 1024 * 1024
+    b = (-8 * dim + (64 * dim * dim + 20 * budget) ** 0.5) / 10
+    return max(256, int(b) // 256 * 256)
+
+
+def _write_json(path: str, data: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def export_gallery(store, run_dir: str) -> int:
+    """Copy every stored vector into run_dir/gallery.npy (unit rows) and ids.json."""
+    shards = getattr(store, "shards", None) or [store]
+    sizes = [len(shard) for shard in shards]
+    total = sum(sizes)
+    gallery = np.lib.format.open_memmap(
+        os.path.join(run_dir, "gallery.npy"), mode="w+", dtype=np.float32, shape=(total, store.dim)
+    )
+    ids: List[str] = []
+    for shard, size in zip(shards, sizes):
+        for start in range(0, size, EXPORT_CHUNK):
+            chunk_ids, vecs = shard.export_vectors(start, EXPORT_CHUNK)
+            vecs = np.asarray(vecs, dtype=np.float32)
+            vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+            gallery[len(ids):len(ids) + len(chunk_ids)] = vecs
+            ids.extend(chunk_ids)
+    if len(ids) != total:
+        # A shard changed size mid-export; the rows past len(ids) would be garbage
+        raise RuntimeError(f"Gallery changed during export ({len(ids)} of {total} vectors); rerun the sweep")
+    gallery.flush()
+    del gallery
+    with open(os.path.join(run_dir, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    return total
+
+
+def wallets_by_user(wallets: Dict[str, dict]) -> Dict[str, List[str]]:
+    by_user: Dict[str, List[str]] = {}
+    for wallet, rec in wallets.items():
+        if rec.get("user_id"):
+            by_user.setdefault(rec["user_id"], []).append(wallet)
+    return by_user
+
+
+def sweep_row(gallery: np.ndarray, i: int, block: int, threshold: float) -> List[tuple]:
+    """(row, col, score) for every pair in row block i with col > row and score >= threshold."""
+    n = gallery.shape[0]
+    r0, r1 = i * block, min(n, (i + 1) * block)
+    rows = np.ascontiguousarray(gallery[r0:r1])
+    found = []
+    for c0 in range(r0, n, block):
+        c1 = min(n, c0 + block)
+        cols = rows if c0 == r0 else np.ascontiguousarray(gallery[c0:c1])
+        scores = rows @ cols.T
+        ri, ci = np.nonzero(scores >= threshold)
+        if c0 == r0:
+            keep = ci > ri  # diagonal tile: upper triangle only, no self-pairs
+            ri, ci = ri[keep], ci[keep]
+        found.extend(zip((ri + r0).tolist(), (ci + c0).tolist(), scores[ri, ci].tolist()))
+    return found
+
+
+def run(args) -> dict:
+    os.makedirs(args.run_dir, exist_ok=True)
+    state_path = os.path.join(args.run_dir, "state.json")
+    pairs_path = os.path.join(args.run_dir, "pairs.jsonl")
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state["threshold"] != args.threshold:
+            raise SystemExit(f"{args.run_dir} was started with --threshold {state['threshold']}; use a new --run-dir")
+
+    from app.sharded_storage import open_vector_store
+
+    store = open_vector_store(dim=512, use_cosine=True)
+    started = time.perf_counter()
+    if not state.get("exported"):
+        t0 = time.perf_counter()
+        total = export_gallery(store, args.run_dir)
+        state = {
+            "threshold": args.threshold,
+            "exported": total,
+            "export_seconds": round(time.perf_counter() - t0, 1),
+            "block": block_size_for(args.memory_mb, store.dim),
+            "next_block": 0,
+            "pairs_bytes": 0,
+            "pairs": 0,
+        }
+        _write_json(state_path, state)
+        print(f"✅ Exported {total} vectors in {state['export_seconds']}s")
+    elif block_size_for(args.memory_mb, store.dim) != state["block"]:
+        print(f"⚠️ Resuming with the run's block size {state['block']}; --memory-mb is ignored")
+
+    gallery = np.load(os.path.join(args.run_dir, "gallery.npy"), mmap_mode="r")
+    with open(os.path.join(args.run_dir, "ids.json"), "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    owners = wallets_by_user(store.wallets)
+    block = state["block"]
+    blocks = (len(ids) + block - 1) // block
+    if state["next_block"]:
+        print(f"Resuming at block row {state['next_block']}/{blocks}")
+
+    with open(pairs_path, "a+b") as out:
+        # Drop anything written after the last checkpoint
+        out.truncate(state["pairs_bytes"])
+        out.seek(state["pairs_bytes"])
+        for i in range(state["next_block"], blocks):
+            t0 = time.perf_counter()
+            found = sweep_row(gallery, i, block, args.threshold)
+            for row, col, score in found:
+                a, b = ids[row], ids[col]
+                out.write((json.dumps({
+                    "user_a": a,
+                    "user_b": b,
+                    "score": round(score, 4),
+                    "wallets_a": owners.get(a, []),
+                    "wallets_b": owners.get(b, []),
+                }) + "\n").encode("utf-8"))
+            out.flush()
+            os.fsync(out.fileno())
+            state.update({"next_block": i + 1, "pairs_bytes": out.tell(), "pairs": state["pairs"] + len(found)})
+            _write_json(state_path, state)
+            print(f"[block row {i + 1}/{blocks}] {len(found)} pairs in {time.perf_counter() - t0:.1f}s "
+                  f"(total {state['pairs']})")
+
+    n = len(ids)
+    report = {
+        "vectors": n,
+        "threshold": args.threshold,
+        "block": block,
+        "comparisons": n * (n - 1) // 2,
+        "pairs": state["pairs"],
+        "wall_seconds": round(time.perf_counter() - started, 1),
+        "pairs_file": pairs_path,
+    }
+    _write_json(os.path.join(args.run_dir, "report.json"), report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-identical faces across the whole gallery")
+    parser.add_argument("--run-dir", required=True, help="Directory for the exported gallery, state and pairs")
+    parser.add_argument("--threshold", type=float, default=SIM_THRESHOLD, help="Cosine similarity for a duplicate")
+    parser.add_argument("--memory-mb", type=float, default=1024, help="Budget for the working blocks")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
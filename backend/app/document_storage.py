@@ -1,11 +1,16 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 import json
 import os
+import threading
+
+DOCUMENTS_DB = "documents_db.json"
 
 class DocumentStorage:
-    def __init__(self, storage_file: str = "documents_db.json"):
+    def __init__(self, storage_file: str = DOCUMENTS_DB):
         self.storage_file = storage_file
         self.documents: Dict[str, List[dict]] = {}
+        # Held by writers so a save never serialises a half-updated dict
+        self.lock = threading.RLock()
         self.load()
     
     def load(self):
@@ -21,36 +26,47 @@ class DocumentStorage:
     def save(self):
         """Save documents to file."""
         try:
-            with open(self.storage_file, 'w') as f:
+            # Write-then-rename so a crash mid-save never truncates the store
+            tmp = self.storage_file + ".tmp"
+            with self.lock, open(tmp, 'w') as f:
                 json.dump(self.documents, f, indent=2)
+            os.replace(tmp, self.storage_file)
         except Exception as e:
             print(f"Error saving documents: {e}")
     
-    def add_document(self, wallet: str, doc_data: dict):
+    def add_document(self, wallet: str, doc_data: dict, persist: bool = True):
         """Add a document for a wallet."""
         wallet = wallet.lower()
-        if wallet not in self.documents:
-            self.documents[wallet] = []
-        
-        self.documents[wallet].append(doc_data)
-        self.save()
+        with self.lock:
+            self.documents.setdefault(wallet, []).append(doc_data)
+        if persist:
+            self.save()
     
     def get_documents(self, wallet: str) -> List[dict]:
         """Get all documents for a wallet."""
         wallet = wallet.lower()
         return self.documents.get(wallet, [])
     
+    def find_document(self, ipfs_cid: str) -> Optional[dict]:
+        """Find a document record by its data CID across all wallets."""
+        for docs in self.documents.values():
+            for doc in docs:
+                if doc.get('ipfs_cid') == ipfs_cid:
+                    return doc
+        return None
+    
     def remove_document(self, wallet: str, ipfs_cid: str) -> bool:
         """Remove a specific document by CID."""
         wallet = wallet.lower()
         if wallet not in self.documents:
             return False
         
-        initial_len = len(self.documents[wallet])
-        self.documents[wallet] = [
-            doc for doc in self.documents[wallet] 
-            if doc.get('ipfs_cid') != ipfs_cid
-        ]
+        with self.lock:
+            initial_len = len(self.documents[wallet])
+            self.documents[wallet] = [
+                doc for doc in self.documents[wallet] 
+                if doc.get('ipfs_cid') != ipfs_cid
+            ]
         
         if len(self.documents[wallet]) < initial_len:
             self.save()
@@ -0,0 +1,232 @@
+import os
+import queue
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from email.message import EmailMessage
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+
+load_dotenv()
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_USER = os.getenv("SMTP_USER") or os.getenv("GMAIL")
+SMTP_PASS = os.getenv("SMTP_PASS") or os.getenv("MAIL_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM") or SMTP_USER or "no-reply@localhost"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))
+# Sessions idle longer than this are probed with NOOP before reuse
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+OUTBOX_MAX_QUEUE = int(os.getenv("OUTBOX_MAX_QUEUE", "1000"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "1"))
+OUTBOX_STATUS_ENTRIES = 10000
+
+# Connection-level failures: drop the session and retry
+_TRANSIENT = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.error, TimeoutError)
+
+
+class OutboxFull(Exception):
+    pass
+
+
+class SMTPSession:
+    """One authenticated SMTP connection, opened lazily and reused."""
+
+    def __init__(self, host: str, port: int, user: Optional[str], password: Optional[str], starttls: bool):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        start = time.perf_counter()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            smtp.starttls()
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        self._smtp = smtp
+        metrics.incr("email.smtp_connects")
+        metrics.observe("email.smtp_connect", time.perf_counter() - start)
+
+    def _alive(self) -> bool:
+        if self._smtp is None:
+            return False
+        if time.time() - self._last_used < SMTP_IDLE_SECONDS:
+            return True
+        try:
+            return self._smtp.noop()[0] == 250
+        except _TRANSIENT + (smtplib.SMTPException,):
+            return False
+
+    def send(self, msg: EmailMessage):
+        if not self._alive():
+            self.close()
+            self._connect()
+        self._smtp.send_message(msg)
+        self._last_used = time.time()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class EmailOutbox:
+    """
+    Background email sender. enqueue() returns as soon as the message is
+    queued; a small pool of threads, each holding one persistent SMTP
+    session, delivers it with exponential backoff on transient failures.
+
+    The queue and the delivery status are in memory, per process: status()
+    only knows messages this process queued, and both are lost on restart.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = SMTP_POOL_SIZE,
+        max_queue: int = OUTBOX_MAX_QUEUE,
+        max_retries: int = OUTBOX_MAX_RETRIES,
+        backoff: float = OUTBOX_BACKOFF_SECONDS,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        user: Optional[str] = SMTP_USER,
+        password: Optional[str] = SMTP_PASS,
+        starttls: bool = SMTP_STARTTLS,
+        sender: str = SMTP_FROM
+    ):
+        self.pool_size = pool_size
+        self.max_retries = max(1, max_retries)  # at least the first attempt
+        self.backoff = backoff
+        self.sender = sender
+        self._session_args = (host, port, user, password, starttls)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._status: "OrderedDict[str, dict]" = OrderedDict()
+        self._status_lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            for i in range(self.pool_size):
+                t = threading.Thread(target=self._worker, name=f"email-outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started = True
+
+    def _set_status(self, message_id: str, **fields):
+        with self._status_lock:
+            entry = self._status.setdefault(message_id, {})
+            entry.update(fields)
+            self._status.move_to_end(message_id)
+            while len(self._status) > OUTBOX_STATUS_ENTRIES:
+                self._status.popitem(last=False)
+
+    def enqueue(self, to: str, subject: str, body: str) -> str:
+        """Queue a plain-text email; raises OutboxFull when the queue is at capacity."""
+        self._start()
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = to
+        msg["Subject"] = subject
+        msg.set_content(body)
+
+        message_id = uuid.uuid4().hex
+        # Recorded first: a worker can pick the message up and mark it sent
+        # before put_nowait() returns
+        self._set_status(message_id, status="queued", attempts=0)
+        try:
+            self._queue.put_nowait((message_id, msg, time.perf_counter()))
+        except queue.Full:
+            with self._status_lock:
+                self._status.pop(message_id, None)
+            metrics.incr("email.rejected")
+            raise OutboxFull("Email outbox is full")
+        metrics.incr("email.queued")
+        metrics.set_gauge("email.queue_depth", self._queue.qsize())
+        return message_id
+
+    def status(self, message_id: str) -> Optional[dict]:
+        with self._status_lock:
+            entry = self._status.get(message_id)
+            return dict(entry) if entry else None
+
+    def _worker(self):
+        session = SMTPSession(*self._session_args)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                session.close()
+                return
+            message_id, msg, enqueued = item
+            metrics.observe("email.queue_wait", time.perf_counter() - enqueued)
+            self._deliver(session, message_id, msg)
+            metrics.set_gauge("email.queue_depth", self._queue.qsize())
+
+    def _deliver(self, session: SMTPSession, message_id: str, msg: EmailMessage):
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                session.send(msg)
+                metrics.observe("email.send", time.perf_counter() - start)
+                metrics.incr("email.sent")
+                self._set_status(message_id, status="sent", attempts=attempt)
+                return
+            except smtplib.SMTPResponseException as e:
+                # 5xx is permanent (bad recipient, rejected content); 4xx is worth retrying
+                if e.smtp_code >= 500:
+                    self._fail(message_id, attempt, f"{e.smtp_code} {e.smtp_error!r}")
+                    return
+                error = f"{e.smtp_code} {e.smtp_error!r}"
+            except smtplib.SMTPRecipientsRefused as e:
+                self._fail(message_id, attempt, f"Recipients refused: {list(e.recipients)}")
+                return
+            except (smtplib.SMTPException,) + _TRANSIENT as e:
+                error = str(e)
+            session.close()
+            metrics.incr("email.retries")
+            self._set_status(message_id, status="retrying", attempts=attempt, error=error)
+            if attempt < self.max_retries:
+                delay = self.backoff * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay / 2))
+        self._fail(message_id, self.max_retries, error)
+
+    def _fail(self, message_id: str, attempts: int, error: str):
+        metrics.incr("email.failed")
+        self._set_status(message_id, status="failed", attempts=attempts, error=error)
+        print(f"❌ Email {message_id} failed after {attempts} attempt(s): {error}")
+
+    def close(self, timeout: float = 10.0):
+        """Let queued messages drain, then stop the workers and close sessions."""
+        if not self._started:
+            return
+        deadline = time.time() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.time()))
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+
+
+# Global instance
+email_outbox = EmailOutbox()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+
+load_dotenv()
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+EMBED_CACHE_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", "10"))
+EMBED_CACHE_MAX_HITS = int(os.getenv("EMBED_CACHE_MAX_HITS", "3"))
+EMBED_CACHE_MAX_DISTANCE = int(os.getenv("EMBED_CACHE_MAX_DISTANCE", "3"))  # bits out of 64
+EMBED_CACHE_PER_WALLET = 4
+
+
+def face_dhash(aligned) -> int:
+    """64-bit difference hash of an aligned face crop (tensor or array, CHW or HWC)."""
+    arr = aligned.detach().cpu().numpy() if hasattr(aligned, "detach") else np.asarray(aligned)
+    arr = arr.astype(np.float32)
+    if arr.ndim == 4:
+        arr = arr[0]
+    if arr.ndim == 3:
+        arr = arr.mean(axis=0) if arr.shape[0] in (1, 3) else arr.mean(axis=2)
+    small = cv2.resize(arr, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def frame_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Short-lived per-wallet cache of (embedding, liveness) for face frames.
+
+    A new frame reuses an entry when its aligned-crop dHash is within
+    max_distance bits of one computed for the same wallet in the last ttl
+    seconds. To keep it from becoming a replay path:
+      - only frames that passed liveness are stored;
+      - the TTL runs from the original computation and is never extended;
+      - an entry serves at most max_hits frames, then must be recomputed;
+      - a byte-identical resubmission of a frame is never served from cache
+        (real camera frames differ in sensor noise; exact copies are replays).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = EMBED_CACHE_ENABLED,
+        ttl: float = EMBED_CACHE_TTL_SECONDS,
+        max_hits: int = EMBED_CACHE_MAX_HITS,
+        max_distance: int = EMBED_CACHE_MAX_DISTANCE,
+        per_wallet: int = EMBED_CACHE_PER_WALLET
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_hits = max_hits
+        self.max_distance = max_distance
+        self.per_wallet = per_wallet
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[dict]] = {}
+
+    def _live_entries(self, wallet: str, now: float) -> List[dict]:
+        entries = [e for e in self._entries.get(wallet, []) if now - e["created"] <= self.ttl and e["hits"] < self.max_hits]
+        if entries:
+            self._entries[wallet] = entries
+        else:
+            self._entries.pop(wallet, None)
+        return entries
+
+    def get(self, wallet: str, phash: int, digest: str) -> Optional[dict]:
+        """Cached {'embedding', 'liveness'} for a near-identical recent frame, or None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            best = None
+            for entry in self._live_entries(wallet, now):
+                if digest in entry["digests"]:
+                    metrics.incr("embed_cache.replays_refused")
+                    return None
+                distance = bin(entry["phash"] ^ phash).count("1")
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, entry)
+            if best is None:
+                metrics.incr("embed_cache.misses")
+                return None
+            entry = best[1]
+            entry["hits"] += 1
+            entry["digests"].add(digest)
+        metrics.incr("embed_cache.hits")
+        metrics.incr("embed_cache.saved_seconds", entry["cost"])
+        return {"embedding": entry["embedding"], "liveness": entry["liveness"]}
+
+    def put(self, wallet: str, phash: int, digest: str, embedding: np.ndarray, liveness: dict, cost: float):
+        """Store a freshly computed result; frames that failed liveness are ignored."""
+        if not self.enabled or not liveness.get("is_live"):
+            return
+        now = time.time()
+        with self._lock:
+            entries = self._live_entries(wallet, now)
+            entries.append({
+                "phash": phash,
+                "digests": {digest},
+                "embedding": embedding,
+                "liveness": liveness,
+                "cost": cost,
+                "created": now,
+                "hits": 0,
+            })
+            self._entries[wallet] = entries[-self.per_wallet:]
+            metrics.set_gauge("embed_cache.wallets", len(self._entries))
+
+    def invalidate(self, wallet: str):
+        with self._lock:
+            self._entries.pop(wallet, None)
+
+
+# Global instance
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,308 @@
+"""
+Envelope encryption: one random data key (DEK) per object, wrapped with a
+versioned key-encryption key (KEK).
+
+    cipher, key = keyring.new_data_key()
+    cid = upload_stream_to_ipfs(src, cipher=cipher)
+    record["key"] = key                  # {"kek": "v2", "wrapped": "<hex>"}
+    ...
+    stream_from_ipfs(cid, key=record["key"])
+
+Only the 40-byte wrapped key depends on the KEK, so rotating a KEK means
+re-wrapping keys in the local records, not re-encrypting and re-pinning
+document bodies. Wrapping is AES key wrap (RFC 3394), which authenticates
+the wrapped key.
+
+KEKs come from KEK_KEYS ("v1:<hex>,v2:<hex>") and must differ from AES_KEY,
+which stays a data-encryption key only. New keys are wrapped with KEK_ACTIVE
+(default: the last one in KEK_KEYS). Keys wrapped under AES_KEY by earlier
+releases are listed as KEK "v0" and can still be unwrapped (never wrapped)
+while KEK_ALLOW_V0 is true.
+
+To rotate: add a version, make it active and restart; then run
+`python -m app.envelope rotate` with the API stopped, or set
+KEK_ROTATE_ON_START=true to re-wrap inside the API. Drop the old version
+once rotation reports nothing left on it.
+
+Objects stored before envelope encryption have no key field and are
+encrypted directly under AES_KEY. `python -m app.envelope migrate-legacy`
+gives each a wrapped key: document and image bodies get AES_KEY itself as
+their (wrapped) data key, so CIDs and on-chain commitments are unchanged,
+and e-mails are re-encrypted under fresh data keys. Once it reports nothing
+left, no read falls back to AES_KEY, v0 can be disabled and AES_KEY can
+be retired as a decryption key (it still keys the image archive's content
+hashes).
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap, aes_key_wrap, InvalidUnwrap
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+
+load_dotenv()
+KEK_KEYS = os.getenv("KEK_KEYS", "")
+KEK_ACTIVE = os.getenv("KEK_ACTIVE", "")
+KEK_ALLOW_V0 = os.getenv("KEK_ALLOW_V0", "true").lower() in ("1", "true", "yes")
+KEK_ROTATE_ON_START = os.getenv("KEK_ROTATE_ON_START", "false").lower() in ("1", "true", "yes")
+LEGACY_KEK = "v0"  # AES_KEY, as used for wrapping by earlier releases; unwrap only
+DATA_KEY_BYTES = 32
+
+# doc_store fields holding wrapped keys (document body, verified email);
+# archived images keep theirs in the image_archive entry
+ENVELOPE_FIELDS = ("key", "email_key")
+
+
+def _parse_keks(spec: str) -> Dict[str, bytes]:
+    keks = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        version, _, hex_key = item.partition(":")
+        kek = bytes.fromhex(hex_key)
+        if len(kek) not in (16, 24, 32):
+            raise ValueError(f"KEK {version} must be 16, 24 or 32 bytes")
+        keks[version] = kek
+    return keks
+
+
+class KeyRing:
+    def __init__(self, keks: Dict[str, bytes], active: Optional[str] = None, unwrap_only: Dict[str, bytes] = None):
+        if not keks:
+            raise ValueError("At least one KEK is required")
+        self.keks = {**(unwrap_only or {}), **keks}
+        self.active = active or list(keks)[-1]
+        if self.active not in keks:
+            raise ValueError(f"Active KEK {self.active} is not configured")
+
+    @classmethod
+    def from_env(cls) -> "KeyRing":
+        keks = _parse_keks(KEK_KEYS)
+        if not keks:
+            raise ValueError("KEK_KEYS is not set; envelope encryption needs a KEK of its own (python -m app.envelope new-kek)")
+        aes_key = bytes.fromhex(os.getenv("AES_KEY"))
+        if LEGACY_KEK in keks or any(kek == aes_key for kek in keks.values()):
+            raise ValueError(f"KEK_KEYS must not reuse AES_KEY or the reserved version {LEGACY_KEK}")
+        return cls(keks, KEK_ACTIVE or None, {LEGACY_KEK: aes_key} if KEK_ALLOW_V0 else None)
+
+    def wrap(self, data_key: bytes) -> dict:
+        return {"kek": self.active, "wrapped": aes_key_wrap(self.keks[self.active], data_key).hex()}
+
+    def unwrap(self, key: dict) -> bytes:
+        kek = self.keks.get(key["kek"])
+        if kek is None:
+            raise ValueError(f"KEK {key['kek']} is not configured")
+        try:
+            return aes_key_unwrap(kek, bytes.fromhex(key["wrapped"]))
+        except InvalidUnwrap:
+            raise ValueError(f"Wrapped key does not match KEK {key['kek']}")
+
+    def new_data_key(self) -> Tuple[AESGCM, dict]:
+        """A fresh DEK as a cipher, and its wrapped form to store with the object."""
+        data_key = os.urandom(DATA_KEY_BYTES)
+        metrics.incr("envelope.data_keys")
+        return AESGCM(data_key), self.wrap(data_key)
+
+    def cipher_for(self, key: dict) -> AESGCM:
+        return AESGCM(self.unwrap(key))
+
+    def rewrap(self, key: dict) -> dict:
+        """The same DEK wrapped with the active KEK."""
+        return self.wrap(self.unwrap(key))
+
+
+# Global instance, built on first use: importing this module (e.g. for the
+# new-kek command) must work before KEK_KEYS is configured
+_keyring: Optional[KeyRing] = None
+_keyring_lock = threading.Lock()
+
+
+def get_keyring() -> KeyRing:
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = KeyRing.from_env()
+    return _keyring
+
+
+def __getattr__(name: str):
+    # `from app.envelope import keyring` builds the ring at that point
+    if name == "keyring":
+        return get_keyring()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ==================== ROTATION ====================
+
+def _wrapped_keys(doc_store, image_archive) -> Iterator[Tuple[dict, str]]:
+    """Every (record, field) that holds a wrapped key."""
+    for docs in list(doc_store.documents.values()):
+        for doc in docs:
+            for field in ENVELOPE_FIELDS:
+                if isinstance(doc.get(field), dict):
+                    yield doc, field
+    for entry in list(image_archive.entries.values()):
+        if isinstance(entry.get("key"), dict):
+            yield entry, "key"
+
+
+def _legacy_records(doc_store, image_archive) -> Iterator[Tuple[dict, str]]:
+    """Every (record, field) whose object is encrypted directly under AES_KEY."""
+    for docs in list(doc_store.documents.values()):
+        for doc in docs:
+            if doc.get("ipfs_cid") and "key" not in doc:
+                yield doc, "key"
+            if doc.get("email_enc") and "email_key" not in doc:
+                yield doc, "email_key"
+    for entry in list(image_archive.entries.values()):
+        if "key" not in entry:
+            yield entry, "key"
+
+
+def _apply(doc_store, image_archive, updates: List[Tuple[dict, dict]]):
+    """Apply record updates under the stores' locks and save, so live writers are not overwritten."""
+    with ExitStack() as held:
+        for store in (doc_store, image_archive):
+            lock = getattr(store, "lock", None)
+            if lock is not None:
+                held.enter_context(lock)
+        for rec, changes in updates:
+            rec.update(changes)
+        doc_store.save()
+        image_archive.save()
+
+
+def rotate(doc_store, image_archive, ring: KeyRing = None, workers: int = 8, batch: int = 1000) -> dict:
+    """
+    Re-wrap every data key not on the active KEK.
+
+    Each batch is applied under the stores' locks and saved, so this can run
+    inside the API (KEK_ROTATE_ON_START) next to live writes. As a separate
+    process it must run with the API stopped, since both save the same JSON
+    files. Each key records its KEK version, so an interrupted run simply
+    continues with what is still on an old version.
+    """
+    ring = ring or get_keyring()
+    start = time.perf_counter()
+    before = Counter(rec[field]["kek"] for rec, field in _wrapped_keys(doc_store, image_archive))
+    pending = [(rec, field) for rec, field in _wrapped_keys(doc_store, image_archive) if rec[field]["kek"] != ring.active]
+    failed: List[str] = []
+    rewrapped = 0
+
+    def rewrap_one(item):
+        rec, field = item
+        old = rec[field]
+        try:
+            return old, ring.rewrap(old)
+        except ValueError as e:
+            return old, e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(pending), batch):
+            chunk = pending[offset:offset + batch]
+            updates = []
+            for (rec, field), (old, result) in zip(chunk, pool.map(rewrap_one, chunk)):
+                if isinstance(result, ValueError):
+                    failed.append(f"{rec.get('ipfs_cid') or rec.get('image_cid') or rec.get('doc_type')}/{field}: {result}")
+                    continue
+                if rec.get(field) is old:  # skip records changed since they were read
+                    updates.append((rec, {field: result}))
+            _apply(doc_store, image_archive, updates)
+            rewrapped += len(updates)
+            print(f"[{offset + len(chunk)}/{len(pending)}] {rewrapped} re-wrapped to {ring.active}, {len(failed)} failed")
+
+    metrics.incr("envelope.rewrapped", rewrapped)
+    after = Counter(rec[field]["kek"] for rec, field in _wrapped_keys(doc_store, image_archive))
+    return {
+        "active_kek": ring.active,
+        "before": dict(before),
+        "after": dict(after),
+        "rewrapped": rewrapped,
+        "failed": failed,
+        "legacy_unwrapped": sum(1 for _ in _legacy_records(doc_store, image_archive)),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def migrate_legacy(doc_store, image_archive, ring: KeyRing = None, batch: int = 1000) -> dict:
+    """
+    Give every object stored before envelope encryption a wrapped data key.
+    Same locking rules as rotate().
+    """
+    ring = ring or get_keyring()
+    start = time.perf_counter()
+    aes_key = bytes.fromhex(os.getenv("AES_KEY"))
+    legacy_cipher = AESGCM(aes_key)
+    pending = list(_legacy_records(doc_store, image_archive))
+    counts = Counter()
+    failed: List[str] = []
+
+    for offset in range(0, len(pending), batch):
+        updates = []
+        for rec, field in pending[offset:offset + batch]:
+            if field in rec:
+                continue
+            if field == "email_key":
+                # Small and local: re-encrypt under a fresh data key
+                try:
+                    raw = bytes.fromhex(rec["email_enc"])
+                    email = legacy_cipher.decrypt(raw[:12], raw[12:], None)
+                except Exception as e:
+                    failed.append(f"{rec.get('doc_type')}/email: {type(e).__name__}")
+                    continue
+                cipher, key = ring.new_data_key()
+                nonce = os.urandom(12)
+                updates.append((rec, {"email_enc": (nonce + cipher.encrypt(nonce, email, None)).hex(), "email_key": key}))
+                counts["emails"] += 1
+            else:
+                # Bodies stay as pinned (same CID); AES_KEY becomes their wrapped data key
+                updates.append((rec, {"key": ring.wrap(aes_key)}))
+                counts["images" if "image_cid" in rec else "documents"] += 1
+        _apply(doc_store, image_archive, updates)
+        print(f"[{min(offset + batch, len(pending))}/{len(pending)}] {sum(counts.values())} migrated, {len(failed)} failed")
+
+    metrics.incr("envelope.legacy_migrated", sum(counts.values()))
+    return {
+        "active_kek": ring.active,
+        "migrated": dict(counts),
+        "failed": failed,
+        "legacy_left": sum(1 for _ in _legacy_records(doc_store, image_archive)),
+        "on_v0": sum(1 for rec, field in _wrapped_keys(doc_store, image_archive) if rec[field]["kek"] == LEGACY_KEK),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Envelope key management")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rot = sub.add_parser("rotate", help="Re-wrap all data keys with the active KEK")
+    rot.add_argument("--workers", type=int, default=8)
+    rot.add_argument("--batch", type=int, default=1000, help="Records re-wrapped between saves")
+    mig = sub.add_parser("migrate-legacy", help="Give objects stored under AES_KEY a wrapped data key")
+    mig.add_argument("--batch", type=int, default=1000)
+    sub.add_parser("new-kek", help="Print a random KEK for KEK_KEYS")
+    args = parser.parse_args()
+
+    if args.command == "new-kek":
+        print(os.urandom(32).hex())
+        return
+
+    from app.document_storage import doc_store
+    from app.image_archive import image_archive
+
+    if args.command == "migrate-legacy":
+        print(json.dumps(migrate_legacy(doc_store, image_archive, batch=args.batch), indent=2))
+    else:
+        print(json.dumps(rotate(doc_store, image_archive, workers=args.workers, batch=args.batch), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Single-shot ONNX face detector (YuNet layout) run through onnxruntime.
+
+Replaces the facenet-pytorch MTCNN cascade (image pyramid, three networks,
+Python-level NMS per stage) with one forward pass at a fixed input size,
+NumPy decoding of the anchor-free outputs, a vectorised NMS, and an
+OpenCV crop that reproduces MTCNN's box + margin so embeddings stay
+comparable with existing enrollments.
+
+The model is produced by ModelConverter.face_detector_to_onnx().
+"""
+import os
+from typing import Tuple
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.runtime_config import ort_session_options
+
+load_dotenv()
+FACE_DETECTOR_MODEL = os.getenv("FACE_DETECTOR_MODEL", os.path.join("models", "face_detector.onnx"))
+FACE_DETECTOR_INPUT = int(os.getenv("FACE_DETECTOR_INPUT", "640"))
+FACE_DETECTOR_SCORE = float(os.getenv("FACE_DETECTOR_SCORE", "0.7"))
+FACE_DETECTOR_NMS = float(os.getenv("FACE_DETECTOR_NMS", "0.3"))
+
+STRIDES = (8, 16, 32)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Indices kept by greedy NMS; IoU against all remaining boxes is computed at once."""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    x0, y0, x1, y1 = boxes.T
+    areas = np.maximum(0, x1 - x0) * np.maximum(0, y1 - y0)
+    order = np.argsort(-scores)
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(0, np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]))
+        h = np.maximum(0, np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]))
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def _priors(size: int):
+    """Grid cell (col, row) and stride for every output row, per stride level."""
+    grids = []
+    for stride in STRIDES:
+        cells = size // stride
+        rows, cols = np.mgrid[0:cells, 0:cells]
+        grids.append((np.stack([cols.ravel(), rows.ravel()], axis=1).astype(np.float32), stride))
+    return grids
+
+
+def align_crop(image_bgr: np.ndarray, box, image_size: int = 160, margin: int = 20) -> np.ndarray:
+    """
+    Crop the way facenet-pytorch MTCNN.extract does (margin scaled to the
+    output size, area resize, fixed_image_standardization); RGB CHW float32.
+    """
+    h, w = image_bgr.shape[:2]
+    x0, y0, x1, y1 = [float(v) for v in box[:4]]
+    mx = margin * (x1 - x0) / (image_size - margin)
+    my = margin * (y1 - y0) / (image_size - margin)
+    x0, y0 = int(max(x0 - mx / 2, 0)), int(max(y0 - my / 2, 0))
+    x1, y1 = int(min(x1 + mx / 2, w)), int(min(y1 + my / 2, h))
+    crop = image_bgr[y0:y1, x0:x1]
+    crop = cv2.resize(crop, (image_size, image_size), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB).astype(np.float32)
+    return ((rgb - 127.5) / 128.0).transpose(2, 0, 1)
+
+
+class ONNXFaceDetector:
+    """Face boxes, scores and 5-point landmarks from one ONNX forward pass."""
+
+    def __init__(
+        self,
+        model_path: str = FACE_DETECTOR_MODEL,
+        input_size: int = FACE_DETECTOR_INPUT,
+        score_threshold: float = FACE_DETECTOR_SCORE,
+        nms_threshold: float = FACE_DETECTOR_NMS,
+        device: str = "cpu"
+    ):
+        import onnxruntime as ort
+
+        if input_size % 32:
+            raise ValueError("Detector input size must be a multiple of 32")
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        if device.startswith("cuda"):
+            device_id = int(device.split(":")[1]) if ":" in device else 0
+            providers = [("CUDAExecutionProvider", {"device_id": device_id}), "CPUExecutionProvider"]
+        else:
+            providers = ["CPUExecutionProvider"]
+        self.session = ort.InferenceSession(model_path, sess_options=ort_session_options(), providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        self._grids = _priors(input_size)
+
+    def _letterbox(self, image_bgr: np.ndarray) -> Tuple[np.ndarray, float]:
+        h, w = image_bgr.shape[:2]
+        scale = self.input_size / max(h, w)
+        resized = cv2.resize(image_bgr, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_LINEAR)
+        canvas = np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        # YuNet takes raw BGR 0-255, NCHW
+        blob = canvas.transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+        return blob, scale
+
+    def detect(self, image_bgr: np.ndarray):
+        """Returns (boxes Nx4 [x0, y0, x1, y1], scores N, landmarks Nx5x2) in input pixels."""
+        blob, scale = self._letterbox(image_bgr)
+        outputs = dict(zip(self.output_names, self.session.run(self.output_names, {self.input_name: blob})))
+
+        boxes, scores, landmarks = [], [], []
+        for cells, stride in self._grids:
+            cls = np.clip(outputs[f"cls_{stride}"][0, :, 0], 0, 1)
+            obj = np.clip(outputs[f"obj_{stride}"][0, :, 0], 0, 1)
+            score = np.sqrt(cls * obj)
+            mask = score >= self.score_threshold
+            if not mask.any():
+                continue
+            grid = cells[mask]
+            bbox = outputs[f"bbox_{stride}"][0][mask]
+            kps = outputs[f"kps_{stride}"][0][mask].reshape(-1, 5, 2)
+
+            centre = (grid + bbox[:, :2]) * stride
+            size = np.exp(bbox[:, 2:4]) * stride
+            boxes.append(np.concatenate([centre - size / 2, centre + size / 2], axis=1))
+            landmarks.append((kps + grid[:, np.newaxis, :]) * stride)
+            scores.append(score[mask])
+
+        if not boxes:
+            return np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty((0, 5, 2), np.float32)
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores)
+        landmarks = np.concatenate(landmarks)
+        keep = nms(boxes, scores, self.nms_threshold)
+        return boxes[keep] / scale, scores[keep], landmarks[keep] / scale
+
+    def detect_and_crop(self, image_bgr: np.ndarray):
+        """Most confident face: (aligned CHW float32, box, score, landmarks) or (None, None, 0.0, None)."""
+        boxes, scores, landmarks = self.detect(image_bgr)
+        if len(boxes) == 0:
+            return None, None, 0.0, None
+        best = int(np.argmax(scores))
+        box = boxes[best]
+        return align_crop(image_bgr, box), box.tolist(), float(scores[best]), landmarks[best]
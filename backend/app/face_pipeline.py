@@ -1,4 +1,5 @@
 from typing import Optional
+from app.runtime_config import apply_runtime_config, resolve_device, ort_session_options
 import numpy as np
 import torch
 from PIL import Image
@@ -6,8 +7,15 @@ import cv2
 from deepface import DeepFace
 import platform
 import os
+import time
 from facenet_pytorch import MTCNN, InceptionResnetV1
 
+from app.metrics import metrics
+from app.model_registry import ModelRegistry
+from app.face_quality import assess_face_quality
+
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "mtcnn").lower()  # mtcnn | onnx
+
 
 class FacePipeline:
     """
@@ -16,47 +24,181 @@ class FacePipeline:
     - CUDA GPU → TensorRT (.trt file) - 40% faster
     - Otherwise → ONNX (.onnx file) - portable
     - Fallback → PyTorch model
+    Artefacts in models/registry.json are preferred when they match this
+    GPU/toolchain and passed the parity check.
     """
 
-    def __init__(self, device: str = "cpu", model_dir: str = "./models"):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, device: str = "auto", model_dir: str = "./models"):
+        self.runtime = apply_runtime_config()
+        self.device = resolve_device(device)
         self.platform = platform.system()
         self.model_dir = model_dir
+        self.load_timings = {}
+        self.warmup_timings = {}
+        self.warmed_up = False
         
-        self.mtcnn = MTCNN(image_size=160, margin=20, post_process=True, device=self.device)
+        # Face detector: single-shot ONNX model when configured and present,
+        # otherwise the facenet-pytorch MTCNN cascade
+        start = time.perf_counter()
+        self.detector = None
+        self.mtcnn = None
+        if FACE_DETECTOR == "onnx":
+            from app.face_detector import ONNXFaceDetector, FACE_DETECTOR_MODEL
+            if os.path.exists(FACE_DETECTOR_MODEL):
+                self.detector = ONNXFaceDetector(FACE_DETECTOR_MODEL, device=self.device)
+                # Crops differ from MTCNN's; embeddings enrolled with MTCNN only
+                # stay comparable if the detector parity check passed
+                if not ModelRegistry(os.path.dirname(FACE_DETECTOR_MODEL) or ".").parity_passed(FACE_DETECTOR_MODEL):
+                    print(
+                        f"⚠️ {FACE_DETECTOR_MODEL} has no passed parity check against MTCNN; "
+                        "faces enrolled with MTCNN may need re-enrollment (ModelConverter.face_detector_parity)"
+                    )
+            else:
+                print(f"⚠️ {FACE_DETECTOR_MODEL} not found; falling back to MTCNN")
+        if self.detector is None:
+            self.mtcnn = MTCNN(image_size=160, margin=20, post_process=True, device=self.device)
+        self.detector_backend = "onnx" if self.detector is not None else "mtcnn"
+        self.load_timings[f"detector_{self.detector_backend}"] = time.perf_counter() - start
         
-        # Load embedder based on system
-        if self.device == "cuda" and os.path.exists(os.path.join(model_dir, "embedder_fp16.trt")):
+        start = time.perf_counter()
+        # Load embedder: best registered artefact for this device, else by file
+        # name for files the registry does not know (registered ones that were
+        # not returned failed or lack a parity check)
+        registry = ModelRegistry(model_dir)
+        self.artefact = registry.best_for("embedder", self.device)
+        registered = {a["file"] for a in registry.artefacts}
+        if self.artefact:
+            embedder_path = os.path.join(model_dir, self.artefact["file"])
+            embedder_format = self.artefact["format"]
+        elif (self.device.startswith("cuda") and "embedder_fp16.trt" not in registered
+              and os.path.exists(os.path.join(model_dir, "embedder_fp16.trt"))):
+            embedder_path, embedder_format = os.path.join(model_dir, "embedder_fp16.trt"), "tensorrt"
+        elif "embedder.onnx" not in registered and os.path.exists(os.path.join(model_dir, "embedder.onnx")):
+            embedder_path, embedder_format = os.path.join(model_dir, "embedder.onnx"), "onnx"
+        else:
+            embedder_path, embedder_format = None, "pytorch"
+
+        if embedder_format == "tensorrt":
             import tensorrt as trt
             import pycuda.driver as cuda
             import pycuda.autoinit
             
             logger = trt.Logger(trt.Logger.WARNING)
-            with open(os.path.join(model_dir, "embedder_fp16.trt"), "rb") as f:
+            with open(embedder_path, "rb") as f:
                 self.embedder = trt.Runtime(logger).deserialize_cuda_engine(f.read())
             
             self.backend = "tensorrt"
-            print(f"✅ TensorRT loaded (28ms)")
+            print(f"✅ TensorRT loaded: {os.path.basename(embedder_path)}")
         
-        elif os.path.exists(os.path.join(model_dir, "embedder.onnx")):
+        elif embedder_format == "onnx":
             import onnxruntime as ort
             
-            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if self.device == "cuda" else ['CPUExecutionProvider']
+            if self.device.startswith("cuda"):
+                device_id = int(self.device.split(":")[1]) if ":" in self.device else 0
+                providers = [('CUDAExecutionProvider', {'device_id': device_id}), 'CPUExecutionProvider']
+            else:
+                providers = ['CPUExecutionProvider']
             self.embedder = ort.InferenceSession(
-                os.path.join(model_dir, "embedder.onnx"),
+                embedder_path,
+                sess_options=ort_session_options(),
                 providers=providers
             )
             
             self.backend = "onnx"
-            print(f"✅ ONNX loaded (32ms)")
+            print(f"✅ ONNX loaded: {os.path.basename(embedder_path)}")
         
         else:
             self.embedder = InceptionResnetV1(pretrained="vggface2").eval().to(self.device)
             self.backend = "pytorch"
             print(f"✅ PyTorch loaded (40ms)")
+        self.load_timings[f"embedder_{self.backend}"] = time.perf_counter() - start
+
+        for component, seconds in self.load_timings.items():
+            metrics.observe(f"face.load.{component}", seconds)
+
+    def warmup(self, rounds: int = 2) -> dict:
+        """
+        Run dummy inputs through every stage so lazy initialisation (DeepFace
+        RetinaFace + anti-spoof weights, detector, ONNX/TensorRT graph setup)
+        happens before the first request. Returns the seconds per component
+        for the first and the last round.
+        """
+        rng = np.random.default_rng(0)
+        image_bgr = rng.integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+        aligned = torch.zeros((1, 3, 160, 160), dtype=torch.float32, device=self.device)
+        stages = {
+            f"detector_{self.detector_backend}": lambda: self.detect_and_align(image_bgr),
+            f"embedder_{self.backend}": lambda: self.embed(aligned),
+            "liveness": lambda: self.check_liveness_from_bgr(image_bgr, enforce_detection=False),
+        }
+
+        timings = {}
+        for round_no in range(rounds):
+            label = "first" if round_no == 0 else "steady"
+            for component, run in stages.items():
+                start = time.perf_counter()
+                try:
+                    run()
+                except Exception as e:
+                    print(f"⚠️ Warm-up of {component} failed: {e}")
+                elapsed = time.perf_counter() - start
+                if round_no == 0 or round_no == rounds - 1:
+                    timings.setdefault(component, {})[label] = elapsed
+                    metrics.observe(f"face.warmup.{component}.{label}", elapsed)
+
+        self.warmup_timings = timings
+        self.warmed_up = True
+        print("✅ Face pipeline warmed up: " + ", ".join(
+            f"{c}={1000 * t['first']:.0f}ms" for c, t in timings.items()
+        ))
+        return timings
+
+    def align(self, image_bgr: np.ndarray) -> Optional[torch.Tensor]:
+        """Aligned 160x160 face crop (batch of one) or None."""
+        return self._aligned_tensor_from_bgr(image_bgr)
+
+    @torch.no_grad()
+    def detect_face(self, image_bgr: np.ndarray):
+        """
+        Detect the most confident face and align it.
+        Returns (aligned tensor, box [x0, y0, x1, y1], probability, 5x2 landmarks)
+        or (None, None, 0.0, None).
+        """
+        if self.detector is not None:
+            aligned, box, score, landmarks = self.detector.detect_and_crop(image_bgr)
+            if aligned is None:
+                return None, None, 0.0, None
+            return torch.from_numpy(aligned[np.newaxis]).to(self.device), box, score, landmarks
+
+        pil_img = Image.fromarray(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB))
+        boxes, probs, points = self.mtcnn.detect(pil_img, landmarks=True)
+        if boxes is None or len(boxes) == 0:
+            return None, None, 0.0, None
+        best = int(np.argmax(probs))
+        box = boxes[best:best + 1]
+        aligned = self.mtcnn.extract(pil_img, box, save_path=None)
+        if aligned is None:
+            return None, None, 0.0, None
+        if aligned.ndim == 3:
+            aligned = aligned.unsqueeze(0)
+        return aligned.to(self.device), box[0].tolist(), float(probs[best]), points[best]
+
+    def detect_and_align(self, image_bgr: np.ndarray):
+        """(aligned tensor, box, probability) or (None, None, 0.0); see detect_face()."""
+        return self.detect_face(image_bgr)[:3]
+
+    def assess_quality(self, image_bgr: np.ndarray, box, landmarks=None) -> dict:
+        """
+        Sharpness, exposure, size and pose of a detected face, in about a
+        millisecond; run it before liveness and embedding so unusable frames
+        are rejected with a reason (see app.face_quality).
+        """
+        return assess_face_quality(image_bgr, box, landmarks)
 
     @torch.no_grad()
     def _aligned_tensor_from_bgr(self, image_bgr: np.ndarray) -> Optional[torch.Tensor]:
+        if self.detector is not None:
+            return self.detect_and_align(image_bgr)[0]
         img_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
         pil_img = Image.fromarray(img_rgb)
         aligned = self.mtcnn(pil_img)
@@ -114,6 +256,10 @@ class FacePipeline:
         image_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         if image_bgr is None:
             return None
+        return self.embedding_from_bgr(image_bgr)
+
+    def embedding_from_bgr(self, image_bgr: np.ndarray) -> Optional[np.ndarray]:
+        """Embedding from an already decoded image (avoids a second decode)."""
         aligned = self._aligned_tensor_from_bgr(image_bgr)
         if aligned is None:
             return None
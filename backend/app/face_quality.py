@@ -0,0 +1,118 @@
+"""
+Cheap face-quality checks run between detection and the expensive models.
+
+Everything is measured on the face crop downscaled to ANALYSIS_WIDTH
+pixels, so a check costs about a millisecond regardless of the camera
+resolution:
+
+    face_too_small  shorter box side below QUALITY_MIN_FACE_PX (original pixels)
+    underexposed    mean face brightness below QUALITY_MIN_BRIGHTNESS
+    overexposed     mean face brightness above QUALITY_MAX_BRIGHTNESS
+    blurry          variance of the Laplacian below QUALITY_MIN_SHARPNESS
+    off_pose        nose too far off the eye-mouth midline (yaw) or too far
+                    from halfway between eyes and mouth (pitch)
+    tilted          eye line rotated more than QUALITY_MAX_ROLL degrees
+
+Pose checks need the 5-point landmarks (eyes, nose, mouth corners) and are
+skipped without them.
+"""
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+
+load_dotenv()
+QUALITY_GATE = os.getenv("QUALITY_GATE", "true").lower() in ("1", "true", "yes")
+QUALITY_MIN_FACE_PX = int(os.getenv("QUALITY_MIN_FACE_PX", "80"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "50"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "220"))
+QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", "0.35"))
+QUALITY_MAX_PITCH = float(os.getenv("QUALITY_MAX_PITCH", "0.25"))
+QUALITY_MAX_ROLL = float(os.getenv("QUALITY_MAX_ROLL", "20"))
+
+ANALYSIS_WIDTH = 112
+
+# Client-facing wording for each rejection reason
+QUALITY_MESSAGES = {
+    "face_too_small": "Face too small, move closer to the camera",
+    "underexposed": "Image too dark, add more light",
+    "overexposed": "Image overexposed, reduce glare or backlight",
+    "blurry": "Image blurry, hold the camera still",
+    "off_pose": "Look straight at the camera",
+    "tilted": "Keep your head level",
+}
+
+
+def _pose(landmarks) -> dict:
+    pts = np.asarray(landmarks, dtype=np.float32).reshape(5, 2)
+    eye_a, eye_b, nose, mouth_a, mouth_b = pts
+    dx, dy = eye_b - eye_a
+    if dx < 0:
+        # Detectors differ in whether the subject's or the viewer's left comes first
+        dx, dy = -dx, -dy
+    eye_dist = max(math.hypot(dx, dy), 1e-6)
+    eye_mid = (eye_a + eye_b) / 2
+    mouth_mid = (mouth_a + mouth_b) / 2
+    # Signed distance of the nose from the eye-mouth midline, relative to eye distance
+    axis = mouth_mid - eye_mid
+    axis_len = max(float(np.hypot(*axis)), 1e-6)
+    offset = nose - eye_mid
+    yaw = float(axis[0] * offset[1] - axis[1] * offset[0]) / axis_len / eye_dist
+    # Where the nose sits between the eyes (0) and the mouth (1); about 0.5 when frontal
+    pitch = float(np.dot(offset, axis)) / axis_len ** 2 - 0.5
+    return {"yaw": round(yaw, 3), "pitch": round(pitch, 3), "roll": round(math.degrees(math.atan2(dy, dx)), 1)}
+
+
+def assess_face_quality(image_bgr: np.ndarray, box, landmarks=None) -> dict:
+    """
+    Quality of the face in box ([x0, y0, x1, y1], image pixels).
+    Returns {"ok", "reason", "message", measurements...}; reason is None when ok.
+    """
+    start = time.perf_counter()
+    h, w = image_bgr.shape[:2]
+    x0, y0 = max(int(box[0]), 0), max(int(box[1]), 0)
+    x1, y1 = min(int(round(box[2])), w), min(int(round(box[3])), h)
+    result = {"face_px": max(0, min(x1 - x0, y1 - y0))}
+
+    reason = None
+    if result["face_px"] < QUALITY_MIN_FACE_PX:
+        reason = "face_too_small"
+    else:
+        crop = cv2.cvtColor(image_bgr[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        scale = ANALYSIS_WIDTH / crop.shape[1]
+        crop = cv2.resize(crop, (ANALYSIS_WIDTH, max(1, int(round(crop.shape[0] * scale)))), interpolation=cv2.INTER_AREA)
+        result["brightness"] = round(float(crop.mean()), 1)
+        result["sharpness"] = round(float(cv2.Laplacian(crop, cv2.CV_32F).var()), 1)
+        if landmarks is not None:
+            result.update(_pose(landmarks))
+
+        if result["brightness"] < QUALITY_MIN_BRIGHTNESS:
+            reason = "underexposed"
+        elif result["brightness"] > QUALITY_MAX_BRIGHTNESS:
+            reason = "overexposed"
+        elif result["sharpness"] < QUALITY_MIN_SHARPNESS:
+            reason = "blurry"
+        elif "yaw" in result and (abs(result["yaw"]) > QUALITY_MAX_YAW or abs(result["pitch"]) > QUALITY_MAX_PITCH):
+            reason = "off_pose"
+        elif "roll" in result and abs(result["roll"]) > QUALITY_MAX_ROLL:
+            reason = "tilted"
+
+    metrics.observe("face.quality", time.perf_counter() - start)
+    if reason and not QUALITY_GATE:
+        # Measured and counted, but not enforced
+        metrics.incr(f"face.quality.would_reject.{reason}")
+        reason = None
+    elif reason:
+        metrics.incr(f"face.quality.rejected.{reason}")
+    result.update({"ok": reason is None, "reason": reason, "message": QUALITY_MESSAGES.get(reason)})
+    return result
+
+
+def quality_failure_message(quality: dict) -> str:
+    return f"Face quality check failed: {quality['message']}"
@@ -0,0 +1,136 @@
+"""
+Deterministic stand-ins for the face and document models (FAKE_MODELS=true).
+
+Used by the load-test harness so the API can run without torch, DeepFace,
+EasyOCR or model downloads. Every stage waits for a configurable latency
+(FAKE_*_MS, +/- FAKE_LATENCY_JITTER) either sleeping or, with
+FAKE_MODEL_MODE=spin, keeping a core busy with BLAS work the way real
+inference would. Outputs are deterministic:
+
+- the "face" is the whole frame; images that are nearly flat have none
+- the embedding is a fixed random projection of a 16x16 thumbnail, so the
+  same scene under small noise matches itself and different scenes do not
+- liveness always passes
+- document extraction returns fields derived from the image hash
+"""
+import hashlib
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.face_quality import assess_face_quality
+from app.metrics import metrics
+
+load_dotenv()
+FAKE_DETECT_MS = float(os.getenv("FAKE_DETECT_MS", "15"))
+FAKE_EMBED_MS = float(os.getenv("FAKE_EMBED_MS", "10"))
+FAKE_LIVENESS_MS = float(os.getenv("FAKE_LIVENESS_MS", "60"))
+FAKE_EXTRACT_MS = float(os.getenv("FAKE_EXTRACT_MS", "300"))
+FAKE_LATENCY_JITTER = float(os.getenv("FAKE_LATENCY_JITTER", "0.2"))
+FAKE_MODEL_MODE = os.getenv("FAKE_MODEL_MODE", "sleep").lower()
+
+_PROJECTION = np.random.default_rng(0).standard_normal((256, 512)).astype(np.float32)
+_SPIN_A = np.random.default_rng(1).standard_normal((128, 128)).astype(np.float32)
+
+
+def _work(ms: float):
+    """Take about ms milliseconds, sleeping or busy depending on FAKE_MODEL_MODE."""
+    if ms <= 0:
+        return
+    seconds = ms / 1000.0 * random.uniform(1 - FAKE_LATENCY_JITTER, 1 + FAKE_LATENCY_JITTER)
+    if FAKE_MODEL_MODE != "spin":
+        time.sleep(seconds)
+        return
+    deadline = time.perf_counter() + seconds
+    x = _SPIN_A
+    while time.perf_counter() < deadline:
+        x = np.tanh(x @ _SPIN_A)
+
+
+class FakeFacePipeline:
+    """Same interface as FacePipeline, no models."""
+
+    def __init__(self, device: str = "cpu", model_dir: str = "./models"):
+        self.device = "cpu"
+        self.model_dir = model_dir
+        self.backend = "fake"
+        self.detector_backend = "fake"
+        self.artefact = None
+        self.runtime = {}
+        self.load_timings = {"detector_fake": 0.0, "embedder_fake": 0.0}
+        self.warmup_timings = {}
+        self.warmed_up = False
+        print(f"⚠️ FAKE_MODELS enabled: face pipeline is a stand-in ({FAKE_MODEL_MODE})")
+
+    def warmup(self, rounds: int = 2) -> dict:
+        self.warmup_timings = {c: {"first": 0.0, "steady": 0.0} for c in self.load_timings}
+        self.warmed_up = True
+        return self.warmup_timings
+
+    def detect_face(self, image_bgr: np.ndarray):
+        _work(FAKE_DETECT_MS)
+        if image_bgr is None or image_bgr.size == 0 or float(image_bgr.std()) < 5.0:
+            return None, None, 0.0, None
+        h, w = image_bgr.shape[:2]
+        crop = cv2.resize(image_bgr, (160, 160), interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB).astype(np.float32)
+        aligned = ((rgb - 127.5) / 128.0).transpose(2, 0, 1)[np.newaxis]
+        return aligned, [0.0, 0.0, float(w), float(h)], 0.999, None
+
+    def detect_and_align(self, image_bgr: np.ndarray):
+        return self.detect_face(image_bgr)[:3]
+
+    def assess_quality(self, image_bgr: np.ndarray, box, landmarks=None) -> dict:
+        return assess_face_quality(image_bgr, box, landmarks)
+
+    def align(self, image_bgr: np.ndarray):
+        return self.detect_and_align(image_bgr)[0]
+
+    def embed(self, aligned) -> np.ndarray:
+        _work(FAKE_EMBED_MS)
+        arr = np.asarray(aligned, dtype=np.float32)
+        if arr.ndim == 4:
+            arr = arr[0]
+        gray = cv2.resize(arr.mean(axis=0), (16, 16), interpolation=cv2.INTER_AREA).ravel()
+        gray -= gray.mean()
+        emb = gray @ _PROJECTION
+        return (emb / (np.linalg.norm(emb) + 1e-12)).astype(np.float32)
+
+    def embedding_from_bgr(self, image_bgr: np.ndarray):
+        aligned = self.align(image_bgr)
+        return None if aligned is None else self.embed(aligned)
+
+    def image_to_embedding(self, image_bytes: bytes):
+        image_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        return None if image_bgr is None else self.embedding_from_bgr(image_bgr)
+
+    def check_liveness_from_bgr(self, image_bgr: np.ndarray, enforce_detection=True) -> dict:
+        _work(FAKE_LIVENESS_MS)
+        return {"is_live": True, "confidence": 0.99}
+
+
+def fake_extract_document(im: np.ndarray, doc: str = None) -> dict:
+    """Shaped like imageParser.extract_document(); fields derived from the image."""
+    start = time.perf_counter()
+    _work(FAKE_EXTRACT_MS)
+    digest = hashlib.sha256(np.ascontiguousarray(im[::8, ::8]).tobytes()).hexdigest()
+    number = str(int(digest[:15], 16))[-12:].rjust(12, "2")
+    fields = {
+        "name": f"Load Test {digest[:6]}",
+        "dob": f"{1950 + int(digest[6:8], 16) % 50}-{1 + int(digest[8:10], 16) % 12:02d}-{1 + int(digest[10:12], 16) % 28:02d}",
+        "AadharNo": f"{number[:4]} {number[4:8]} {number[8:]}",
+    }
+    metrics.incr("extract.fake")
+    return {
+        "document_type": doc or "aadhar card",
+        "detected": doc is None,
+        "source": "fake",
+        "fields": fields,
+        "invalid_fields": [],
+        "passes": 1,
+        "timings": {"total": time.perf_counter() - start},
+    }
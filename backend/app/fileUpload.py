@@ -5,10 +5,19 @@ from fastapi.responses import StreamingResponse
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
 import os
+import re
+import hashlib
+import signal
+import tempfile
+import threading
+import time
 import zipfile
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator
+
+from app.envelope import keyring
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -22,32 +31,136 @@ if len(AES_KEY) not in [16, 24, 32]:
     raise ValueError("AES_KEY must be 16, 24, or 32 bytes (128, 192, or 256 bits)")
 
 
-def encrypt_file(data: bytes) -> bytes:
+# One cipher object per process; AESGCM is stateless between calls.
+# New objects are encrypted under per-object data keys (app.envelope); AES_KEY
+# itself only decrypts objects stored before that.
+AESGCM_KEY = AESGCM(AES_KEY)
+
+# Chunked stream format:
+#   header = MAGIC(4) | version(1) | chunk_size(4, big-endian) | nonce_prefix(7)
+#   chunk  = AES-GCM(plaintext[i]) with nonce = nonce_prefix | counter(4) | last(1)
+# The header is bound as associated data to every chunk, and the last-chunk
+# flag in the nonce makes truncation and reordering detectable.
+STREAM_MAGIC = b"AGS1"
+STREAM_VERSION = 1
+STREAM_HEADER_LEN = 16
+GCM_TAG_LEN = 16
+CHUNK_SIZE = int(os.getenv("ENCRYPT_CHUNK_SIZE", str(64 * 1024)))
+# Largest chunk size accepted from a stream header; the header is only
+# authenticated with the first chunk, so it must not size the read unchecked
+MAX_CHUNK_SIZE = 16 * CHUNK_SIZE
+IPFS_ADD_TIMEOUT = 30
+IPFS_CAT_TIMEOUT = 60
+
+# "cli" talks to the local IPFS daemon; "local" is a content-addressed
+# directory stand-in for offline batch runs and tests.
+IPFS_BACKEND = os.getenv("IPFS_BACKEND", "cli").lower()
+LOCAL_IPFS_DIR = os.getenv("LOCAL_IPFS_DIR", os.path.join("data", "ipfs"))
+_LOCAL_CID_RE = re.compile(r"local[0-9a-f]{64}")
+
+
+def _chunk_nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    if counter > 0xFFFFFFFF:
+        raise ValueError("Stream too long for chunk counter")
+    return prefix + counter.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def _read_exact(src: BinaryIO, n: int) -> bytes:
+    """Read up to n bytes, looping over short reads from pipes."""
+    buf = bytearray()
+    while len(buf) < n:
+        piece = src.read(n - len(buf))
+        if not piece:
+            break
+        buf += piece
+    return bytes(buf)
+
+
+def encrypt_stream(src: BinaryIO, chunk_size: int = CHUNK_SIZE, cipher: AESGCM = None) -> Iterator[bytes]:
+    """
+    Encrypt a readable binary stream into the chunked AES-GCM format.
+    Yields the header followed by one ciphertext block per chunk, so at most
+    two plaintext chunks are held in memory at a time.
+    """
+    cipher = cipher or AESGCM_KEY
+    prefix = os.urandom(7)
+    header = STREAM_MAGIC + bytes([STREAM_VERSION]) + chunk_size.to_bytes(4, "big") + prefix
+    yield header
+
+    counter = 0
+    current = _read_exact(src, chunk_size)
+    while True:
+        # Read one chunk ahead so the final chunk can be flagged.
+        upcoming = _read_exact(src, chunk_size) if len(current) == chunk_size else b""
+        last = not upcoming
+        yield cipher.encrypt(_chunk_nonce(prefix, counter, last), current, header)
+        if last:
+            return
+        counter += 1
+        current = upcoming
+
+
+def decrypt_stream(src: BinaryIO, cipher: AESGCM = None) -> Iterator[bytes]:
     """
-    Encrypt data using AES-GCM.
+    Decrypt a chunked AES-GCM stream produced by encrypt_stream.
+    Raises ValueError if the stream is malformed, truncated or tampered.
+    """
+    cipher = cipher or AESGCM_KEY
+    header = _read_exact(src, STREAM_HEADER_LEN)
+    if len(header) != STREAM_HEADER_LEN or header[:4] != STREAM_MAGIC:
+        raise ValueError("Not an encrypted stream")
+    if header[4] != STREAM_VERSION:
+        raise ValueError(f"Unsupported stream version: {header[4]}")
+    chunk_size = int.from_bytes(header[5:9], "big")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Invalid stream chunk size: {chunk_size}")
+    prefix = header[9:16]
+
+    counter = 0
+    current = _read_exact(src, chunk_size + GCM_TAG_LEN)
+    while True:
+        upcoming = _read_exact(src, chunk_size + GCM_TAG_LEN) if len(current) == chunk_size + GCM_TAG_LEN else b""
+        last = not upcoming
+        try:
+            yield cipher.decrypt(_chunk_nonce(prefix, counter, last), current, header)
+        except InvalidTag:
+            logger.error("Decryption failed: Authentication tag verification failed")
+            raise ValueError("Decryption failed: Data may be corrupted or tampered")
+        if last:
+            return
+        counter += 1
+        current = upcoming
+
+
+def encrypt_file(data: bytes, cipher: AESGCM = None) -> bytes:
+    """
+    Encrypt data using chunked AES-GCM.
     """
     try:
-        aesgcm = AESGCM(AES_KEY)
-        nonce = os.urandom(12)
-        encrypted = aesgcm.encrypt(nonce, data, None)
-        return nonce + encrypted
+        return b"".join(encrypt_stream(io.BytesIO(data), cipher=cipher))
     except Exception as e:
         logger.error(f"Encryption failed: {str(e)}")
         raise RuntimeError(f"Encryption error: {str(e)}")
 
 
-def decrypt_file(data: bytes) -> bytes:
+def decrypt_file(data: bytes, cipher: AESGCM = None) -> bytes:
     """
-    Decrypt AES-GCM encrypted data.
+    Decrypt AES-GCM encrypted data (chunked stream or legacy nonce + ciphertext).
     """
     if len(data) < 13:
         raise ValueError("Encrypted data is too short")
-    
+
+    if data[:4] == STREAM_MAGIC:
+        try:
+            return b"".join(decrypt_stream(io.BytesIO(data), cipher=cipher))
+        except ValueError:
+            # A legacy random nonce can collide with the magic; fall through.
+            pass
+
     try:
-        aesgcm = AESGCM(AES_KEY)
         nonce = data[:12]
         encrypted = data[12:]
-        decrypted = aesgcm.decrypt(nonce, encrypted, None)
+        decrypted = (cipher or AESGCM_KEY).decrypt(nonce, encrypted, None)
         return decrypted
     except InvalidTag:
         logger.error("Decryption failed: Authentication tag verification failed")
@@ -57,72 +170,225 @@ def decrypt_file(data: bytes) -> bytes:
         raise RuntimeError(f"Decryption error: {str(e)}")
 
 
-def upload_json_to_ipfs(data: dict) -> str:
+def _local_ipfs_path(cid: str) -> str:
+    if not _LOCAL_CID_RE.fullmatch(cid):
+        raise ValueError(f"Invalid local CID: {cid}")
+    return os.path.join(LOCAL_IPFS_DIR, cid)
+
+
+def _local_ipfs_add(chunks: Iterable[bytes]) -> str:
+    """Write chunks to the local store under their SHA-256 content address."""
+    os.makedirs(LOCAL_IPFS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=LOCAL_IPFS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+        cid = "local" + digest.hexdigest()
+        os.replace(tmp_path, _local_ipfs_path(cid))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return cid
+
+
+def _ipfs_add_chunks(chunks: Iterable[bytes]) -> str:
+    """Pipe byte chunks into `ipfs add` without buffering the whole payload."""
+    if IPFS_BACKEND == "local":
+        return _local_ipfs_add(chunks)
+
+    try:
+        proc = subprocess.Popen(
+            ['ipfs', 'add', '-Q', '--pin=true'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+    except FileNotFoundError:
+        logger.error("IPFS command not found. Is IPFS installed and in PATH?")
+        raise RuntimeError("IPFS not installed or not in system PATH")
+
+    def kill():
+        # The whole group: a leftover child would keep the pipes open
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    # Drain both pipes while writing: ipfs blocks on a full stderr pipe and
+    # then stops reading stdin, which would block our write forever
+    output = {}
+
+    def drain(name, pipe):
+        output[name] = pipe.read()
+
+    drains = [
+        threading.Thread(target=drain, args=(name, pipe), daemon=True)
+        for name, pipe in (("stdout", proc.stdout), ("stderr", proc.stderr))
+    ]
+    for t in drains:
+        t.start()
+
+    # A single write stuck for IPFS_ADD_TIMEOUT kills ipfs, which turns the
+    # blocked write into BrokenPipeError (time spent producing chunks, e.g.
+    # reading a slow upload, does not count)
+    writing_since = [None]
+    done = threading.Event()
+    timed_out = threading.Event()
+
+    def watchdog():
+        while not done.wait(1.0):
+            since = writing_since[0]
+            if since is not None and time.monotonic() - since > IPFS_ADD_TIMEOUT:
+                timed_out.set()
+                kill()
+                return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    try:
+        try:
+            for chunk in chunks:
+                writing_since[0] = time.monotonic()
+                proc.stdin.write(chunk)
+                writing_since[0] = None
+            writing_since[0] = time.monotonic()
+            proc.stdin.close()
+            writing_since[0] = None
+        except BrokenPipeError:
+            pass  # ipfs exited early; its exit code and stderr say why
+        proc.wait(timeout=IPFS_ADD_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        timed_out.set()
+    except Exception:
+        kill()
+        raise
+    finally:
+        done.set()
+        if timed_out.is_set():
+            kill()
+        proc.wait()
+        for t in drains:
+            t.join()
+
+    if timed_out.is_set():
+        logger.error("IPFS upload timed out")
+        raise RuntimeError(f"IPFS upload timed out after {IPFS_ADD_TIMEOUT} seconds")
+
+    stdout, stderr = output.get("stdout", b""), output.get("stderr", b"")
+    if proc.returncode != 0:
+        error_msg = stderr.decode('utf-8') if stderr else f"exit code {proc.returncode}"
+        logger.error(f"IPFS upload failed: {error_msg}")
+        raise RuntimeError(f"IPFS upload failed: {error_msg}")
+
+    cid = stdout.decode('utf-8').strip()
+    if not cid:
+        raise RuntimeError("IPFS returned empty CID")
+    return cid
+
+
+def upload_stream_to_ipfs(src: BinaryIO, chunk_size: int = CHUNK_SIZE, cipher: AESGCM = None) -> str:
+    """
+    Encrypt a binary stream chunk by chunk and pin it to IPFS.
+    Memory use is bounded by the chunk size, not the payload size.
+    Pass the cipher of a data key from keyring.new_data_key().
+    """
+    cid = _ipfs_add_chunks(encrypt_stream(src, chunk_size, cipher=cipher))
+    logger.info(f"Successfully streamed encrypted upload to IPFS: {cid}")
+    return cid
+
+
+def stream_from_ipfs(cid: str, key: dict = None) -> Iterator[bytes]:
+    """
+    Fetch an encrypted object from IPFS and yield decrypted plaintext chunks.
+    key is the wrapped data key stored with the CID (None for legacy objects).
+    Suitable for passing straight to a StreamingResponse.
+    """
+    if not cid or not isinstance(cid, str):
+        raise ValueError("Invalid CID provided")
+    cipher = keyring.cipher_for(key) if key else None
+
+    if IPFS_BACKEND == "local":
+        with open(_local_ipfs_path(cid), "rb") as f:
+            yield from decrypt_stream(f, cipher=cipher)
+        return
+
+    try:
+        proc = subprocess.Popen(
+            ['ipfs', 'cat', cid],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise RuntimeError("IPFS not installed or not in system PATH")
+
+    try:
+        yield from decrypt_stream(proc.stdout, cipher=cipher)
+    finally:
+        proc.stdout.close()
+        try:
+            _, stderr = proc.communicate(timeout=IPFS_CAT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            _, stderr = proc.communicate()
+        if proc.returncode not in (0, None, -9):
+            error_msg = stderr.decode('utf-8') if stderr else f"exit code {proc.returncode}"
+            logger.error(f"IPFS fetch failed for CID {cid}: {error_msg}")
+
+
+def upload_json_to_ipfs(data: dict, cipher: AESGCM = None) -> str:
     """
     Upload JSON data to IPFS (encrypted).
     """
     try:
         # Convert dict to JSON string, then to bytes
         json_bytes = json.dumps(data, ensure_ascii=False).encode("utf-8")
-        encrypted_bytes = encrypt_file(json_bytes)
-        
-        # Upload to IPFS
-        result = subprocess.run(
-            ['ipfs', 'add', '-Q', '--pin=true'],
-            input=encrypted_bytes,
-            capture_output=True,
-            check=True,
-            timeout=30
-        )
-        
-        # ✅ FIX: Decode bytes to string
-        cid = result.stdout.decode('utf-8').strip()
-        
-        if not cid:
-            raise RuntimeError("IPFS returned empty CID")
-        
+
+        # Encrypt and pipe to IPFS chunk by chunk
+        cid = _ipfs_add_chunks(encrypt_stream(io.BytesIO(json_bytes), cipher=cipher))
+
         logger.info(f"Successfully uploaded to IPFS: {cid}")
         return cid
-        
-    except subprocess.CalledProcessError as e:
-        # ✅ FIX: Properly decode stderr if it exists
-        error_msg = e.stderr.decode('utf-8') if e.stderr else str(e)
-        logger.error(f"IPFS upload failed: {error_msg}")
-        raise RuntimeError(f"IPFS upload failed: {error_msg}")
-    except subprocess.TimeoutExpired:
-        logger.error("IPFS upload timed out")
-        raise RuntimeError("IPFS upload timed out after 30 seconds")
-    except FileNotFoundError:
-        logger.error("IPFS command not found. Is IPFS installed and in PATH?")
-        raise RuntimeError("IPFS not installed or not in system PATH")
+
+    except RuntimeError:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error during IPFS upload: {str(e)}")
         raise RuntimeError(f"IPFS upload error: {str(e)}")
 
 
-def fetch_json_from_ipfs(cid: str) -> dict:
+def fetch_json_from_ipfs(cid: str, key: dict = None) -> dict:
     """
     Fetch and decrypt JSON data from IPFS.
+    key is the wrapped data key stored with the CID (None for legacy objects).
     """
     if not cid or not isinstance(cid, str):
         raise ValueError("Invalid CID provided")
     
     try:
-        result = subprocess.run(
-            ['ipfs', 'cat', cid],
-            capture_output=True,
-            check=True,
-            timeout=60
-        )
-        
-        # ✅ FIX: result.stdout is already bytes, no need to decode
-        file_bytes = result.stdout
+        if IPFS_BACKEND == "local":
+            with open(_local_ipfs_path(cid), "rb") as f:
+                file_bytes = f.read()
+        else:
+            result = subprocess.run(
+                ['ipfs', 'cat', cid],
+                capture_output=True,
+                check=True,
+                timeout=60
+            )
+
+            # ✅ FIX: result.stdout is already bytes, no need to decode
+            file_bytes = result.stdout
         
         if not file_bytes:
             raise ValueError(f"No data retrieved for CID: {cid}")
         
         # Decrypt the bytes
-        decrypted_bytes = decrypt_file(file_bytes)
+        decrypted_bytes = decrypt_file(file_bytes, cipher=keyring.cipher_for(key) if key else None)
         
         # ✅ FIX: Now decode to string
         json_str = decrypted_bytes.decode('utf-8')
@@ -153,7 +419,8 @@ def fetch_json_from_ipfs(cid: str) -> dict:
 def upload_identity_document(
     extracted_data: dict, 
     doc_type: str, 
-    wallet_address: str = None
+    wallet_address: str = None,
+    image_cid: str = None
 ) -> dict:
     """
     Upload extracted identity document data to IPFS with metadata.
@@ -174,14 +441,18 @@ def upload_identity_document(
             "version": "1.0",
             "encrypted": True
         }
+        if image_cid:
+            metadata["image_cid"] = image_cid
         
-        # Upload to IPFS
-        ipfs_cid = upload_json_to_ipfs(metadata)
+        # Upload to IPFS under a fresh data key
+        cipher, key = keyring.new_data_key()
+        ipfs_cid = upload_json_to_ipfs(metadata, cipher=cipher)
         
         logger.info(f"Document uploaded: type={doc_type}, wallet={wallet_address}, CID={ipfs_cid}")
         
         return {
             "ipfs_cid": ipfs_cid,
+            "key": key,
             "metadata": metadata,
             "encrypted": True
         }
@@ -208,7 +479,9 @@ def verify_ipfs_daemon() -> bool:
 
 
 # Optional: Run verification on module import
-if not verify_ipfs_daemon():
+if IPFS_BACKEND == "local":
+    logger.info(f"Using local IPFS stand-in at {LOCAL_IPFS_DIR}")
+elif not verify_ipfs_daemon():
     logger.warning("⚠️  IPFS daemon may not be running. Start it with 'ipfs daemon'")
 else:
     logger.info("✅ IPFS daemon is running")
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.metrics import metrics
+
+load_dotenv()
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+# Without an Idempotency-Key only near-simultaneous duplicates are deduplicated
+IDEMPOTENCY_CONTENT_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_CONTENT_TTL_SECONDS", "5"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+def _digest(*material: str) -> str:
+    return hashlib.sha256("\x1f".join(material).encode("utf-8")).hexdigest()
+
+
+class IdempotencyCache:
+    """
+    Remember successful results and coalesce concurrent identical requests:
+    while one execution is in flight, duplicates await its result.
+    Failures are not cached, so a retry after an error runs again.
+
+    With a client Idempotency-Key the result is kept for the TTL and the key
+    is bound to the request content; reusing it for a different request is
+    rejected. Without one, requests are keyed by their content and only kept
+    for IDEMPOTENCY_CONTENT_TTL_SECONDS, since sending the same content
+    again later (re-enrolling an earlier photo, re-uploading a deleted
+    document) is a new request.
+    """
+
+    def __init__(
+        self,
+        ttl: int = IDEMPOTENCY_TTL_SECONDS,
+        content_ttl: int = IDEMPOTENCY_CONTENT_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.content_ttl = content_ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, endpoint, wallet, content fingerprint, result)
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()
+        # key -> (future, content fingerprint)
+        self._inflight: Dict[str, tuple] = {}
+
+    def _get(self, key: str):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if time.time() > entry[0]:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, ttl: int, endpoint: str, wallet: str, fingerprint: str, result: Any):
+        if ttl <= 0:
+            return
+        self._results[key] = (time.time() + ttl, endpoint, wallet, fingerprint, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    @staticmethod
+    def _check_fingerprint(stored: str, fingerprint: str):
+        if stored != fingerprint:
+            metrics.incr("idempotency.key_reused")
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request"
+            )
+
+    def invalidate(self, wallet: str, endpoint: Optional[str] = None):
+        """Forget stored results for a wallet (e.g. after its state changed)."""
+        stale = [
+            key for key, entry in self._results.items()
+            if entry[2] == wallet and (endpoint is None or entry[1] == endpoint)
+        ]
+        for key in stale:
+            del self._results[key]
+        if stale:
+            metrics.set_gauge("idempotency.entries", len(self._results))
+
+    async def run(
+        self,
+        endpoint: str,
+        wallet: str,
+        content: Sequence[str],
+        fn: Callable[[], Awaitable[Any]],
+        idempotency_key: Optional[str] = None,
+        cache_if: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """Return the stored result for this request, or run fn once and store it."""
+        fingerprint = _digest(*content)
+        if idempotency_key:
+            key, ttl = _digest(endpoint, wallet, "key", idempotency_key), self.ttl
+        else:
+            key, ttl = _digest(endpoint, wallet, "content", fingerprint), self.content_ttl
+
+        entry = self._get(key)
+        if entry is not None:
+            self._check_fingerprint(entry[3], fingerprint)
+            metrics.incr("idempotency.hits")
+            return entry[4]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check_fingerprint(inflight[1], fingerprint)
+            metrics.incr("idempotency.coalesced")
+            return await asyncio.shield(inflight[0])
+
+        metrics.incr("idempotency.misses")
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fut, fingerprint)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if cache_if is None or cache_if(result):
+            self._put(key, ttl, endpoint, wallet, fingerprint, result)
+        fut.set_result(result)
+        metrics.set_gauge("idempotency.entries", len(self._results))
+        return result
+
+
+# Global instance
+idempotency_cache = IdempotencyCache()
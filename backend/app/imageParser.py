@@ -1,30 +1,28 @@
 import base64
 import json
+import os
+import time
+import logging
+from datetime import datetime
 import cv2
 import re
 import numpy as np
-from fastapi import UploadFile
-import easyocr
-from transformers import pipeline
-from accelerate import Accelerator
+from fastapi import UploadFile, HTTPException
+from app.ocr_service import ocr_service
+from app.ner_service import ner_service
+from app.metrics import metrics
+from app.image_ingest import decode_image, MAX_UPLOAD_BYTES
 from pyzbar import pyzbar
 import zlib
 import xml.etree.ElementTree as ET
 
-# Initialize HuggingFace Accelerator
-accelerator = Accelerator()
-device = 0 if accelerator.device.type == "cuda" else -1  # pipeline uses -1 for CPU
+logger = logging.getLogger(__name__)
 
-# Load HuggingFace NER model with Accelerate
-ner_pipeline = pipeline(
-    "ner",
-    model="Davlan/xlm-roberta-base-ner-hrl",
-    grouped_entities=True,
-    device=device
-)
+# HuggingFace NER (xlm-roberta) runs batched and memoized in app.ner_service,
+# on candidate lines near the name/DOB anchors only.
 
-# Load EasyOCR reader (English + Kannada)
-reader = easyocr.Reader(['en', 'kn'])
+# EasyOCR readers (English + Kannada) are owned by the OCR worker pool
+# in app.ocr_service and loaded lazily on first use.
 
 # def imageToString(uploadFile: UploadFile, doc: str):
 #     file_bytes = np.frombuffer(uploadFile.file.read(), np.uint8)
@@ -79,29 +77,15 @@ reader = easyocr.Reader(['en', 'kn'])
 #         return voterID_text(text)
 
 def imageToString(uploadFile: UploadFile, doc: str):
-    file_bytes = np.frombuffer(uploadFile.file.read(), np.uint8)
-    im = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    data = uploadFile.file.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        return None
+    try:
+        im = decode_image(data)
+    except HTTPException:
+        return None
 
-    # ===== PREPROCESSING =====
-    
-    im = cv2.resize(im, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_CUBIC)
-    gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-    gray = cv2.bilateralFilter(gray, 11, 17, 17)
-
-    # ===== OCR with EasyOCR =====
-    results = reader.readtext(gray, detail=0)
-    text = "\n".join(results)
-
-    print("===== RAW OCR TEXT =====")
-    print(text)
-    print("========================")
-
-    if doc.lower() == 'aadhar card':
-        return aadhar_text(text)
-    elif(doc == 'Pan Card'):
-        return panCard_text(text)
-    elif(doc == "Driver's License"):
-        return DL_text(text)
+    return extract_document(im, doc)["fields"]
 
 
 def aadhar_text(text: str):
@@ -109,13 +93,7 @@ def aadhar_text(text: str):
 
     # --- Extract Name using HuggingFace NER ---
     name = None
-    entities = ner_pipeline(text)
-    candidates = []
-    for ent in entities:
-        if ent['entity_group'] in ["PER", "PERSON"]:
-            candidate = re.sub(r"[^A-Za-z\s]", "", ent['word']).strip()
-            if len(candidate.split()) >= 2:
-                candidates.append(candidate)
+    candidates = ner_service.person_names(text)
 
     if candidates:
         # Pick longest name candidate
@@ -171,13 +149,7 @@ def aadhar_text(text: str):
 def panCard_text(text: str):
     lines = [line.strip() for line in text.split("\n") if line.strip()]
     name = None
-    entities = ner_pipeline(text)
-    candidates = []
-    for ent in entities:
-        if ent['entity_group'] in ["PER", "PERSON"]:
-            candidate = re.sub(r"[^A-Za-z\s]", "", ent['word']).strip()
-            if len(candidate.split()) >= 2:
-                candidates.append(candidate)
+    candidates = ner_service.person_names(text)
 
     if candidates:
         # Pick longest name candidate
@@ -185,7 +157,7 @@ def panCard_text(text: str):
 
     dob = re.search(r"\b(\d{2}[\/\-]\d{2}[\/\-]\d{4})\b", text)
 
-    if not name:
+    if not name and dob:
         for i, line in enumerate(lines):
             if dob.group() in line.lower():
                 for offset in [1, 2]:  # check 1 above, then 2 above
@@ -221,13 +193,7 @@ def DL_text(text: str):
 
     # --- Extract Name using HuggingFace NER ---
     name = None
-    entities = ner_pipeline(text)
-    candidates = []
-    for ent in entities:
-        if ent['entity_group'] in ["PER", "PERSON"]:
-            candidate = re.sub(r"[^A-Za-z\s]", "", ent['word']).strip()
-            if len(candidate.split()) >= 2:
-                candidates.append(candidate)
+    candidates = ner_service.person_names(text)
 
     if candidates:
         # Pick longest name candidate
@@ -276,13 +242,7 @@ def voterID_text(text: str):
 
     # --- Extract Name using HuggingFace NER ---
     name = None
-    entities = ner_pipeline(text)
-    candidates = []
-    for ent in entities:
-        if ent['entity_group'] in ["PER", "PERSON"]:
-            candidate = re.sub(r"[^A-Za-z\s]", "", ent['word']).strip()
-            if len(candidate.split()) >= 2:
-                candidates.append(candidate)
+    candidates = ner_service.person_names(text)
 
     if candidates:
         # Pick longest name candidate
@@ -315,3 +275,401 @@ def voterID_text(text: str):
     print("-------------------------------------------------------------------------------------")
 
     return result
+
+
+# ==================== AADHAAR QR FAST PATH ====================
+
+UIDAI_CERT_PATH = os.getenv("UIDAI_CERT_PATH")  # PEM/DER certificate for secure QR signatures
+QR_SIGNATURE_LEN = 256
+_GENDERS = {"M": "Male", "MALE": "Male", "F": "Female", "FEMALE": "Female", "T": "Transgender"}
+
+# Secure QR text fields after the optional version marker (V2, V3...)
+_SECURE_QR_FIELDS = [
+    "email_mobile_indicator", "reference_id", "name", "dob", "gender", "care_of",
+    "district", "landmark", "house", "location", "pincode", "post_office",
+    "state", "street", "sub_district", "vtc",
+]
+
+_uidai_public_key = None
+
+
+def _load_uidai_key():
+    global _uidai_public_key
+    if _uidai_public_key is None and UIDAI_CERT_PATH:
+        from cryptography import x509
+        with open(UIDAI_CERT_PATH, "rb") as f:
+            raw = f.read()
+        cert = x509.load_pem_x509_certificate(raw) if b"BEGIN CERTIFICATE" in raw else x509.load_der_x509_certificate(raw)
+        _uidai_public_key = cert.public_key()
+    return _uidai_public_key
+
+
+def _verify_secure_qr(payload: bytes):
+    """True/False when a UIDAI certificate is configured, otherwise None."""
+    key = _load_uidai_key()
+    if key is None:
+        return None
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    try:
+        key.verify(payload[-QR_SIGNATURE_LEN:], payload[:-QR_SIGNATURE_LEN], padding.PKCS1v15(), hashes.SHA256())
+        return True
+    except InvalidSignature:
+        return False
+
+
+def _format_dob(value):
+    if not value:
+        return None
+    return value.replace("-", "/") if re.fullmatch(r"\d{2}-\d{2}-\d{4}", value) else value
+
+
+def parse_aadhaar_qr(raw: bytes):
+    """
+    Parse an Aadhaar QR payload (legacy XML or compressed secure QR) into the
+    same fields aadhar_text returns. Returns None if it is not an Aadhaar QR.
+    """
+    data = raw.strip()
+
+    # Legacy: <PrintLetterBarcodeData uid=".." name=".." .../>
+    if data.startswith(b"<"):
+        try:
+            root = ET.fromstring(data.decode("utf-8", errors="replace"))
+        except ET.ParseError:
+            return None
+        attrs = root.attrib
+        if "uid" not in attrs:
+            return None
+        gender = attrs.get("gender", "").upper()
+        return {
+            "name": attrs.get("name"),
+            "dob": _format_dob(attrs.get("dob")) or attrs.get("yob"),
+            "gender": _GENDERS.get(gender),
+            "AadharNo": re.sub(r"\D", "", attrs["uid"]) or None,
+        }, {"format": "xml", "signature_valid": None}
+
+    # Secure QR: big decimal integer -> bytes -> gzip -> 0xFF separated fields
+    if not data.isdigit():
+        return None
+    try:
+        number = int(data)
+        payload = zlib.decompress(number.to_bytes((number.bit_length() + 7) // 8, "big"), 16 + zlib.MAX_WBITS)
+    except (ValueError, zlib.error):
+        return None
+
+    parts = payload.split(b"\xff")
+    offset = 1 if re.fullmatch(rb"V\d+", parts[0]) else 0
+    if len(parts) < offset + len(_SECURE_QR_FIELDS):
+        return None
+    record = {
+        key: parts[offset + i].decode("iso-8859-1")
+        for i, key in enumerate(_SECURE_QR_FIELDS)
+    }
+    last4 = record["reference_id"][:4]
+    return {
+        "name": record["name"] or None,
+        "dob": _format_dob(record["dob"]),
+        "gender": _GENDERS.get(record["gender"].upper()),
+        # Secure QR only carries the last four digits of the number
+        "AadharNo": f"XXXXXXXX{last4}" if last4.isdigit() else None,
+    }, {
+        "format": f"secure-{parts[0].decode() if offset else 'V1'}",
+        "signature_valid": _verify_secure_qr(payload),
+    }
+
+
+def decode_aadhaar_qr(im: np.ndarray):
+    """Find and parse an Aadhaar QR in the image; (fields, info) or None."""
+    gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY) if im.ndim == 3 else im
+    candidates = [gray]
+    # Dense secure QRs in large photos often decode better slightly reduced
+    if max(gray.shape[:2]) > 1600:
+        candidates.append(_downscale(gray, 1600)[0])
+
+    for img in candidates:
+        for symbol in pyzbar.decode(img, symbols=[pyzbar.ZBarSymbol.QRCODE]):
+            parsed = parse_aadhaar_qr(symbol.data)
+            if parsed:
+                return parsed
+
+    # OpenCV detector as a fallback for codes zbar misses
+    text, _, _ = cv2.QRCodeDetector().detectAndDecode(gray)
+    if text:
+        return parse_aadhaar_qr(text.encode("utf-8"))
+    return None
+
+
+# ==================== DOCUMENT TYPE DETECTION ====================
+
+# Client labels -> canonical type. Labels in DOC_LABELS are what we store.
+_DOC_ALIASES = {
+    "aadhar card": "aadhaar", "aadhaar card": "aadhaar", "aadhar": "aadhaar", "aadhaar": "aadhaar",
+    "pan card": "pan", "pan": "pan",
+    "driver's license": "dl", "drivers license": "dl", "driving licence": "dl", "driving license": "dl", "dl": "dl",
+    "voter id": "voter", "voter id card": "voter", "epic": "voter", "voter": "voter",
+}
+DOC_LABELS = {"aadhaar": "aadhar card", "pan": "Pan Card", "dl": "Driver's License", "voter": "Voter ID"}
+
+# Keyword and pattern weights for the downscaled classification pass
+_DOC_KEYWORDS = {
+    "aadhaar": [
+        (re.compile(r"aadhaar|aadhar|unique identification|enrolment|\bvid\b", re.IGNORECASE), 2),
+        (re.compile(r"\b\d{4}\s\d{4}\s\d{4}\b"), 2),
+        (re.compile(r"government of india", re.IGNORECASE), 1),
+    ],
+    "pan": [
+        (re.compile(r"income tax|permanent account", re.IGNORECASE), 3),
+        (re.compile(r"\b[A-Z]{5}\d{4}[A-Z]\b"), 2),
+        (re.compile(r"govt\.? of india", re.IGNORECASE), 1),
+    ],
+    "dl": [
+        (re.compile(r"driving licen[cs]e|transport|licence no|\bdl no", re.IGNORECASE), 3),
+        (re.compile(r"\b[A-Z]{2}\d{2}\s?\d{11}\b"), 2),
+        (re.compile(r"valid till|\bcov\b", re.IGNORECASE), 1),
+    ],
+    "voter": [
+        (re.compile(r"election commission|elector|\bepic\b", re.IGNORECASE), 3),
+        (re.compile(r"\b[A-Z]{3}\d{7,8}\b"), 2),
+    ],
+}
+
+CLASSIFY_SIDE = 800
+ROI_MARGIN = 0.04
+
+# OCR passes per type: (languages, use ROI). Kannada only as a fallback.
+_OCR_PLAN = {
+    "aadhaar": [(("en",), True), (("en", "kn"), False)],
+    "pan": [(("en",), True), (("en",), False)],
+    "dl": [(("en",), True), (("en", "kn"), False)],
+    "voter": [(("en",), True), (("en", "kn"), False)],
+}
+
+# Verhoeff tables for the Aadhaar check digit
+_VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6], [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8], [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2], [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4], [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+_VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2], [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0], [4, 1, 8, 7, 6, 5, 2, 9, 3, 0],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5], [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+
+def _verhoeff_valid(number: str) -> bool:
+    c = 0
+    for i, digit in enumerate(reversed(number)):
+        c = _VERHOEFF_D[c][_VERHOEFF_P[i % 8][int(digit)]]
+    return c == 0
+
+
+def _valid_date(value) -> bool:
+    if not value:
+        return False
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            continue
+    return False
+
+
+def _valid_name(value) -> bool:
+    return bool(value) and len(value.split()) >= 2
+
+
+_REQUIRED_FIELDS = {
+    "aadhaar": {
+        "name": _valid_name,
+        "dob": _valid_date,
+        "AadharNo": lambda v: bool(v) and len(v) == 12 and v.isdigit() and v[0] not in "01" and _verhoeff_valid(v),
+    },
+    "pan": {
+        "name": _valid_name,
+        "dob": _valid_date,
+        "Pan": lambda v: bool(v) and re.fullmatch(r"[A-Z]{5}\d{4}[A-Z]", v.upper()) is not None,
+    },
+    "dl": {
+        "name": _valid_name,
+        "dob": _valid_date,
+        "DL_no": lambda v: bool(v) and re.fullmatch(r"[A-Z]{2}\d{2}\s?\d{11}", v) is not None,
+    },
+    "voter": {
+        "name": _valid_name,
+        "voterId": lambda v: bool(v) and re.fullmatch(r"[A-Z]{3}\d{7,8}", v) is not None,
+    },
+}
+
+
+def normalize_doc_type(doc: str):
+    """Map a client-supplied document label to a canonical type (or None)."""
+    if not doc:
+        return None
+    return _DOC_ALIASES.get(doc.strip().lower())
+
+
+def invalid_fields(doc_type: str, fields: dict) -> list:
+    """Required fields for the type that are missing or fail validation."""
+    fields = fields or {}
+    return [key for key, check in _REQUIRED_FIELDS[doc_type].items() if not check(fields.get(key))]
+
+
+def _downscale(im: np.ndarray, side: int):
+    h, w = im.shape[:2]
+    scale = min(1.0, side / max(h, w))
+    if scale < 1.0:
+        im = cv2.resize(im, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return im, scale
+
+
+def find_card_roi(im: np.ndarray):
+    """
+    Bounding box (x0, y0, x1, y1) of the card in the photo, from edge
+    contours on a downscaled copy. None when no clear card outline is found.
+    """
+    small, scale = _downscale(im, CLASSIFY_SIDE)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((5, 5), np.uint8), iterations=2)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    area_ratio = (w * h) / float(small.shape[0] * small.shape[1])
+    if area_ratio < 0.2 or area_ratio > 0.95:
+        return None
+
+    mx, my = int(w * ROI_MARGIN), int(h * ROI_MARGIN)
+    H, W = im.shape[:2]
+    return (
+        max(0, int((x - mx) / scale)), max(0, int((y - my) / scale)),
+        min(W, int((x + w + mx) / scale)), min(H, int((y + h + my) / scale)),
+    )
+
+
+def classify_document(im: np.ndarray):
+    """
+    Guess the document type from a fast English OCR pass on a downscaled copy.
+    Returns (doc_type or None, scores).
+    """
+    small, _ = _downscale(im, CLASSIFY_SIDE)
+    text = ocr_service.read_text(small, langs=("en",), fast=True)["text"]
+
+    scores = {doc_type: 0 for doc_type in _DOC_KEYWORDS}
+    for doc_type, patterns in _DOC_KEYWORDS.items():
+        for pattern, weight in patterns:
+            if pattern.search(text):
+                scores[doc_type] += weight
+
+    # Portrait layout: e-Aadhaar letter / printout rather than an ID-1 card
+    h, w = im.shape[:2]
+    if h > 1.2 * w:
+        scores["aadhaar"] += 1
+
+    best = max(scores, key=scores.get)
+    return (best if scores[best] >= 2 else None), scores
+
+
+def extract_document(im: np.ndarray, doc: str = None) -> dict:
+    """
+    Detect the document type if needed, then OCR in increasingly expensive
+    passes (English on the card region first, wider language set on the full
+    image after) and stop as soon as all required fields validate.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    doc_type = normalize_doc_type(doc)
+    detected = False
+
+    # Aadhaar QR fast path: milliseconds instead of a full OCR + NER run.
+    # Only a QR whose UIDAI signature verified is trusted; anyone can print
+    # an unsigned (legacy XML) or unverifiable one with arbitrary fields.
+    unverified_qr = None
+    if doc_type in (None, "aadhaar"):
+        qr = decode_aadhaar_qr(im)
+        timings["qr"] = time.perf_counter() - start
+        metrics.incr("extract.qr_hits" if qr else "extract.qr_misses")
+        if qr:
+            fields, info = qr
+            if info["signature_valid"] is not True:
+                metrics.incr("extract.qr_unverified")
+                logger.warning(f"Aadhaar QR signature not verified ({info['signature_valid']}); using OCR")
+                unverified_qr = info
+            else:
+                timings["total"] = time.perf_counter() - start
+                return {
+                    "document_type": DOC_LABELS["aadhaar"],
+                    "detected": doc_type is None,
+                    "source": "qr",
+                    "qr": info,
+                    "fields": fields,
+                    "invalid_fields": [k for k in ("name", "dob", "AadharNo") if not fields.get(k)],
+                    "passes": 0,
+                    "timings": timings,
+                }
+
+    if doc_type is None:
+        doc_type, scores = classify_document(im)
+        detected = True
+        timings["classify"] = time.perf_counter() - start
+        logger.info(f"Document classifier scores: {scores}")
+        if doc_type is None:
+            return {
+                "document_type": None, "detected": True, "source": "ocr", "fields": None,
+                "invalid_fields": None, "passes": 0, "timings": timings,
+            }
+
+    t0 = time.perf_counter()
+    roi = find_card_roi(im)
+    timings["roi"] = time.perf_counter() - t0
+
+    plan = []
+    for langs, use_roi in _OCR_PLAN[doc_type]:
+        step = (langs, use_roi and roi is not None)
+        if step not in plan:
+            plan.append(step)
+
+    extractor = _EXTRACTORS[doc_type]
+    best, best_invalid, passes = None, None, 0
+    for langs, use_roi in plan:
+        region = im[roi[1]:roi[3], roi[0]:roi[2]] if use_roi else im
+
+        t0 = time.perf_counter()
+        text = ocr_service.read_text(region, langs=langs)["text"]
+        print("===== RAW OCR TEXT =====")
+        print(text)
+        print("========================")
+        fields = extractor(text)
+        passes += 1
+        timings[f"pass{passes}_{'+'.join(langs)}"] = time.perf_counter() - t0
+
+        invalid = invalid_fields(doc_type, fields)
+        if best is None or len(invalid) < len(best_invalid):
+            best, best_invalid = fields, invalid
+        if not invalid:
+            break
+
+    timings["total"] = time.perf_counter() - start
+    result = {
+        "document_type": DOC_LABELS[doc_type],
+        "detected": detected,
+        "source": "ocr",
+        "fields": best,
+        "invalid_fields": best_invalid,
+        "passes": passes,
+        "timings": timings,
+    }
+    if unverified_qr is not None:
+        result["qr"] = unverified_qr
+    return result
+
+
+_EXTRACTORS = {"aadhaar": aadhar_text, "pan": panCard_text, "dl": DL_text, "voter": voterID_text}
@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import BinaryIO, Dict, Optional, Union
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.envelope import keyring
+from app.fileUpload import AES_KEY, upload_stream_to_ipfs
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ARCHIVE_ORIGINAL_IMAGES = os.getenv("ARCHIVE_ORIGINAL_IMAGES", "false").lower() in ("1", "true", "yes")
+ARCHIVE_IMAGE_FORMAT = os.getenv("ARCHIVE_IMAGE_FORMAT", "webp").lower()  # webp | jpg | jxl
+ARCHIVE_IMAGE_QUALITY = int(os.getenv("ARCHIVE_IMAGE_QUALITY", "90"))
+ARCHIVE_INDEX_FILE = os.path.join("data", "image_archive.json")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# extension -> (quality flag name, media type)
+_FORMATS = {
+    "webp": ("IMWRITE_WEBP_QUALITY", "image/webp"),
+    "jpg": ("IMWRITE_JPEG_QUALITY", "image/jpeg"),
+    "jxl": ("IMWRITE_JPEGXL_QUALITY", "image/jxl"),
+}
+
+
+class _BufferReader:
+    """Minimal read() over an existing buffer without copying it up front."""
+
+    def __init__(self, buf):
+        self.view = memoryview(buf).cast("B")
+        self._pos = 0
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = len(self.view) - self._pos
+        chunk = self.view[self._pos:self._pos + n].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self._pos, 2: len(self.view)}[whence]
+        self._pos = max(0, base + pos)
+        return self._pos
+
+
+class ImageArchive:
+    """Content-hash index of archived original document images."""
+
+    def __init__(self, storage_file: str = ARCHIVE_INDEX_FILE):
+        self.storage_file = storage_file
+        self.entries: Dict[str, dict] = {}
+        # Held by writers so a save never serialises a half-updated dict
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Load the archive index from file."""
+        if os.path.exists(self.storage_file):
+            try:
+                with open(self.storage_file, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading image archive index: {e}")
+                self.entries = {}
+
+    def save(self):
+        """Save the archive index to file."""
+        try:
+            os.makedirs(os.path.dirname(self.storage_file) or ".", exist_ok=True)
+            tmp = self.storage_file + ".tmp"
+            with self.lock, open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.storage_file)
+        except Exception as e:
+            logger.error(f"Error saving image archive index: {e}")
+
+    def get(self, content_hash: str) -> Optional[dict]:
+        return self.entries.get(content_hash)
+
+    def find_by_cid(self, image_cid: str) -> Optional[dict]:
+        for entry in self.entries.values():
+            if entry.get("image_cid") == image_cid:
+                return entry
+        return None
+
+    def add(self, content_hash: str, entry: dict):
+        with self.lock:
+            self.entries[content_hash] = entry
+        self.save()
+
+
+def content_hash(src: BinaryIO) -> str:
+    """
+    Keyed hash of the raw upload, read in chunks from the stream.
+    Keyed with AES_KEY so the local index does not reveal scan hashes.
+    """
+    mac = hmac.new(AES_KEY, digestmod=hashlib.sha256)
+    src.seek(0)
+    while True:
+        chunk = src.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        mac.update(chunk)
+    src.seek(0)
+    return mac.hexdigest()
+
+
+def _upload_buffer(src: BinaryIO):
+    """The whole upload without another copy where it is already in memory."""
+    if isinstance(src, _BufferReader):
+        return src.view
+    if isinstance(src, io.BytesIO):
+        return src.getbuffer()
+    src.seek(0)
+    data = src.read()
+    src.seek(0)
+    return data
+
+
+def _reencode(src: BinaryIO, fmt: str, quality: int):
+    """Decode the upload and re-encode it; returns the encoded buffer or None."""
+    flag_name, _ = _FORMATS[fmt]
+    flag = getattr(cv2, flag_name, None)
+    if flag is None:
+        return None
+
+    im = cv2.imdecode(np.frombuffer(_upload_buffer(src), np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+        return None
+
+    try:
+        ok, encoded = cv2.imencode(f".{fmt}", im, [flag, quality])
+    except cv2.error as e:
+        logger.warning(f"Re-encoding to {fmt} failed: {e}")
+        return None
+    return encoded if ok else None
+
+
+def archive_image(
+    src: Union[bytes, BinaryIO],
+    source_content_type: str,
+    fmt: str = ARCHIVE_IMAGE_FORMAT,
+    quality: int = ARCHIVE_IMAGE_QUALITY
+) -> dict:
+    """
+    Re-encode, encrypt and pin an original document image to IPFS.
+    Returns the existing entry if the same bytes were archived before.
+    src is the upload's bytes (hashed and decoded in place) or a stream.
+    """
+    if fmt not in _FORMATS:
+        raise ValueError(f"Unsupported archive format: {fmt}")
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = _BufferReader(src)
+
+    digest = content_hash(src)
+    existing = image_archive.get(digest)
+    if existing:
+        logger.info(f"Image already archived: {existing['image_cid']}")
+        return {**existing, "deduplicated": True}
+
+    encoded = _reencode(src, fmt, quality)
+    cipher, key = keyring.new_data_key()
+    if encoded is not None:
+        image_cid = upload_stream_to_ipfs(_BufferReader(encoded), cipher=cipher)
+        media_type = _FORMATS[fmt][1]
+        stored_size = int(encoded.size)
+    else:
+        # Codec unavailable in this OpenCV build: archive the original bytes.
+        logger.warning(f"Archiving original bytes; {fmt} encoding unavailable")
+        src.seek(0)
+        image_cid = upload_stream_to_ipfs(src, cipher=cipher)
+        src.seek(0)
+        media_type = source_content_type
+        stored_size = None
+
+    entry = {
+        "image_cid": image_cid,
+        "key": key,
+        "media_type": media_type,
+        "quality": quality if encoded is not None else None,
+        "stored_size": stored_size,
+        "created_at": datetime.now().isoformat()
+    }
+    image_archive.add(digest, entry)
+    return {**entry, "deduplicated": False}
+
+
+# Global instance
+image_archive = ImageArchive()
@@ -0,0 +1,162 @@
+import os
+import struct
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+
+from app.metrics import metrics
+
+load_dotenv()
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# Longest side each stage needs; larger inputs are decoded at reduced resolution
+FACE_DECODE_MAX_SIDE = int(os.getenv("FACE_DECODE_MAX_SIDE", "1280"))
+DOC_DECODE_MAX_SIDE = int(os.getenv("DOC_DECODE_MAX_SIDE", "2200"))
+
+READ_CHUNK_SIZE = 64 * 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# SOF markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, rejecting it as soon as it exceeds max_bytes."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            metrics.incr("ingest.rejected_bytes")
+            raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes} bytes")
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(status_code=422, detail="Empty image")
+    return b"".join(chunks)
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    i = 2
+    n = len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # no length field
+            i += 2
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        if marker in (0xD9, 0xDA) or length < 2:  # image data starts before any SOF
+            return None
+        i += 2 + length
+    return None
+
+
+def probe_image(data: bytes) -> Tuple[str, int, int]:
+    """
+    Format and dimensions from the image header alone (PNG IHDR / JPEG SOF).
+    Raises 415 for anything that is not a well-formed PNG or JPEG header.
+    """
+    if data.startswith(PNG_SIGNATURE) and len(data) >= 24 and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+    if data.startswith(b"\xff\xd8"):
+        size = _jpeg_size(data)
+        if size:
+            return "jpeg", size[0], size[1]
+    metrics.incr("ingest.rejected_header")
+    raise HTTPException(status_code=415, detail="Not a valid JPEG/PNG image")
+
+
+def decode_image(data: bytes, max_side: int = DOC_DECODE_MAX_SIDE, max_pixels: int = MAX_IMAGE_PIXELS) -> np.ndarray:
+    """
+    Check the header, then decode at the smallest power-of-two reduction that
+    still keeps the long side >= max_side, and resize down the rest of the way.
+    JPEGs are scaled inside libjpeg, so the full-size bitmap is never allocated.
+    """
+    _fmt, width, height = probe_image(data)
+    if width == 0 or height == 0 or width * height > max_pixels:
+        metrics.incr("ingest.rejected_pixels")
+        raise HTTPException(status_code=413, detail=f"Image is {width}x{height}; limit is {max_pixels} pixels")
+
+    flag = cv2.IMREAD_COLOR
+    long_side = max(width, height)
+    for factor, reduced in _REDUCED_FLAGS:
+        if long_side // factor >= max_side:
+            flag = reduced
+            break
+
+    image_bgr = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if image_bgr is None:
+        metrics.incr("ingest.rejected_decode")
+        raise HTTPException(status_code=422, detail="Invalid image content")
+
+    h, w = image_bgr.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        image_bgr = cv2.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    metrics.observe("ingest.decoded_pixels", float(image_bgr.shape[0] * image_bgr.shape[1]))
+    return image_bgr
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies over max_bytes while they stream in, before the
+    multipart parser spools them: on Content-Length up front, otherwise once
+    the received byte count passes the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                metrics.incr("ingest.rejected_bytes")
+                return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    metrics.incr("ingest.rejected_bytes")
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,457 @@
+"""
+End-to-end load test of the API with in-process stand-ins.
+
+    python -m app.loadtest --users 20 --duration 60
+    python -m app.loadtest --users 50 --mix auth=80,enroll=5,upload=10,otp=5 --fake-mode spin
+    python -m app.loadtest --base-url http://10.0.0.5:8000 --mix auth=100
+
+Unless --base-url is given, a uvicorn server is started from a scratch
+directory with every external dependency replaced:
+
+    chain   CHAIN_BACKEND=local (in-memory LocalChain)
+    IPFS    IPFS_BACKEND=local (content-addressed directory)
+    SMTP    aiosmtpd sink in this process (app.smtp_sink)
+    models  FAKE_MODELS=true (app.fake_models, FAKE_*_MS latencies)
+
+Each virtual user owns a wallet and a synthetic face, enrolls once, then
+loops over operations drawn from --mix:
+
+    auth         POST /auth with a slightly perturbed frame
+    auth_stream  POST /auth/stream with a burst of frames
+    enroll       POST /enroll (re-enrollment)
+    upload       POST /identity/upload with a synthetic document
+    otp          POST /mfa/email/request, read the code from the sink,
+                 POST /mfa/email/verify (verifies the email once first)
+
+The report has throughput, status counts and latency percentiles per
+endpoint (after --warmup seconds), the server's CPU/RSS sampled with psutil,
+and the server's own /metrics snapshot. Keep --workers at 1 unless the
+scenario tolerates per-worker state (the vector store and local chain are
+per process).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "auth=70,auth_stream=5,enroll=5,upload=10,otp=10"
+_CODE_RE = re.compile(rb"code is: (\S+)")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in Scenario.OPERATIONS:
+            raise ValueError(f"Unknown operation in --mix: {name}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+# ---------------- synthetic inputs ----------------
+
+def synthetic_face(seed: int) -> np.ndarray:
+    """Random scene, distinct per seed (the fake models treat it as a face)."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 255, size=(6, 8, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (640, 480), interpolation=cv2.INTER_CUBIC)
+    cv2.ellipse(image, (320, 240), (110, 150), 0, 0, 360, [int(v) for v in rng.integers(60, 220, 3)], -1)
+    # Fixed fine texture so frames pass the sharpness check of the quality gate
+    texture = cv2.resize(rng.normal(0, 12, (120, 160, 3)), (640, 480), interpolation=cv2.INTER_NEAREST)
+    return np.clip(image.astype(np.float32) + texture, 0, 255).astype(np.uint8)
+
+
+def perturb(image: np.ndarray, rng: random.Random) -> bytes:
+    """Re-capture of the same scene: sensor noise and a small exposure change, JPEG-encoded."""
+    noise = np.random.default_rng(rng.getrandbits(32)).normal(rng.uniform(-5, 5), 3, image.shape)
+    frame = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def synthetic_document(seed: int) -> np.ndarray:
+    rng = random.Random(seed)
+    image = np.full((640, 1000, 3), 245, dtype=np.uint8)
+    cv2.rectangle(image, (30, 30), (970, 610), (90, 90, 90), 3)
+    lines = ["GOVERNMENT OF INDIA", f"Name: Load Test {seed}", f"DOB: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/19{rng.randint(50, 99)}"]
+    lines.append(" ".join(str(rng.randint(2000, 9999)) for _ in range(3)))
+    for i, text in enumerate(lines):
+        cv2.putText(image, text, (70, 130 + 110 * i), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    return image
+
+
+# ---------------- measurement ----------------
+
+class Recorder:
+    """Latency and status per endpoint; samples before the warm-up deadline are dropped."""
+
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.measured_from: Optional[float] = None
+
+    def add(self, endpoint: str, seconds: float, status):
+        now = time.perf_counter()
+        if now < self.warmup_until:
+            return
+        if self.measured_from is None:
+            self.measured_from = now
+        self.samples[endpoint].append(seconds)
+        self.statuses[endpoint][str(status)] += 1
+
+    def report(self, ended: float) -> dict:
+        window = max(1e-9, ended - (self.measured_from or ended))
+        endpoints = {}
+        for endpoint, values in sorted(self.samples.items()):
+            statuses = dict(self.statuses[endpoint])
+            ok = sum(n for s, n in statuses.items() if s.startswith("2"))
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "ok": ok,
+                "statuses": statuses,
+                "rps": round(len(values) / window, 2),
+                "ok_rps": round(ok / window, 2),
+                "mean_ms": round(1000 * sum(values) / len(values), 1),
+                "p50_ms": round(1000 * _percentile(values, 0.50), 1),
+                "p90_ms": round(1000 * _percentile(values, 0.90), 1),
+                "p95_ms": round(1000 * _percentile(values, 0.95), 1),
+                "p99_ms": round(1000 * _percentile(values, 0.99), 1),
+                "max_ms": round(1000 * max(values), 1),
+            }
+        return {"window_seconds": round(window, 2), "endpoints": endpoints}
+
+
+class ResourceSampler:
+    """CPU and RSS of a process and its children, sampled on a thread."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        import psutil
+
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    def _procs(self):
+        # Keep Process objects across samples: cpu_percent() is relative to the previous call
+        import psutil
+        try:
+            current = [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        procs = [self._known.setdefault(p.pid, p) for p in current]
+        return procs
+
+    def _run(self):
+        import psutil
+        self._known = {}
+        for p in self._procs():
+            p.cpu_percent(None)
+        while not self._stop.wait(self.interval):
+            cpu = rss = threads = 0
+            for p in self._procs():
+                try:
+                    cpu += p.cpu_percent(None)
+                    rss += p.memory_info().rss
+                    threads += p.num_threads()
+                except psutil.NoSuchProcess:
+                    continue
+            self.samples.append((cpu, rss, threads))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return {}
+        cpu = [s[0] for s in self.samples]
+        return {
+            "samples": len(self.samples),
+            "cpu_percent_mean": round(sum(cpu) / len(cpu), 1),
+            "cpu_percent_max": round(max(cpu), 1),
+            "rss_mb_max": round(max(s[1] for s in self.samples) / 2 ** 20, 1),
+            "threads_max": max(s[2] for s in self.samples),
+        }
+
+
+# ---------------- server and stand-ins ----------------
+
+def standin_env(run_dir: str, smtp_port: int, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "CHAIN_BACKEND": "local",
+        "LOCAL_CHAIN_FILE": "",
+        "IPFS_BACKEND": "local",
+        "LOCAL_IPFS_DIR": os.path.join(run_dir, "ipfs"),
+        "FAKE_MODELS": "true",
+        "FAKE_MODEL_MODE": args.fake_mode,
+        "AES_KEY": secrets.token_hex(32),
+        "KEK_KEYS": "v1:" + secrets.token_hex(32),
+        "KEK_ACTIVE": "v1",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_STARTTLS": "false",
+        # Empty values shadow GMAIL/MAIL_PASSWORD from .env: the sink takes no login
+        "SMTP_USER": "",
+        "SMTP_PASS": "",
+        "GMAIL": "",
+        "MAIL_PASSWORD": "",
+        "OTP_DB_PATH": os.path.join(run_dir, "otp.sqlite3"),
+        "ADMISSION_ENABLED": "false" if args.no_admission else "true",
+        "WARMUP_ON_STARTUP": "true",
+    })
+    return env
+
+
+def start_server(run_dir: str, env: dict, port: int, workers: int) -> subprocess.Popen:
+    log = open(os.path.join(run_dir, "server.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+async def wait_ready(session, base_url: str, timeout: float = 120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            async with session.get(f"{base_url}/health") as resp:
+                if resp.status == 200 and (await resp.json()).get("status") == "ok":
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become ready in {timeout:.0f}s")
+
+
+# ---------------- scenario ----------------
+
+class Scenario:
+    OPERATIONS = ("auth", "auth_stream", "enroll", "upload", "otp")
+
+    def __init__(self, session, base_url: str, recorder: Recorder, mix: Dict[str, float], sink=None, think: float = 0.0):
+        self.session = session
+        self.base_url = base_url
+        self.recorder = recorder
+        self.ops = list(mix)
+        self.weights = [mix[o] for o in self.ops]
+        self.sink = sink
+        self.think = think
+
+    async def _call(self, endpoint: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with self.session.request(method, self.base_url + path, **kwargs) as resp:
+                body = await resp.read()
+                status = resp.status
+        except Exception as e:
+            body, status = b"", type(e).__name__
+        self.recorder.add(endpoint, time.perf_counter() - start, status)
+        return status, body
+
+    @staticmethod
+    def _image_form(field: str, data: bytes, **fields):
+        import aiohttp
+        form = aiohttp.FormData()
+        for k, v in fields.items():
+            form.add_field(k, v)
+        form.add_field(field, data, filename=f"{field}.jpg", content_type="image/jpeg")
+        return form
+
+    async def _read_code(self, address: str, previous: Optional[bytes], timeout: float = 10.0) -> Optional[str]:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            content = self.sink.handler.latest.get(address)
+            if content is not None and content is not previous:
+                match = _CODE_RE.search(content)
+                return match.group(1).decode() if match else None
+            await asyncio.sleep(0.02)
+        return None
+
+    async def user(self, index: int, deadline: float):
+        rng = random.Random(index)
+        wallet = "0x" + "%040x" % rng.getrandbits(160)
+        face = synthetic_face(index)
+        document = synthetic_document(index)
+        address = f"{wallet}@loadtest.local"
+        email_verified = False
+
+        await self._call("enroll", "POST", f"/enroll?wallet={wallet}", data=self._image_form("image", perturb(face, rng)))
+        while time.perf_counter() < deadline:
+            op = rng.choices(self.ops, self.weights)[0]
+            if op == "auth":
+                await self._call("auth", "POST", f"/auth?wallet={wallet}", data=self._image_form("image", perturb(face, rng)))
+            elif op == "auth_stream":
+                import aiohttp
+                form = aiohttp.FormData()
+                for i in range(5):
+                    form.add_field("frames", perturb(face, rng), filename=f"f{i}.jpg", content_type="image/jpeg")
+                await self._call("auth_stream", "POST", f"/auth/stream?wallet={wallet}", data=form)
+            elif op == "enroll":
+                await self._call("enroll", "POST", f"/enroll?wallet={wallet}", data=self._image_form("image", perturb(face, rng)))
+            elif op == "upload":
+                # A fresh scan each time: identical bytes would be answered from
+                # the idempotency cache without reaching admission or the pipeline
+                await self._call("upload", "POST", "/identity/upload", data=self._image_form(
+                    "image", perturb(document, rng), wallet=wallet, document="aadhaar", archive_original="false"
+                ))
+            elif op == "otp" and self.sink is not None:
+                if not email_verified:
+                    previous = self.sink.handler.latest.get(address)
+                    status, _ = await self._call("email_enroll", "POST", "/enroll/email", data={"wallet": wallet, "email": address})
+                    code = await self._read_code(address, previous) if status == 200 else None
+                    if code:
+                        status, _ = await self._call("email_verify", "POST", "/enroll/email/verify",
+                                                     data={"wallet": wallet, "email": address, "token": code})
+                        email_verified = status == 200
+                    continue
+                previous = self.sink.handler.latest.get(address)
+                status, _ = await self._call("otp_request", "POST", "/mfa/email/request", data={"wallet": wallet})
+                code = await self._read_code(address, previous) if status == 200 else None
+                if code:
+                    await self._call("otp_verify", "POST", "/mfa/email/verify", data={"wallet": wallet, "otp": code})
+            if self.think:
+                await asyncio.sleep(rng.expovariate(1 / self.think))
+
+
+async def run(args) -> dict:
+    import aiohttp
+
+    mix = parse_mix(args.mix)
+    run_dir = args.run_dir or tempfile.mkdtemp(prefix="loadtest-")
+    os.makedirs(run_dir, exist_ok=True)
+    server = sink = sampler = None
+    base_url = args.base_url
+    try:
+        if base_url is None:
+            from app.smtp_sink import start_sink
+
+            smtp_port = _free_port()
+            sink = start_sink(port=smtp_port, latency_ms=args.smtp_latency_ms)
+            port = _free_port()
+            server = start_server(run_dir, standin_env(run_dir, smtp_port, args), port, args.workers)
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"🚀 Server starting in {run_dir} (log: server.log)")
+        elif "otp" in mix:
+            print("⚠️ otp operations need the local SMTP sink; skipping them against --base-url")
+
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_ready(session, base_url)
+            if server is not None:
+                sampler = ResourceSampler(server.pid)
+                sampler.start()
+
+            started = time.perf_counter()
+            recorder = Recorder(warmup_until=started + args.warmup)
+            scenario = Scenario(session, base_url, recorder, mix, sink=sink, think=args.think_ms / 1000.0)
+            deadline = started + args.warmup + args.duration
+            print(f"⏱️  {args.users} users, {args.warmup:.0f}s warm-up + {args.duration:.0f}s measured, mix {args.mix}")
+            await asyncio.gather(*(scenario.user(i, deadline) for i in range(args.users)))
+            ended = time.perf_counter()
+
+            report = {
+                "config": {k: v for k, v in vars(args).items()},
+                **recorder.report(ended),
+                "server_resources": sampler.stop() if sampler else None,
+            }
+            sampler = None
+            try:
+                async with session.get(f"{base_url}/metrics") as resp:
+                    report["server_metrics"] = await resp.json()
+            except Exception as e:
+                report["server_metrics"] = {"error": str(e)}
+        if sink is not None:
+            report["emails_received"] = sink.handler.received
+        return report
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if sink is not None:
+            sink.stop()
+        if args.run_dir is None and not args.keep:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def print_report(report: dict):
+    print(f"\n{'endpoint':<14}{'reqs':>7}{'ok':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  statuses")
+    for endpoint, r in report["endpoints"].items():
+        statuses = " ".join(f"{s}:{n}" for s, n in sorted(r["statuses"].items()))
+        print(f"{endpoint:<14}{r['requests']:>7}{r['ok']:>7}{r['rps']:>8.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}  {statuses}")
+    resources = report.get("server_resources")
+    if resources:
+        print(f"\nserver cpu mean {resources['cpu_percent_mean']}% max {resources['cpu_percent_max']}%, "
+              f"rss max {resources['rss_mb_max']} MB, threads max {resources['threads_max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end API load test with local stand-ins")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users (one wallet each)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds run before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. auth=70,upload=10")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a user's operations")
+    parser.add_argument("--base-url", help="Target an already running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local server")
+    parser.add_argument("--fake-mode", choices=["sleep", "spin"], default="sleep",
+                        help="Fake models sleep through their latency or keep a core busy")
+    parser.add_argument("--smtp-latency-ms", type=float, default=0.0, help="Per-message delay in the SMTP sink")
+    parser.add_argument("--no-admission", action="store_true", help="Start the server with admission control off")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--run-dir", help="Server working directory (default: temporary, removed afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary run directory")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
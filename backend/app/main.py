@@ -1,25 +1,61 @@
+import asyncio
 import os
+import threading
+import time
 import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import hashlib
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 from dotenv import load_dotenv
+from app.runtime_config import FACE_DEVICE  # sets OMP/MKL pool sizes before the native libs load
 import numpy as np
-from deepface import DeepFace
 import cv2
 
-from app.imageParser import imageToString
-from app.fileUpload import upload_identity_document
-from app.models import EnrollResponse, AuthResponse
-from app.face_pipeline import FacePipeline
-from app.storage import VectorStore
-from app.utils.hashing import build_commitment
+# FAKE_MODELS swaps the face and document models for deterministic stand-ins (load tests).
+# Fake embeddings and documents must never reach a real chain or IPFS node.
+FAKE_MODELS = os.getenv("FAKE_MODELS", "false").lower() in ("1", "true", "yes")
+if FAKE_MODELS:
+    from app.blockchain.local_chain import CHAIN_BACKEND
+    from app.fileUpload import IPFS_BACKEND
+    if CHAIN_BACKEND != "local" or IPFS_BACKEND != "local":
+        raise RuntimeError(
+            f"FAKE_MODELS requires CHAIN_BACKEND=local and IPFS_BACKEND=local "
+            f"(got {CHAIN_BACKEND}, {IPFS_BACKEND}); use python -m app.loadtest"
+        )
+    from app.fake_models import FakeFacePipeline as FacePipeline, fake_extract_document as extract_document
+else:
+    from app.imageParser import extract_document
+    from app.face_pipeline import FacePipeline
+from app.fileUpload import upload_identity_document, stream_from_ipfs
+from app.image_archive import archive_image, image_archive, ARCHIVE_ORIGINAL_IMAGES
+from app.models import EnrollResponse, AuthResponse, StreamAuthResponse
+from app.sharded_storage import open_vector_store, VECTOR_SHARD_ADDRESSES
+from app.utils.hashing import build_commitment, verify_merkle_proof
+from web3 import Web3
 from app.blockchain.face_auth.service import set_face_commitment as onchain_set, get_face_commitment as onchain_get
 from app.blockchain.identity_docs.service import (
     set_identity_commitment,
     get_identity_commitment,
     verify_identity_commitment
 )
+from app.blockchain.indexer import chain_indexer, INDEXER_FOLLOW
 from app.document_storage import doc_store
+from app.snapshot import Snapshotter
+from app.envelope import ENVELOPE_FIELDS, KEK_ROTATE_ON_START, rotate as rotate_keys
+from app.metrics import metrics
+from app.embedding_cache import embedding_cache, face_dhash, frame_digest
+from app.idempotency import idempotency_cache
+from app.image_ingest import (
+    read_upload, decode_image, BodySizeLimitMiddleware,
+    MAX_UPLOAD_BYTES, FACE_DECODE_MAX_SIDE, DOC_DECODE_MAX_SIDE
+)
+from app.stream_auth import StreamAuthSession, STREAM_IDLE_SECONDS, STREAM_MAX_FRAMES
+from app.face_quality import quality_failure_message
+from app.email_outbox import email_outbox
+from app.admission import admission
 from app.mfa_email import (
     send_verification_email, verify_enrollment_email,
     send_action_otp, verify_action_otp
@@ -36,9 +72,72 @@ app.add_middleware(
     allow_methods=["*"], 
     allow_headers=["*"],
 )
+app.add_middleware(BodySizeLimitMiddleware)
+
+pipeline = FacePipeline(device=FACE_DEVICE)
+store = open_vector_store(dim=512, use_cosine=True)
+snapshotter = Snapshotter()
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+@app.on_event("startup")
+async def warmup_models():
+    """Pay lazy model initialisation before the worker starts accepting requests."""
+    if WARMUP_ON_STARTUP:
+        await run_in_threadpool(pipeline.warmup)
+
+
+@app.on_event("startup")
+async def start_chain_indexer():
+    if INDEXER_FOLLOW:
+        chain_indexer.start()
+
+
+@app.on_event("startup")
+async def start_key_rotation():
+    if KEK_ROTATE_ON_START:
+        # Re-wraps in batches under the stores' locks while requests are served
+        threading.Thread(
+            target=rotate_keys, args=(doc_store, image_archive), name="kek-rotation", daemon=True
+        ).start()
+
+
+@app.on_event("startup")
+async def start_snapshots():
+    # Remote shard servers keep their own data; the coordinator has nothing to snapshot
+    if not VECTOR_SHARD_ADDRESSES:
+        snapshotter.start()
 
-pipeline = FacePipeline(device="cpu")
-store = VectorStore(dim=512, use_cosine=True)
+
+@app.on_event("shutdown")
+async def drain_outbox():
+    """Give queued emails a chance to go out before the worker exits."""
+    await run_in_threadpool(email_outbox.close)
+    chain_indexer.close()
+    snapshotter.close()
+
+
+def _commitment_history(commitment: str, event: Optional[str] = None) -> List[dict]:
+    """Indexed on-chain events for a commitment; empty if the index is unavailable."""
+    try:
+        return [
+            {"event": e["event"], "block_number": e["block_number"], "transaction_hash": e["tx_hash"], "timestamp": e["timestamp"]}
+            for e in chain_indexer.find_commitment(commitment, event=event)
+        ]
+    except Exception as e:
+        print(f"⚠️ Chain index lookup failed: {e}")
+        return []
+
+def _commitment_in_block(commitment: str, block_number: int, event: Optional[str] = None) -> List[dict]:
+    """On-chain events for a commitment in a known block; empty if the chain is unreachable."""
+    try:
+        return [
+            {"event": e["event"], "block_number": e["block_number"], "transaction_hash": e["tx_hash"], "timestamp": e["timestamp"]}
+            for e in chain_indexer.events_at(block_number, commitment, event=event)
+        ]
+    except Exception as e:
+        print(f"⚠️ Chain lookup failed: {e}")
+        return []
 
 def validate_wallet(addr: str) -> str:
     """Validate Ethereum wallet address format."""
@@ -50,28 +149,53 @@ def validate_wallet(addr: str) -> str:
 # ==================== FACE AUTHENTICATION ROUTES ====================
 
 @app.post("/enroll", response_model=EnrollResponse)
-async def enroll(wallet: str, image: UploadFile = File(...)):
+async def enroll(
+    wallet: str,
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Enroll user with face authentication and commit to blockchain."""
     wallet = validate_wallet(wallet)
 
     if image.content_type not in ("image/jpeg", "image/png"):
         raise HTTPException(status_code=400, detail="Only JPEG/PNG supported")
 
-    image_bytes = await image.read()
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if image_bgr is None:
-        raise HTTPException(status_code=422, detail="Invalid image content")
-    
+    image_bytes = await read_upload(image)
+
+    async def run_enroll():
+        result = await admission.run("enroll", wallet, lambda: run_in_threadpool(_enroll_image, wallet, image_bytes))
+        # The wallet's earlier enrollments (and their user_ids) are gone now
+        idempotency_cache.invalidate(wallet, "enroll")
+        return result
+
+    # Retries of the same enrollment return the stored result
+    return await idempotency_cache.run(
+        "enroll", wallet, [hashlib.sha256(image_bytes).hexdigest()], run_enroll,
+        idempotency_key=idempotency_key
+    )
+
+
+def _enroll_image(wallet: str, image_bytes: bytes) -> EnrollResponse:
+    image_bgr = decode_image(image_bytes, max_side=FACE_DECODE_MAX_SIDE)
+
+    # Detect and check quality first; blurry, dark, tiny or off-pose frames
+    # never reach the anti-spoofing model or the embedder
+    aligned, box, _prob, landmarks = pipeline.detect_face(image_bgr)
+    if aligned is None:
+        raise HTTPException(status_code=422, detail="No face detected")
+    quality = pipeline.assess_quality(image_bgr, box, landmarks)
+    if not quality["ok"]:
+        raise HTTPException(status_code=422, detail=quality_failure_message(quality))
+
     # Liveness check
     liveness_result = pipeline.check_liveness_from_bgr(image_bgr)
     if not liveness_result["is_live"]:
         raise HTTPException(status_code=422, detail="Liveness check failed: Spoof detected")
 
     # Extract face embedding
-    emb = pipeline.image_to_embedding(image_bytes)
-    if emb is None:
-        raise HTTPException(status_code=422, detail="No face detected")
+    emb = pipeline.embed(aligned)
+
+    embedding_cache.invalidate(wallet)
 
     # Remove old wallet binding if exists
     old_rec = store.get_wallet_record(wallet)
@@ -111,32 +235,58 @@ async def auth(wallet: str, image: UploadFile = File(...)):
     if image.content_type not in ("image/jpeg", "image/png"):
         raise HTTPException(status_code=400, detail="Only JPEG/PNG supported")
 
-    image_bytes = await image.read()
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if image_bgr is None:
-        raise HTTPException(status_code=422, detail="Invalid image content")
+    image_bytes = await read_upload(image)
+    async with admission.admit("auth", wallet):
+        return await run_in_threadpool(_auth_image, wallet, image_bytes)
 
-    # Liveness detection
-    liveness_result = pipeline.check_liveness_from_bgr(image_bgr)
-    if not liveness_result["is_live"]:
+
+def _auth_image(wallet: str, image_bytes: bytes) -> AuthResponse:
+    image_bgr = decode_image(image_bytes, max_side=FACE_DECODE_MAX_SIDE)
+
+    # Align first: the crop is needed for the embedding anyway and its
+    # perceptual hash keys the short-lived per-wallet cache.
+    aligned, box, _prob, landmarks = pipeline.detect_face(image_bgr)
+    if aligned is None:
         return AuthResponse(
             user_id=None, 
             score=0.0, 
             passed=False, 
-            message="Liveness check failed: Spoof detected"
+            message="No face detected"
         )
 
-    # Face matching
-    emb = pipeline.image_to_embedding(image_bytes)
-    if emb is None:
+    quality = pipeline.assess_quality(image_bgr, box, landmarks)
+    if not quality["ok"]:
         return AuthResponse(
-            user_id=None, 
-            score=0.0, 
-            passed=False, 
-            message="No face detected"
+            user_id=None,
+            score=0.0,
+            passed=False,
+            message=quality_failure_message(quality),
+            quality_reason=quality["reason"]
         )
 
+    phash = face_dhash(aligned)
+    digest = frame_digest(image_bytes)
+    del image_bytes
+    cached = embedding_cache.get(wallet, phash, digest)
+    if cached is not None:
+        emb = cached["embedding"]
+    else:
+        started = time.perf_counter()
+
+        # Liveness detection
+        liveness_result = pipeline.check_liveness_from_bgr(image_bgr)
+        if not liveness_result["is_live"]:
+            return AuthResponse(
+                user_id=None, 
+                score=0.0, 
+                passed=False, 
+                message="Liveness check failed: Spoof detected"
+            )
+
+        # Face matching
+        emb = pipeline.embed(aligned)
+        embedding_cache.put(wallet, phash, digest, emb, liveness_result, time.perf_counter() - started)
+
     matched_user, score = store.search(emb, k=1)
     passed = bool(matched_user is not None and score >= SIM_THRESHOLD)
     message = "Authenticated" if passed else "Not matched"
@@ -154,15 +304,104 @@ async def auth(wallet: str, image: UploadFile = File(...)):
         message=message
     )
 
+
+@app.post("/auth/stream", response_model=StreamAuthResponse)
+async def auth_stream(wallet: str, frames: List[UploadFile] = File(...)):
+    """
+    Authenticate from a burst of frames (multipart, in capture order).
+    Stops reading frames as soon as liveness and match are decided.
+    """
+    wallet = validate_wallet(wallet)
+
+    session = StreamAuthSession(pipeline, store, wallet)
+    async with admission.admit("auth_stream", wallet):
+        for frame in frames[:STREAM_MAX_FRAMES]:
+            if frame.content_type not in ("image/jpeg", "image/png"):
+                raise HTTPException(status_code=400, detail="Only JPEG/PNG supported")
+            image_bgr = decode_image(await read_upload(frame), max_side=FACE_DECODE_MAX_SIDE)
+            if await run_in_threadpool(session.feed, image_bgr):
+                break
+        return session.finish()
+
+
+@app.websocket("/auth/stream/ws")
+async def auth_stream_ws(websocket: WebSocket, wallet: str):
+    """
+    Same as POST /auth/stream over a WebSocket: send frames as binary
+    messages, "end" as text when out of frames. Each frame is answered with
+    {"status": "continue"} until the final {"status": "done", ...}.
+
+    A shed connection gets {"status": "error", "detail", "retry_after"}
+    and close code 1013 (try again later); a socket idle for
+    STREAM_IDLE_SECONDS is closed with 1008.
+    """
+    # Accept first: closing before accept becomes an HTTP 403 and the
+    # client never sees the close code
+    await websocket.accept()
+    try:
+        wallet = validate_wallet(wallet)
+    except HTTPException:
+        await websocket.close(code=1008, reason="Invalid wallet address")
+        return
+
+    try:
+        async with admission.admit("auth_stream", wallet):
+            await _auth_stream_ws(websocket, wallet)
+    except HTTPException as e:
+        retry_after = int((e.headers or {}).get("Retry-After", "1"))
+        try:
+            await websocket.send_json({"status": "error", "detail": e.detail, "retry_after": retry_after})
+            await websocket.close(code=1013, reason=f"{e.detail}; retry after {retry_after}s")
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+
+async def _auth_stream_ws(websocket: WebSocket, wallet: str):
+    session = StreamAuthSession(pipeline, store, wallet)
+    try:
+        result = None
+        while result is None:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), STREAM_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                metrics.incr("stream_auth.idle_closed")
+                await websocket.close(code=1008, reason="Idle timeout")
+                return
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                if message.get("text") == "end":
+                    result = session.finish()
+                continue
+            if len(data) > MAX_UPLOAD_BYTES:
+                await websocket.close(code=1009)
+                return
+            try:
+                image_bgr = decode_image(data, max_side=FACE_DECODE_MAX_SIDE)
+            except HTTPException as e:
+                await websocket.send_json({"status": "error", "detail": e.detail})
+                continue
+            result = await run_in_threadpool(session.feed, image_bgr)
+            if result is None:
+                await websocket.send_json({"status": "continue", "frames_used": session.frames})
+        await websocket.send_json({"status": "done", **result})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @app.post("/enroll/email")
 async def enroll_email(wallet: str = Form(...), email: str = Form(...)):
     """Send email verification for enrollment."""
-    return send_verification_email(wallet, email)
+    async with admission.admit("email", wallet.lower()):
+        return await run_in_threadpool(send_verification_email, wallet, email)
 
 @app.post("/enroll/email/verify")
 async def verify_enroll_email(wallet: str = Form(...), email: str = Form(...), token: str = Form(...)):
     """Verify user's email and save encrypted email."""
-    if verify_enrollment_email(wallet, email, token):
+    async with admission.admit("email_verify", wallet.lower()):
+        verified = await run_in_threadpool(verify_enrollment_email, wallet, email, token)
+    if verified:
         return {"status": "verified", "message": "Email successfully verified"}
     raise HTTPException(status_code=400, detail="Email verification failed")
 
@@ -176,6 +415,18 @@ def onchain(wallet: str):
     return {"wallet": wallet, "commitment": commitment}
 
 
+@app.get("/onchain/commitment/{commitment}")
+def onchain_commitment_history(commitment: str):
+    """Every indexed on-chain event that set this commitment (local lookup, no RPC)."""
+    history = _commitment_history(commitment)
+    return {
+        "commitment": commitment,
+        "committed": bool(history),
+        "events": history,
+        "indexed_to_block": chain_indexer.checkpoint()
+    }
+
+
 @app.get("/binding/{wallet}")
 def binding(wallet: str):
     """Get wallet binding information."""
@@ -264,7 +515,9 @@ def binding(wallet: str):
 async def upload_document(
     wallet: str = Form(...),
     document: str = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    archive_original: Optional[bool] = Form(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Upload identity document, extract data, upload to IPFS, and commit to blockchain."""
     wallet = validate_wallet(wallet)
@@ -278,35 +531,80 @@ async def upload_document(
 
     if image.content_type not in ("image/jpeg", "image/png"):
         raise HTTPException(status_code=400, detail="Only JPEG/PNG supported")
-    
+
+    if archive_original is None:
+        archive_original = ARCHIVE_ORIGINAL_IMAGES
+
+    image_bytes = await read_upload(image)
+
+    # Retries of the same upload return the stored result; concurrent
+    # duplicates wait for the first one instead of re-running the pipeline.
+    return await idempotency_cache.run(
+        "identity/upload", wallet, [document, str(archive_original), hashlib.sha256(image_bytes).hexdigest()],
+        lambda: admission.run(
+            "upload", wallet,
+            lambda: _process_upload(wallet, document, image_bytes, image.content_type, archive_original)
+        ),
+        idempotency_key=idempotency_key,
+        cache_if=lambda result: result.get("status") == "success"
+    )
+
+
+async def _process_upload(
+    wallet: str,
+    document: str,
+    image_bytes: bytes,
+    content_type: str,
+    archive_original: bool
+) -> dict:
     try:
-        # Extract data
-        extracted_data = imageToString(image, document)
-        
+        # Extract data (off the event loop; OCR runs in its own worker pool)
+        image_bgr = await run_in_threadpool(decode_image, image_bytes, DOC_DECODE_MAX_SIDE)
+        extraction = await run_in_threadpool(extract_document, image_bgr, document)
+        del image_bgr
+        extracted_data = extraction["fields"]
+
         if not extracted_data:
             raise HTTPException(status_code=422, detail="Failed to extract data from document")
+
+        # Store the detected type when the client asked for auto-detection
+        document = extraction["document_type"]
         
+        # Optionally archive the original scan (re-encoded, encrypted).
+        # Encoding, IPFS adds and the chain transaction block for seconds,
+        # so they run off the event loop like extraction.
+        image_cid = None
+        if archive_original:
+            archived = await run_in_threadpool(archive_image, image_bytes, content_type)
+            image_cid = archived["image_cid"]
+
         # Upload to IPFS
-        ipfs_result = upload_identity_document(
+        ipfs_result = await run_in_threadpool(
+            upload_identity_document,
             extracted_data=extracted_data,
             doc_type=document,
-            wallet_address=wallet
+            wallet_address=wallet,
+            image_cid=image_cid
         )
         
         ipfs_cid = ipfs_result["ipfs_cid"]
         
         # Commit to blockchain
-        blockchain_result = set_identity_commitment(ipfs_cid)
+        blockchain_result = await run_in_threadpool(set_identity_commitment, ipfs_cid)
         
         if blockchain_result["success"]:
             # ✅ NEW: Store document reference
-            doc_store.add_document(wallet, {
+            doc_record = {
                 "ipfs_cid": ipfs_cid,
+                "key": ipfs_result["key"],
                 "document_type": document,
                 "timestamp": ipfs_result["metadata"]["timestamp"],
                 "transaction_hash": blockchain_result["transaction_hash"],
                 "block_number": blockchain_result["block_number"]
-            })
+            }
+            if image_cid:
+                doc_record["image_cid"] = image_cid
+            await run_in_threadpool(doc_store.add_document, wallet, doc_record)
             
             return {
                 "status": "success",
@@ -314,8 +612,16 @@ async def upload_document(
                 "wallet": wallet,
                 "document_type": document,
                 "extracted_data": extracted_data,
+                "extraction": {
+                    "source": extraction["source"],
+                    "detected": extraction["detected"],
+                    "invalid_fields": extraction["invalid_fields"],
+                    "passes": extraction["passes"],
+                    "timings": extraction["timings"]
+                },
                 "ipfs": {
                     "cid": ipfs_cid,
+                    "image_cid": image_cid,
                     "encrypted": True
                 },
                 "blockchain": {
@@ -332,26 +638,54 @@ async def upload_document(
                 "wallet": wallet,
                 "extracted_data": extracted_data,
                 "ipfs_cid": ipfs_cid,
+                "image_cid": image_cid,
                 "blockchain_error": blockchain_result["error"]
             }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @app.get("/identity/verify/{ipfs_cid}")
-async def verify_document(ipfs_cid: str):
+def verify_document(ipfs_cid: str):
     """
     Verify if a document's IPFS CID matches the blockchain commitment.
+
+    A document is valid if its commitment is the current global commitment
+    or was committed earlier; the history comes from the local chain index.
+    Batch-ingested documents record the block their root was committed in,
+    so when the index has not caught up (INDEXER_FOLLOW off) that block is
+    read from the chain directly. All of these are blocking RPC / SQLite
+    calls, so this is a plain def and runs in the threadpool.
     
     Args:
         ipfs_cid: IPFS Content Identifier to verify
     """
     try:
-        is_valid = verify_identity_commitment(ipfs_cid)
+        record = doc_store.find_document(ipfs_cid)
+        if record and record.get("merkle_proof"):
+            # Batch-ingested document: prove membership in the committed root
+            commitment = record["merkle_root"] if verify_merkle_proof(
+                bytes(Web3.keccak(text=ipfs_cid)),
+                record["merkle_proof"],
+                bytes.fromhex(record["merkle_root"])
+            ) else None
+            is_current = commitment is not None and get_identity_commitment() == commitment
+        else:
+            commitment = bytes(Web3.keccak(text=ipfs_cid)).hex()
+            is_current = verify_identity_commitment(ipfs_cid)
+
+        history = _commitment_history(commitment, event="GlobalCommitmentSet") if commitment else []
+        if commitment and not history and not is_current and (record or {}).get("block_number") is not None:
+            history = _commitment_in_block(commitment, record["block_number"], event="GlobalCommitmentSet")
+        is_valid = is_current or bool(history)
         
         return {
             "ipfs_cid": ipfs_cid,
             "verified": is_valid,
+            "current": is_current,
+            "committed_in": history,
             "message": "Document verified on blockchain" if is_valid else "Document not found or tampered",
             "status": "valid" if is_valid else "invalid"
         }
@@ -384,7 +718,8 @@ async def retrieve_document(ipfs_cid: str):
     try:
         from app.fileUpload import fetch_json_from_ipfs
         
-        document_data = fetch_json_from_ipfs(ipfs_cid)
+        record = doc_store.find_document(ipfs_cid) or {}
+        document_data = fetch_json_from_ipfs(ipfs_cid, key=record.get("key"))
         
         return {
             "status": "success",
@@ -421,8 +756,13 @@ async def adding_document_legacy(
 def health():
     """Health check endpoint."""
     return {
-        "status": "ok",
+        "status": "ok" if pipeline.warmed_up or not WARMUP_ON_STARTUP else "warming_up",
         "service": "Face Auth + Identity Docs",
+        "face_backend": pipeline.backend,
+        "model_load_seconds": pipeline.load_timings,
+        "warmup_seconds": pipeline.warmup_timings,
+        "chain_index": chain_indexer.status(),
+        "snapshot": snapshotter.status(),
         "features": [
             "face_authentication",
             "identity_document_ocr",
@@ -432,6 +772,12 @@ def health():
     }
 
 
+@app.get("/metrics")
+def get_metrics():
+    """In-process counters, gauges and stage timings, plus admission limits."""
+    return {**metrics.snapshot(), "admission": admission.snapshot()}
+
+
 @app.get("/")
 def root():
     """Root endpoint with API information."""
@@ -442,16 +788,21 @@ def root():
             "face_auth": {
                 "enroll": "POST /enroll",
                 "authenticate": "POST /auth",
+                "authenticate_stream": "POST /auth/stream",
+                "authenticate_stream_ws": "WS /auth/stream/ws",
                 "check_commitment": "GET /onchain/{wallet}",
+                "commitment_history": "GET /onchain/commitment/{commitment}",
                 "check_binding": "GET /binding/{wallet}"
             },
             "identity_docs": {
                 "upload": "POST /identity/upload",
                 "verify": "GET /identity/verify/{ipfs_cid}",
                 "get_commitment": "GET /identity/commitment",
-                "retrieve": "GET /identity/document/{ipfs_cid}"
+                "retrieve": "GET /identity/document/{ipfs_cid}",
+                "retrieve_image": "GET /identity/document/{ipfs_cid}/image"
             },
-            "health": "GET /health"
+            "health": "GET /health",
+            "metrics": "GET /metrics"
         }
     }
 
@@ -464,7 +815,11 @@ async def get_wallet_documents(wallet: str):
     wallet = validate_wallet(wallet)
     
     try:
-        documents = doc_store.get_documents(wallet)
+        # Wrapped data keys stay server-side
+        documents = [
+            {k: v for k, v in doc.items() if k not in ENVELOPE_FIELDS}
+            for doc in doc_store.get_documents(wallet)
+        ]
         
         return {
             "wallet": wallet,
@@ -483,7 +838,8 @@ async def get_document_data(ipfs_cid: str):
     try:
         from app.fileUpload import fetch_json_from_ipfs
         
-        document_data = fetch_json_from_ipfs(ipfs_cid)
+        record = doc_store.find_document(ipfs_cid) or {}
+        document_data = fetch_json_from_ipfs(ipfs_cid, key=record.get("key"))
         
         return {
             "status": "success",
@@ -495,6 +851,23 @@ async def get_document_data(ipfs_cid: str):
         raise HTTPException(status_code=500, detail=f"Failed to retrieve document: {str(e)}")
 
 
+@app.get("/identity/document/{ipfs_cid}/image")
+async def get_document_image(ipfs_cid: str):
+    """
+    Stream the archived original image for a document, decrypted on the fly.
+    """
+    record = doc_store.find_document(ipfs_cid)
+    if not record or not record.get("image_cid"):
+        raise HTTPException(status_code=404, detail="No archived image for this document")
+
+    image_cid = record["image_cid"]
+    entry = image_archive.find_by_cid(image_cid) or {}
+    return StreamingResponse(
+        stream_from_ipfs(image_cid, key=entry.get("key")),
+        media_type=entry.get("media_type", "application/octet-stream")
+    )
+
+
 @app.delete("/identity/document/{ipfs_cid}")
 async def delete_document(ipfs_cid: str, wallet: str):
     """
@@ -506,6 +879,8 @@ async def delete_document(ipfs_cid: str, wallet: str):
         success = doc_store.remove_document(wallet, ipfs_cid)
         
         if success:
+            # A later re-upload of the same document must run again
+            idempotency_cache.invalidate(wallet, "identity/upload")
             return {
                 "status": "success",
                 "message": "Document reference removed",
@@ -519,11 +894,26 @@ async def delete_document(ipfs_cid: str, wallet: str):
 @app.post("/mfa/email/request")
 async def request_action_otp(wallet: str = Form(...)):
     """Send fresh OTP for this wallet every time."""
-    return send_action_otp(wallet)
+    async with admission.admit("email", wallet.lower()):
+        return await run_in_threadpool(send_action_otp, wallet)
+
+@app.get("/mfa/email/status/{message_id}")
+def email_status(message_id: str):
+    """
+    Delivery status of a queued verification/OTP email. The outbox is per
+    worker process, so with several workers the poll must reach the worker
+    that queued the message (e.g. sticky routing); others answer 404.
+    """
+    status = email_outbox.status(message_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown message id (status is kept by the worker that queued it)")
+    return {"message_id": message_id, **status}
 
 @app.post("/mfa/email/verify")
 async def verify_action(wallet: str = Form(...), otp: str = Form(...)):
     """Verify OTP before performing sensitive action."""
-    if verify_action_otp(wallet, otp):
+    async with admission.admit("email_verify", wallet.lower()):
+        verified = await run_in_threadpool(verify_action_otp, wallet, otp)
+    if verified:
         return {"status": "granted", "message": "OTP verified, action allowed"}
     raise HTTPException(status_code=400, detail="Invalid OTP")
\ No newline at end of file
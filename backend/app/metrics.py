@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+# Samples kept per timing for percentile estimates
+RESERVOIR_SIZE = 512
+
+
+class Metrics:
+    """Small in-process registry of counters, gauges and timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self._timings: Dict[str, dict] = {}
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            t = self._timings.get(name)
+            if t is None:
+                t = {"count": 0, "total": 0.0, "max": 0.0, "recent": deque(maxlen=RESERVOIR_SIZE)}
+                self._timings[name] = t
+            t["count"] += 1
+            t["total"] += seconds
+            t["max"] = max(t["max"], seconds)
+            t["recent"].append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """Return a JSON-serialisable view of every metric."""
+        with self._lock:
+            timings = {}
+            for name, t in self._timings.items():
+                recent = sorted(t["recent"])
+                timings[name] = {
+                    "count": t["count"],
+                    "mean_ms": round(1000 * t["total"] / t["count"], 3),
+                    "p50_ms": round(1000 * _percentile(recent, 0.50), 3),
+                    "p95_ms": round(1000 * _percentile(recent, 0.95), 3),
+                    "max_ms": round(1000 * t["max"], 3),
+                }
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": timings,
+            }
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+# Global instance
+metrics = Metrics()
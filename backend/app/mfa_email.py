@@ -1,55 +1,55 @@
 import secrets
-import time
 import hashlib
-import smtplib
-from email.message import EmailMessage
 from datetime import datetime
 from fastapi import HTTPException
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 from dotenv import load_dotenv
 from app.document_storage import doc_store
+from app.envelope import keyring
+from app.email_outbox import email_outbox, OutboxFull
+from app.otp_store import otp_store, OTP_OK, OTP_MISSING, OTP_EXPIRED, OTP_LOCKED, OTP_THROTTLED
 
 load_dotenv()
 
 # ==================== CONFIG ====================
-SMTP_HOST = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USER = os.getenv("GMAIL")
-SMTP_PASS = os.getenv("MAIL_PASSWORD")  # use Gmail app password or provider API key
+# SMTP settings (SMTP_HOST/PORT/USER/PASS, pool size, retries) live in app.email_outbox
 AES_KEY = bytes.fromhex(os.getenv("AES_KEY"))
 OTP_TTL_SECONDS = 300  # 5 minutes
 AESGCM_KEY = AESGCM(AES_KEY)
 
-# In-memory OTP store: {wallet: {otp_hash, salt, expires_at}}
-OTP_CACHE = {}
+# Pending tokens/OTPs live in app.otp_store (shared SQLite, active expiry)
+ENROLL_PURPOSE = "enroll_email"
+ACTION_PURPOSE = "action_otp"
 
 # ==================== HELPERS ====================
-def encrypt_str(data: str) -> str:
+def encrypt_str(data: str, cipher: AESGCM = None) -> str:
     nonce = os.urandom(12)
-    ct = AESGCM_KEY.encrypt(nonce, data.encode(), None)
+    ct = (cipher or AESGCM_KEY).encrypt(nonce, data.encode(), None)
     return (nonce + ct).hex()
 
-def decrypt_str(enc_hex: str) -> str:
+def decrypt_str(enc_hex: str, key: dict = None) -> str:
+    """key is the record's wrapped data key; None for records stored under AES_KEY."""
     raw = bytes.fromhex(enc_hex)
     nonce, ct = raw[:12], raw[12:]
-    return AESGCM_KEY.decrypt(nonce, ct, None).decode()
+    cipher = keyring.cipher_for(key) if key else AESGCM_KEY
+    return cipher.decrypt(nonce, ct, None).decode()
 
-def send_email(to: str, subject: str, body: str):
-    msg = EmailMessage()
-    msg["From"] = SMTP_USER
-    msg["To"] = to
-    msg["Subject"] = subject
-    msg.set_content(body)
-
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-        s.starttls()
-        s.login(SMTP_USER, SMTP_PASS)
-        s.send_message(msg)
+def send_email(to: str, subject: str, body: str) -> str:
+    """Queue an email for background delivery; returns the outbox message id."""
+    return email_outbox.enqueue(to, subject, body)
 
 def _hash_otp(otp: str, salt: str):
     return hashlib.sha256(f"{salt}:{otp}".encode()).hexdigest()
 
+def _throttled(purpose: str, wallet: str):
+    retry_after = max(1, int(otp_store.throttled_for(purpose, wallet)))
+    raise HTTPException(
+        status_code=429,
+        detail="Too many failed attempts; try again later",
+        headers={"Retry-After": str(retry_after)}
+    )
+
 # ==================== ENROLL FLOW ====================
 def send_verification_email(wallet: str, email: str):
     """Send verification email on enrollment and store only encrypted email."""
@@ -57,44 +57,45 @@ def send_verification_email(wallet: str, email: str):
     token = secrets.token_urlsafe(16)
     salt = secrets.token_hex(8)
     token_hash = _hash_otp(token, salt)
-    expires = int(time.time()) + OTP_TTL_SECONDS
 
-    # Temporarily keep the token only in memory
-    OTP_CACHE[wallet] = {"otp_hash": token_hash, "salt": salt, "expires_at": expires}
+    # Keep only the salted hash, until verified or expired
+    otp_store.issue(ENROLL_PURPOSE, wallet, token_hash, salt, OTP_TTL_SECONDS)
 
     try:
-        send_email(
+        message_id = send_email(
             to=email,
             subject="Verify your email address",
             body=f"Your verification code is: {token}\n\nValid for 5 minutes."
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send verification email: {str(e)}")
+    except OutboxFull:
+        raise HTTPException(status_code=503, detail="Email service busy, try again shortly", headers={"Retry-After": "5"})
 
-    return {"status": "sent", "wallet": wallet, "email": email}
+    return {"status": "queued", "wallet": wallet, "email": email, "message_id": message_id}
 
 
 def verify_enrollment_email(wallet: str, email: str, token: str):
     """Verify email during enrollment and store encrypted email permanently."""
     wallet = wallet.lower()
-    if wallet not in OTP_CACHE:
+    result = otp_store.verify(ENROLL_PURPOSE, wallet, lambda salt: _hash_otp(token, salt))
+    if result == OTP_THROTTLED:
+        _throttled(ENROLL_PURPOSE, wallet)
+    if result == OTP_MISSING:
         raise HTTPException(status_code=400, detail="No verification pending")
-
-    rec = OTP_CACHE[wallet]
-    if int(time.time()) > rec["expires_at"]:
-        OTP_CACHE.pop(wallet, None)
+    if result == OTP_EXPIRED:
         raise HTTPException(status_code=400, detail="Verification token expired")
+    if result == OTP_LOCKED:
+        raise HTTPException(status_code=429, detail="Too many attempts; request a new verification email")
 
-    if _hash_otp(token, rec["salt"]) == rec["otp_hash"]:
+    if result == OTP_OK:
         # store encrypted email off-chain
-        enc_email = encrypt_str(email)
+        cipher, key = keyring.new_data_key()
         record = {
             "doc_type": "verified_email",
-            "email_enc": enc_email,
+            "email_enc": encrypt_str(email, cipher),
+            "email_key": key,
             "created_at": datetime.utcnow().isoformat()
         }
         doc_store.add_document(wallet, record)
-        OTP_CACHE.pop(wallet, None)
         return True
     else:
         raise HTTPException(status_code=400, detail="Invalid verification token")
@@ -109,40 +110,40 @@ def send_action_otp(wallet: str):
     if not email_rec:
         raise HTTPException(status_code=403, detail="No verified email for this wallet")
 
-    email = decrypt_str(email_rec["email_enc"])
+    email = decrypt_str(email_rec["email_enc"], email_rec.get("email_key"))
 
     otp = "".join(secrets.choice("0123456789") for _ in range(6))
     salt = secrets.token_hex(8)
     otp_hash = _hash_otp(otp, salt)
-    expires = int(time.time()) + OTP_TTL_SECONDS
 
-    # store temporarily in memory
-    OTP_CACHE[wallet] = {"otp_hash": otp_hash, "salt": salt, "expires_at": expires}
+    # Keep only the salted hash, until verified or expired
+    otp_store.issue(ACTION_PURPOSE, wallet, otp_hash, salt, OTP_TTL_SECONDS)
 
     try:
-        send_email(
+        message_id = send_email(
             to=email,
             subject="Your Verification Code",
             body=f"Your one-time verification code is: {otp}\nValid for 5 minutes."
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send OTP: {str(e)}")
+    except OutboxFull:
+        raise HTTPException(status_code=503, detail="Email service busy, try again shortly", headers={"Retry-After": "5"})
 
-    return {"status": "sent", "wallet": wallet, "email": email, "expires_in": OTP_TTL_SECONDS}
+    return {"status": "queued", "message_id": message_id, "wallet": wallet, "email": email, "expires_in": OTP_TTL_SECONDS}
 
 
 def verify_action_otp(wallet: str, otp: str):
     """Verify OTP for an action. Does not persist."""
     wallet = wallet.lower()
-    if wallet not in OTP_CACHE:
+    result = otp_store.verify(ACTION_PURPOSE, wallet, lambda salt: _hash_otp(otp, salt))
+    if result == OTP_THROTTLED:
+        _throttled(ACTION_PURPOSE, wallet)
+    if result == OTP_MISSING:
         raise HTTPException(status_code=400, detail="No OTP pending")
-
-    rec = OTP_CACHE[wallet]
-    if int(time.time()) > rec["expires_at"]:
-        OTP_CACHE.pop(wallet, None)
+    if result == OTP_EXPIRED:
         raise HTTPException(status_code=400, detail="OTP expired")
+    if result == OTP_LOCKED:
+        raise HTTPException(status_code=429, detail="Too many attempts; request a new OTP")
 
-    if _hash_otp(otp, rec["salt"]) == rec["otp_hash"]:
-        OTP_CACHE.pop(wallet, None)
+    if result == OTP_OK:
         return True
     raise HTTPException(status_code=400, detail="Invalid OTP")
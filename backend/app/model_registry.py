@@ -0,0 +1,231 @@
+"""
+Registry of converted model artefacts (models/registry.json).
+
+Every ONNX / TensorRT file the converter writes is recorded with what it was
+built from and where it can run:
+
+    source_hash    SHA-256 over the PyTorch weights it was exported from
+    artefact_hash  SHA-256 of the file itself
+    precision      fp32 | fp16 | int8 (what the builder actually enabled)
+    opset, batch_profile {min, opt, max}
+    fingerprint    toolchain + hardware (onnx/onnxruntime versions; for
+                   TensorRT also the TensorRT/CUDA versions and GPU model)
+    parity         cosine similarity of outputs against PyTorch
+
+The converter asks lookup() before rebuilding, and FacePipeline asks
+best_for() which artefact to load on the current device.
+"""
+import hashlib
+import json
+import os
+import platform
+import time
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.99"))
+# Face detector vs MTCNN: embeddings of the two crops of the same photo
+DETECTOR_PARITY_MIN_COSINE = float(os.getenv("DETECTOR_PARITY_MIN_COSINE", "0.9"))
+REGISTRY_FILE = "registry.json"
+
+# Preference order when several compatible artefacts exist
+_PREFERENCE = {
+    "cuda": [("tensorrt", "fp16"), ("tensorrt", "int8"), ("tensorrt", "fp32"), ("onnx", "fp32")],
+    "cpu": [("onnx", "fp32")],
+}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_sha256(model) -> str:
+    """Order-stable hash of a torch module's state_dict."""
+    digest = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint(fmt: str) -> dict:
+    """Toolchain and hardware an artefact depends on."""
+    info = {"machine": platform.machine(), "system": platform.system()}
+    try:
+        import onnx
+        info["onnx"] = onnx.__version__
+    except ImportError:
+        pass
+    try:
+        import onnxruntime as ort
+        info["onnxruntime"] = ort.__version__
+    except ImportError:
+        pass
+    if fmt == "tensorrt":
+        import tensorrt as trt
+        import torch
+        info["tensorrt"] = trt.__version__
+        info["cuda"] = torch.version.cuda
+        if torch.cuda.is_available():
+            info["gpu"] = torch.cuda.get_device_name(0)
+            info["compute_capability"] = ".".join(map(str, torch.cuda.get_device_capability(0)))
+    return info
+
+
+def _compatible(fmt: str, recorded: dict, current: dict) -> bool:
+    # ONNX graphs are portable; TensorRT engines only run on the GPU and
+    # TensorRT version they were built for.
+    if fmt == "tensorrt":
+        return all(recorded.get(k) == current.get(k) for k in ("tensorrt", "gpu", "compute_capability"))
+    return "onnxruntime" in current
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / (np.linalg.norm(a, axis=1, keepdims=True) + 1e-12)
+    b = b / (np.linalg.norm(b, axis=1, keepdims=True) + 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def run_onnx(path: str, batch: np.ndarray) -> np.ndarray:
+    import onnxruntime as ort
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    name = session.get_inputs()[0].name
+    return session.run(None, {name: batch.astype(np.float32)})[0]
+
+
+def run_tensorrt(path: str, batch: np.ndarray) -> np.ndarray:
+    import tensorrt as trt
+    import pycuda.driver as cuda
+    import pycuda.autoinit  # noqa: F401
+
+    with open(path, "rb") as f:
+        engine = trt.Runtime(trt.Logger(trt.Logger.WARNING)).deserialize_cuda_engine(f.read())
+    context = engine.create_execution_context()
+    input_idx = engine.get_binding_index("input")
+    output_idx = engine.get_binding_index("output")
+    batch = np.ascontiguousarray(batch, dtype=np.float32)
+    out = np.empty((batch.shape[0], 512), dtype=np.float32)
+    d_input, d_output = cuda.mem_alloc(batch.nbytes), cuda.mem_alloc(out.nbytes)
+    cuda.memcpy_htod(d_input, batch)
+    context.set_binding_shape(input_idx, batch.shape)
+    bindings = [0] * engine.num_bindings
+    bindings[input_idx], bindings[output_idx] = int(d_input), int(d_output)
+    context.execute_v2(bindings)
+    cuda.memcpy_dtoh(out, d_output)
+    d_input.free()
+    d_output.free()
+    return out
+
+
+def parity_report(model, artefact_path: str, fmt: str, samples: Optional[np.ndarray] = None, count: int = 16) -> dict:
+    """
+    Cosine similarity between PyTorch outputs and the artefact's outputs.
+    samples: Nx3x160x160 standardized face crops; random inputs otherwise.
+    """
+    import torch
+    if samples is None:
+        samples = np.random.default_rng(0).standard_normal((count, 3, 160, 160)).astype(np.float32)
+    with torch.no_grad():
+        reference = model(torch.from_numpy(samples)).cpu().numpy()
+    outputs = run_tensorrt(artefact_path, samples) if fmt == "tensorrt" else run_onnx(artefact_path, samples)
+    cos = _cosine(reference, outputs)
+    return {
+        "samples": int(len(samples)),
+        "mean_cosine": round(float(cos.mean()), 6),
+        "min_cosine": round(float(cos.min()), 6),
+        "passed": bool(cos.min() >= PARITY_MIN_COSINE),
+    }
+
+
+class ModelRegistry:
+    """JSON index of artefacts in a model directory."""
+
+    def __init__(self, model_dir: str = "./models"):
+        self.model_dir = model_dir
+        self.path = os.path.join(model_dir, REGISTRY_FILE)
+        self.artefacts: List[dict] = []
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.artefacts = json.load(f).get("artefacts", [])
+
+    def save(self):
+        os.makedirs(self.model_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"artefacts": self.artefacts}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def register(self, record: dict) -> dict:
+        """Add or replace the record for record['path']."""
+        record = {
+            **record,
+            "file": os.path.basename(record["path"]),
+            "artefact_hash": file_sha256(record["path"]),
+            "created": time.time(),
+        }
+        record.pop("path")
+        self.artefacts = [a for a in self.artefacts if a["file"] != record["file"]]
+        self.artefacts.append(record)
+        self.save()
+        return record
+
+    def set_parity(self, file: str, parity: dict):
+        for a in self.artefacts:
+            if a["file"] == os.path.basename(file):
+                a["parity"] = parity
+        self.save()
+
+    def parity_passed(self, file: str) -> bool:
+        record = next((a for a in self.artefacts if a["file"] == os.path.basename(file)), None)
+        return bool(record) and (record.get("parity") or {}).get("passed") is True
+
+    def path_of(self, record: dict) -> str:
+        return os.path.join(self.model_dir, record["file"])
+
+    def _usable(self, record: dict) -> bool:
+        path = self.path_of(record)
+        return os.path.exists(path) and file_sha256(path) == record["artefact_hash"]
+
+    def lookup(self, model: str, fmt: str, precision: str, source_hash: str, **build) -> Optional[dict]:
+        """An up-to-date artefact built from the same weights with the same settings, if cached."""
+        current = fingerprint(fmt)
+        for a in self.artefacts:
+            if (a["model"], a["format"], a["precision"], a["source_hash"]) != (model, fmt, precision, source_hash):
+                continue
+            if any(a.get(k) != v for k, v in build.items()):
+                continue
+            if _compatible(fmt, a["fingerprint"], current) and self._usable(a):
+                return a
+        return None
+
+    def best_for(self, model: str, device: str) -> Optional[dict]:
+        """
+        Best artefact for the device that is intact, compatible and passed
+        parity. Artefacts never checked (e.g. from pytorch_to_onnx called on
+        its own) are not served; full_conversion_pipeline records parity.
+        """
+        kind = "cuda" if device.startswith("cuda") else "cpu"
+        fingerprints = {}
+        for fmt, precision in _PREFERENCE[kind]:
+            for a in self.artefacts:
+                if (a["model"], a["format"], a["precision"]) != (model, fmt, precision):
+                    continue
+                if not self.parity_passed(a["file"]):
+                    continue
+                try:
+                    current = fingerprints.setdefault(fmt, fingerprint(fmt))
+                except ImportError:
+                    break
+                if _compatible(fmt, a["fingerprint"], current) and self._usable(a):
+                    return a
+        return None
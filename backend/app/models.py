@@ -13,3 +13,13 @@ class AuthResponse(BaseModel):
     score: float
     passed: bool
     message: str
+    quality_reason: str | None = None
+
+class StreamAuthResponse(AuthResponse):
+    frames_used: int
+    frames_tracked: int
+    frames_low_quality: int = 0
+    liveness_checks: int
+    liveness_passed: int
+    liveness_confidence: float
+    elapsed_ms: float
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+from app.utils.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+NER_MODEL = os.getenv("NER_MODEL", "Davlan/xlm-roberta-base-ner-hrl")
+NER_BACKEND = os.getenv("NER_BACKEND", "pytorch").lower()  # pytorch | onnx
+NER_ONNX_DIR = os.getenv("NER_ONNX_DIR", os.path.join("models", "ner-int8"))
+NER_QUANT_ISA = os.getenv("NER_QUANT_ISA", "avx2").lower()  # avx2 | avx512 | avx512_vnni | arm64
+NER_MAX_BATCH = int(os.getenv("NER_MAX_BATCH", "8"))
+NER_BATCH_WAIT_MS = float(os.getenv("NER_BATCH_WAIT_MS", "10"))
+NER_WORKERS = int(os.getenv("NER_WORKERS", "1"))
+NER_CACHE_SIZE = int(os.getenv("NER_CACHE_SIZE", "2048"))
+NER_CONTEXT_LINES = int(os.getenv("NER_CONTEXT_LINES", "2"))
+NER_MAX_LINES = 40
+
+# Lines that usually sit next to the holder's name on Indian ID cards
+_ANCHOR_RE = re.compile(
+    r"\bname\b|\bdob\b|d\.o\.b|date of birth|year of birth|\bbirth\b|"
+    r"\bfather|\bs/o\b|\bd/o\b|\bw/o\b|\bson of\b|\bdaughter of\b|"
+    r"\b\d{2}[/\-]\d{2}[/\-]\d{4}\b",
+    re.IGNORECASE
+)
+
+
+def candidate_lines(text: str, context: int = NER_CONTEXT_LINES) -> str:
+    """
+    Keep only the lines around name/DOB anchors, where the holder's name is.
+    Falls back to the first NER_MAX_LINES lines when no anchor is present.
+    """
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    keep = set()
+    for i, line in enumerate(lines):
+        if _ANCHOR_RE.search(line):
+            keep.update(range(max(0, i - context), min(len(lines), i + context + 1)))
+    if not keep:
+        return "\n".join(lines[:NER_MAX_LINES])
+    return "\n".join(lines[i] for i in sorted(keep))
+
+
+def _load_onnx_pipeline(task_pipeline):
+    """Export the model to ONNX and quantize it to INT8 once; reuse afterwards."""
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    quantized = os.path.join(NER_ONNX_DIR, "model_quantized.onnx")
+    if not os.path.exists(quantized):
+        logger.info(f"Exporting {NER_MODEL} to ONNX and quantizing to INT8 ({NER_QUANT_ISA})...")
+        export_dir = NER_ONNX_DIR + "-fp32"
+        model = ORTModelForTokenClassification.from_pretrained(NER_MODEL, export=True)
+        model.save_pretrained(export_dir)
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        qconfig = getattr(AutoQuantizationConfig, NER_QUANT_ISA)(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=NER_ONNX_DIR, quantization_config=qconfig)
+        AutoTokenizer.from_pretrained(NER_MODEL).save_pretrained(NER_ONNX_DIR)
+
+    model = ORTModelForTokenClassification.from_pretrained(NER_ONNX_DIR, file_name="model_quantized.onnx")
+    tokenizer = AutoTokenizer.from_pretrained(NER_ONNX_DIR)
+    return task_pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
+
+
+class NERService:
+    """
+    Batched, memoized named-entity recognition for OCR text.
+
+    Inputs are cut down to candidate lines, looked up in an LRU cache keyed by
+    a hash of that text, and misses from concurrent uploads are run through
+    the model together.
+    """
+
+    def __init__(self):
+        self._pipe = None
+        self.backend = None
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.batcher = MicroBatcher(
+            self._process_batch,
+            max_batch=NER_MAX_BATCH,
+            max_wait_ms=NER_BATCH_WAIT_MS,
+            workers=NER_WORKERS,
+            name="ner"
+        )
+
+    def _pipeline(self):
+        if self._pipe is not None:
+            return self._pipe
+        with self._load_lock:
+            if self._pipe is not None:
+                return self._pipe
+            from transformers import pipeline
+            start = time.perf_counter()
+            if NER_BACKEND == "onnx":
+                try:
+                    self._pipe = _load_onnx_pipeline(pipeline)
+                    self.backend = "onnx-int8"
+                except ImportError:
+                    logger.warning("optimum[onnxruntime] not installed; falling back to PyTorch NER")
+            if self._pipe is None:
+                from accelerate import Accelerator
+                accelerator = Accelerator()
+                device = 0 if accelerator.device.type == "cuda" else -1  # pipeline uses -1 for CPU
+                self._pipe = pipeline("ner", model=NER_MODEL, aggregation_strategy="simple", device=device)
+                self.backend = "pytorch"
+            metrics.observe("ner.model_load", time.perf_counter() - start)
+            logger.info(f"NER model loaded ({self.backend})")
+        return self._pipe
+
+    def _process_batch(self, items) -> List[list]:
+        started = time.perf_counter()
+        texts = [text for text, _ in items]
+        for _, enqueued in items:
+            metrics.observe("ner.queue_wait", started - enqueued)
+        outputs = self._pipeline()(texts, batch_size=len(texts))
+        # A single string input returns a flat list rather than a list of lists
+        if len(texts) == 1 and outputs and isinstance(outputs[0], dict):
+            outputs = [outputs]
+        metrics.observe("ner.inference", time.perf_counter() - started)
+        metrics.set_gauge("ner.last_batch_size", len(texts))
+        return outputs
+
+    def entities(self, text: str, truncate: bool = True, timeout: Optional[float] = None) -> list:
+        """Grouped entities for text, restricted to candidate lines by default."""
+        if truncate:
+            text = candidate_lines(text)
+        if not text.strip():
+            return []
+
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                metrics.incr("ner.cache_hits")
+                return cached
+        metrics.incr("ner.cache_misses")
+
+        result = self.batcher.submit(text, timeout=5).result(timeout=timeout)
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > NER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    def person_names(self, text: str) -> List[str]:
+        """Multi-word PER entities, letters and spaces only."""
+        candidates = []
+        for ent in self.entities(text):
+            if ent['entity_group'] in ["PER", "PERSON"]:
+                candidate = re.sub(r"[^A-Za-z\s]", "", ent['word']).strip()
+                if len(candidate.split()) >= 2:
+                    candidates.append(candidate)
+        return candidates
+
+
+# Global instance
+ner_service = NERService()
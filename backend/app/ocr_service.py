@@ -0,0 +1,258 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+from app.utils.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_MAX_BATCH = int(os.getenv("OCR_MAX_BATCH", "4"))
+OCR_BATCH_WAIT_MS = float(os.getenv("OCR_BATCH_WAIT_MS", "15"))
+OCR_RECOGNIZE_BATCH = int(os.getenv("OCR_RECOGNIZE_BATCH", "16"))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", "32"))
+OCR_GPU = os.getenv("OCR_GPU", "auto").lower()
+
+# Adaptive preprocessing: only small photos are upscaled, huge ones are
+# reduced before filtering (cost of bilateralFilter grows with pixel count).
+OCR_UPSCALE_BELOW = int(os.getenv("OCR_UPSCALE_BELOW", "1200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2200"))
+
+DEFAULT_LANGS = ("en", "kn")
+LINE_PAD = 8
+
+
+def preprocess(image_bgr: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Grayscale + denoise, resizing only when it helps recognition.
+    Returns the processed image and the scale applied to the input.
+    """
+    h, w = image_bgr.shape[:2]
+    long_side = max(h, w)
+    if long_side > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / long_side
+        image_bgr = cv2.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    elif long_side < OCR_UPSCALE_BELOW:
+        scale = 1.5
+        image_bgr = cv2.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    else:
+        scale = 1.0
+
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY) if image_bgr.ndim == 3 else image_bgr
+    # Smaller filter window on already-sharp high resolution input
+    diameter = 11 if scale > 1.0 else 7
+    gray = cv2.bilateralFilter(gray, diameter, 17, 17)
+    return gray, scale
+
+
+def _stack_lines(jobs: List[dict]):
+    """
+    Crop every detected text box of every document onto one tall canvas so a
+    single recognize() call batches text lines across documents.
+    Returns the canvas, remapped boxes and the y-range owned by each job.
+    """
+    crops = []
+    for j, job in enumerate(jobs):
+        gray = job["gray"]
+        h, w = gray.shape[:2]
+        for x_min, x_max, y_min, y_max in job["horizontal"]:
+            x0, x1 = max(0, int(x_min)), min(w, int(x_max))
+            y0, y1 = max(0, int(y_min)), min(h, int(y_max))
+            if x1 > x0 and y1 > y0:
+                crops.append((j, gray[y0:y1, x0:x1], None))
+        for poly in job["free"]:
+            pts = np.asarray(poly, dtype=np.float32)
+            x0, y0 = np.floor(pts.min(axis=0)).astype(int)
+            x1, y1 = np.ceil(pts.max(axis=0)).astype(int)
+            x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+            if x1 > x0 and y1 > y0:
+                crops.append((j, gray[y0:y1, x0:x1], pts - [x0, y0]))
+
+    if not crops:
+        return None, [], [], []
+
+    width = max(c.shape[1] for _, c, _ in crops)
+    height = sum(c.shape[0] + LINE_PAD for _, c, _ in crops)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+
+    horizontal, free, owner = [], [], []
+    y = 0
+    for j, crop, poly in crops:
+        ch, cw = crop.shape[:2]
+        canvas[y:y + ch, :cw] = crop
+        if poly is None:
+            horizontal.append([0, cw, y, y + ch])
+        else:
+            free.append((poly + [0, y]).astype(int).tolist())
+        owner.append((y, y + ch, j))
+        y += ch + LINE_PAD
+    return canvas, horizontal, free, owner
+
+
+class OCRService:
+    """
+    Bounded pool of EasyOCR workers fed from a request queue.
+
+    Each worker thread owns its own Reader per language set. Requests that
+    arrive together are batched: detection runs per image, then the detected
+    text lines of all documents are recognized in one call.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._configured = False
+        self._config_lock = threading.Lock()
+        self.batcher = MicroBatcher(
+            self._process_batch,
+            max_batch=OCR_MAX_BATCH,
+            max_wait_ms=OCR_BATCH_WAIT_MS,
+            workers=OCR_WORKERS,
+            max_queue=OCR_QUEUE_SIZE,
+            name="ocr"
+        )
+
+    def _configure_threads(self):
+        with self._config_lock:
+            if self._configured:
+                return
+            # torch's intra-op pool is process-wide and shared with the face
+            # models; runtime_config sizes it (TORCH_THREADS) for both.
+            from app.runtime_config import apply_runtime_config
+            apply_runtime_config()
+            self._configured = True
+
+    def _reader(self, langs: Tuple[str, ...]):
+        readers = getattr(self._local, "readers", None)
+        if readers is None:
+            readers = self._local.readers = {}
+        reader = readers.get(langs)
+        if reader is None:
+            import easyocr
+            self._configure_threads()
+            if OCR_GPU == "auto":
+                import torch
+                gpu = torch.cuda.is_available()
+            else:
+                gpu = OCR_GPU in ("1", "true", "yes")
+            start = time.perf_counter()
+            reader = easyocr.Reader(list(langs), gpu=gpu)
+            metrics.observe("ocr.reader_load", time.perf_counter() - start)
+            readers[langs] = reader
+        return reader
+
+    def submit(self, image_bgr: np.ndarray, langs: Sequence[str] = DEFAULT_LANGS, fast: bool = False) -> Future:
+        """
+        Queue an image for OCR; the future resolves to a result dict.
+        fast=True skips resizing and denoising (for quick classification passes).
+        """
+        metrics.set_gauge("ocr.queue_depth", self.batcher.qsize())
+        return self.batcher.submit({"image": image_bgr, "langs": tuple(langs), "fast": fast}, timeout=5)
+
+    def read_text(
+        self,
+        image_bgr: np.ndarray,
+        langs: Sequence[str] = DEFAULT_LANGS,
+        fast: bool = False,
+        timeout: Optional[float] = None
+    ) -> dict:
+        """Blocking OCR of one image: {'lines', 'text', 'timings'}."""
+        return self.submit(image_bgr, langs, fast).result(timeout=timeout)
+
+    def _process_batch(self, items) -> List[dict]:
+        started = time.perf_counter()
+        jobs = []
+        for item, enqueued in items:
+            t0 = time.perf_counter()
+            if item["fast"]:
+                image = item["image"]
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            else:
+                gray, _ = preprocess(item["image"])
+            jobs.append({
+                "gray": gray,
+                "langs": item["langs"],
+                "timings": {
+                    "queue_wait": started - enqueued,
+                    "preprocess": time.perf_counter() - t0,
+                }
+            })
+
+        groups: Dict[Tuple[str, ...], List[dict]] = {}
+        for job in jobs:
+            groups.setdefault(job["langs"], []).append(job)
+
+        results: List[Optional[dict]] = [None] * len(jobs)
+        for langs, group in groups.items():
+            try:
+                self._recognize_group(self._reader(langs), group)
+            except Exception as e:
+                logger.error(f"OCR batch failed: {e}")
+                for job in group:
+                    job["error"] = e
+
+        metrics.incr("ocr.batches")
+        metrics.incr("ocr.images", len(jobs))
+        metrics.set_gauge("ocr.last_batch_size", len(jobs))
+        for i, job in enumerate(jobs):
+            if "error" in job:
+                results[i] = job["error"]
+                continue
+            lines = job.get("lines", [])
+            timings = job["timings"]
+            for stage, seconds in timings.items():
+                metrics.observe(f"ocr.{stage}", seconds)
+            logger.info("OCR timings (ms): " + ", ".join(f"{k}={1000 * v:.1f}" for k, v in timings.items()))
+            results[i] = {"lines": lines, "text": "\n".join(lines), "timings": timings}
+        return results
+
+    def _recognize_group(self, reader, group: List[dict]):
+        for job in group:
+            t0 = time.perf_counter()
+            horizontal, free = reader.detect(job["gray"])
+            job["horizontal"], job["free"] = horizontal[0], free[0]
+            job["timings"]["detect"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        if len(group) == 1:
+            job = group[0]
+            job["lines"] = reader.recognize(
+                job["gray"],
+                horizontal_list=job["horizontal"],
+                free_list=job["free"],
+                detail=0,
+                batch_size=OCR_RECOGNIZE_BATCH
+            )
+        else:
+            canvas, horizontal, free, owner = _stack_lines(group)
+            for job in group:
+                job["lines"] = []
+            if canvas is not None:
+                detections = reader.recognize(
+                    canvas,
+                    horizontal_list=horizontal,
+                    free_list=free,
+                    detail=1,
+                    batch_size=OCR_RECOGNIZE_BATCH
+                )
+                for box, text, _conf in detections:
+                    cy = (min(p[1] for p in box) + max(p[1] for p in box)) / 2
+                    for y0, y1, j in owner:
+                        if y0 - LINE_PAD / 2 <= cy < y1 + LINE_PAD / 2:
+                            group[j]["lines"].append(text)
+                            break
+        elapsed = time.perf_counter() - t0
+        for job in group:
+            job["timings"]["recognize"] = elapsed
+
+
+# Global instance
+ocr_service = OCRService()
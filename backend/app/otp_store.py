@@ -0,0 +1,236 @@
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+
+load_dotenv()
+OTP_DB_PATH = os.getenv("OTP_DB_PATH", os.path.join("data", "otp.sqlite3"))
+OTP_MAX_ENTRIES = int(os.getenv("OTP_MAX_ENTRIES", "100000"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_SWEEP_SECONDS = float(os.getenv("OTP_SWEEP_SECONDS", "30"))
+# Wrong guesses allowed per purpose+wallet per window, across re-issued codes
+OTP_MAX_FAILURES = int(os.getenv("OTP_MAX_FAILURES", "10"))
+OTP_FAILURE_WINDOW_SECONDS = float(os.getenv("OTP_FAILURE_WINDOW_SECONDS", "3600"))
+
+# verify() outcomes
+OTP_OK = "ok"
+OTP_MISSING = "missing"
+OTP_EXPIRED = "expired"
+OTP_INVALID = "invalid"
+OTP_LOCKED = "locked"
+OTP_THROTTLED = "throttled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS otps (
+    purpose    TEXT NOT NULL,
+    wallet     TEXT NOT NULL,
+    otp_hash   TEXT NOT NULL,
+    salt       TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (purpose, wallet)
+);
+CREATE INDEX IF NOT EXISTS otps_expires_at ON otps (expires_at);
+CREATE TABLE IF NOT EXISTS otp_failures (
+    purpose      TEXT NOT NULL,
+    wallet       TEXT NOT NULL,
+    failures     INTEGER NOT NULL,
+    window_start REAL NOT NULL,
+    PRIMARY KEY (purpose, wallet)
+);
+"""
+
+
+class OTPStore:
+    """
+    Pending OTPs and verification tokens in a SQLite file shared by every
+    worker process on the node (WAL mode, one connection per thread).
+
+    Only salted hashes are stored. Entries are keyed by (purpose, wallet),
+    so an enrollment token and an action OTP do not overwrite each other.
+    A sweeper thread deletes expired rows every OTP_SWEEP_SECONDS through
+    the expires_at index; the table is capped at max_entries (soonest to
+    expire evicted first); and each entry allows max_attempts wrong guesses
+    before it is burnt.
+
+    Wrong guesses are also counted per (purpose, wallet) in otp_failures,
+    which issuing a new code does not reset: after max_failures within
+    failure_window seconds, verify() answers OTP_THROTTLED without checking
+    the code until the window has passed.
+    """
+
+    def __init__(
+        self,
+        path: str = OTP_DB_PATH,
+        max_entries: int = OTP_MAX_ENTRIES,
+        max_attempts: int = OTP_MAX_ATTEMPTS,
+        sweep_seconds: float = OTP_SWEEP_SECONDS,
+        max_failures: int = OTP_MAX_FAILURES,
+        failure_window: float = OTP_FAILURE_WINDOW_SECONDS
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_attempts = max_attempts
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.sweep_seconds = sweep_seconds
+        self._local = threading.local()
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        self._start_sweeper()
+        return conn
+
+    # ---- expiry ----
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="otp-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_seconds):
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                print(f"⚠️ OTP sweep failed: {e}")
+
+    def sweep(self) -> int:
+        """Delete expired entries; returns how many were removed."""
+        conn = self._conn()
+        now = time.time()
+        removed = conn.execute("DELETE FROM otps WHERE expires_at <= ?", (now,)).rowcount
+        conn.execute("DELETE FROM otp_failures WHERE window_start <= ?", (now - self.failure_window,))
+        if removed:
+            metrics.incr("otp.expired_swept", removed)
+        metrics.set_gauge("otp.entries", conn.execute("SELECT COUNT(*) FROM otps").fetchone()[0])
+        return removed
+
+    # ---- API ----
+
+    def issue(self, purpose: str, wallet: str, otp_hash: str, salt: str, ttl: int):
+        """
+        Store (or replace) the pending secret for purpose+wallet. Resets the
+        entry's attempts, not the wallet's failure count.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM otps WHERE expires_at <= ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM otps").fetchone()[0]
+            overflow = count - self.max_entries + 1
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM otps WHERE rowid IN (SELECT rowid FROM otps ORDER BY expires_at LIMIT ?)",
+                    (overflow,)
+                )
+                metrics.incr("otp.evicted", overflow)
+            conn.execute(
+                "INSERT OR REPLACE INTO otps (purpose, wallet, otp_hash, salt, expires_at, attempts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (purpose, wallet, otp_hash, salt, now + ttl, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        metrics.incr(f"otp.issued.{purpose}")
+
+    def verify(self, purpose: str, wallet: str, hash_fn) -> str:
+        """
+        Check a submitted secret; hash_fn(salt) hashes it with the stored salt.
+        Returns one of the OTP_* outcomes. The entry is removed on success,
+        on expiry and when the attempt limit is reached.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = conn.execute(
+                "SELECT failures FROM otp_failures WHERE purpose = ? AND wallet = ? AND window_start > ?",
+                (purpose, wallet, now - self.failure_window)
+            ).fetchone()
+            row = conn.execute(
+                "SELECT otp_hash, salt, expires_at, attempts FROM otps WHERE purpose = ? AND wallet = ?",
+                (purpose, wallet)
+            ).fetchone()
+            if failed is not None and failed[0] >= self.max_failures:
+                result = OTP_THROTTLED
+            elif row is None:
+                result = OTP_MISSING
+            else:
+                otp_hash, salt, expires_at, attempts = row
+                if now > expires_at:
+                    result = OTP_EXPIRED
+                elif hmac.compare_digest(hash_fn(salt), otp_hash):
+                    result = OTP_OK
+                elif attempts + 1 >= self.max_attempts:
+                    result = OTP_LOCKED
+                else:
+                    result = OTP_INVALID
+                if result == OTP_INVALID:
+                    conn.execute(
+                        "UPDATE otps SET attempts = attempts + 1 WHERE purpose = ? AND wallet = ?",
+                        (purpose, wallet)
+                    )
+                else:
+                    conn.execute("DELETE FROM otps WHERE purpose = ? AND wallet = ?", (purpose, wallet))
+            if result in (OTP_INVALID, OTP_LOCKED):
+                # A new window starts once the previous one has passed
+                conn.execute(
+                    "INSERT INTO otp_failures (purpose, wallet, failures, window_start) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT (purpose, wallet) DO UPDATE SET "
+                    "failures = CASE WHEN window_start <= ? THEN 1 ELSE failures + 1 END, "
+                    "window_start = CASE WHEN window_start <= ? THEN excluded.window_start ELSE window_start END",
+                    (purpose, wallet, now, now - self.failure_window, now - self.failure_window)
+                )
+            elif result == OTP_OK:
+                conn.execute("DELETE FROM otp_failures WHERE purpose = ? AND wallet = ?", (purpose, wallet))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        metrics.incr(f"otp.verify.{result}")
+        return result
+
+    def attempts_left(self, purpose: str, wallet: str) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT attempts FROM otps WHERE purpose = ? AND wallet = ? AND expires_at > ?",
+            (purpose, wallet, time.time())
+        ).fetchone()
+        return None if row is None else self.max_attempts - row[0]
+
+    def throttled_for(self, purpose: str, wallet: str) -> float:
+        """Seconds until a throttled purpose+wallet may verify again (0 if not throttled)."""
+        row = self._conn().execute(
+            "SELECT failures, window_start FROM otp_failures WHERE purpose = ? AND wallet = ?",
+            (purpose, wallet)
+        ).fetchone()
+        if row is None or row[0] < self.max_failures:
+            return 0.0
+        return max(0.0, row[1] + self.failure_window - time.time())
+
+
+# Global instance
+otp_store = OTPStore()
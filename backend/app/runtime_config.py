@@ -0,0 +1,161 @@
+"""
+Execution device and thread-pool configuration for the model runtimes.
+
+Several uvicorn workers per node each get torch, OpenCV, onnxruntime and
+OpenMP pools sized for the whole machine by default, which oversubscribes
+the cores. This module sizes every pool from one per-worker budget and can
+pin each worker to its own slice of CPUs. It is the only place that sets
+torch's thread count: that pool is process-wide, so the face pipeline and the
+OCR workers share TORCH_THREADS (OCR_WORKERS bounds how many OCR jobs use it
+at once).
+
+OMP_NUM_THREADS / MKL_NUM_THREADS are read by the native libraries when they
+load, so import this module before torch, cv2 or onnxruntime.
+"""
+import os
+import tempfile
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+FACE_DEVICE = os.getenv("FACE_DEVICE", "auto").lower()  # auto | cpu | cuda | cuda:N
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# "" (no pinning), "auto" (claim a free slice of CPUS_PER_WORKER cores) or a list like "0-3,8"
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "").strip().lower()
+CPUS_PER_WORKER = int(os.getenv("CPUS_PER_WORKER", "0"))
+
+
+def _parse_cpu_list(spec: str) -> List[int]:
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+_slot_lock = None
+
+
+def _claim_cpu_slice(per_worker: int) -> Optional[List[int]]:
+    """
+    Claim the first free slice of per_worker CPUs with a lock file held for
+    the life of the process, so sibling workers get disjoint slices.
+    """
+    global _slot_lock
+    import fcntl
+    cpus = _available_cpus()
+    slots = max(1, len(cpus) // per_worker)
+    for slot in range(slots):
+        path = os.path.join(tempfile.gettempdir(), f"faceauth-cpu-slot-{slot}.lock")
+        f = open(path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_lock = f
+        return cpus[slot * per_worker:(slot + 1) * per_worker]
+    return None
+
+
+def _default_threads() -> int:
+    if CPUS_PER_WORKER:
+        return CPUS_PER_WORKER
+    return max(1, len(_available_cpus()) // max(1, WEB_CONCURRENCY))
+
+
+THREADS_PER_WORKER = _default_threads()
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(THREADS_PER_WORKER)))
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "1"))
+CV2_THREADS = int(os.getenv("CV2_THREADS", str(THREADS_PER_WORKER)))
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", str(THREADS_PER_WORKER)))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+
+# Native pools size themselves from these when first loaded
+os.environ.setdefault("OMP_NUM_THREADS", str(THREADS_PER_WORKER))
+os.environ.setdefault("MKL_NUM_THREADS", os.environ["OMP_NUM_THREADS"])
+
+_applied = None
+
+
+def resolve_device(requested: Optional[str] = None) -> str:
+    """'auto' picks CUDA when available; an explicit cpu/cuda request is honoured."""
+    device = (requested or FACE_DEVICE).lower()
+    if device == "auto":
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if device.startswith("cuda"):
+        import torch
+        if not torch.cuda.is_available():
+            raise RuntimeError(f"Device {device} requested but CUDA is not available")
+    return device
+
+
+def apply_runtime_config() -> dict:
+    """Pin the process (optional) and size every thread pool. Safe to call repeatedly."""
+    global _applied
+    if _applied is not None:
+        return _applied
+
+    affinity = None
+    if CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+        if CPU_AFFINITY == "auto":
+            affinity = _claim_cpu_slice(CPUS_PER_WORKER or THREADS_PER_WORKER)
+        else:
+            affinity = _parse_cpu_list(CPU_AFFINITY)
+        if affinity:
+            os.sched_setaffinity(0, affinity)
+
+    import torch
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError:
+        pass  # only settable before the first parallel op
+
+    import cv2
+    cv2.setNumThreads(CV2_THREADS)
+
+    try:
+        import tensorflow as tf  # DeepFace backend
+        tf.config.threading.set_intra_op_parallelism_threads(TORCH_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(TORCH_INTEROP_THREADS)
+    except (ImportError, RuntimeError):
+        pass
+
+    _applied = {
+        "pid": os.getpid(),
+        "affinity": affinity,
+        "omp_threads": int(os.environ["OMP_NUM_THREADS"]),
+        "torch_threads": TORCH_THREADS,
+        "torch_interop_threads": TORCH_INTEROP_THREADS,
+        "cv2_threads": CV2_THREADS,
+        "ort_intra_op_threads": ORT_INTRA_OP_THREADS,
+        "ort_inter_op_threads": ORT_INTER_OP_THREADS,
+    }
+    print(f"⚙️ Runtime config: {_applied}")
+    return _applied
+
+
+def ort_session_options():
+    """onnxruntime SessionOptions sized like the other pools."""
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
@@ -0,0 +1,167 @@
+"""
+One face-gallery shard served over multiprocessing.connection.
+
+    python -m app.shard_server --shard 0 --port 7100 --data-dir data/shards
+    python -m app.shard_server --spawn 4 --base-port 7100 --data-dir data/shards
+
+--spawn starts N local shard processes on consecutive ports and prints the
+VECTOR_SHARD_ADDRESSES value for the API. VECTOR_SHARD_AUTHKEY must be set
+(the same secret on the API and every shard): connections exchange pickled
+objects, so anyone holding the key can run code on the shard. Each connection is served on its
+own thread: searches run concurrently (FAISS releases the GIL), writes take
+the index exclusively.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener
+
+from dotenv import load_dotenv
+
+load_dotenv()
+VECTOR_SHARD_AUTHKEY = os.getenv("VECTOR_SHARD_AUTHKEY", "")
+VECTOR_SHARD_DIR = os.getenv("VECTOR_SHARD_DIR", os.path.join("data", "shards"))
+
+_READ_METHODS = ("search_topk", "export_vectors", "count", "ping")
+_WRITE_METHODS = ("add_vector", "delete_vector", "persist")
+
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer; writers are not starved."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class ShardServer:
+    def __init__(self, store, shard: int):
+        self.store = store
+        self.shard = shard
+        self._lock = _ReadWriteLock()
+
+    def dispatch(self, method: str, args: tuple):
+        if method == "ping":
+            # Clients check this against the shard's position in their address list
+            return {"shard": self.shard}
+        if method == "count":
+            return len(self.store)
+        return getattr(self.store, method)(*args)
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if method not in _READ_METHODS + _WRITE_METHODS:
+                    conn.send(("error", f"Unknown method {method}"))
+                    continue
+                write = method in _WRITE_METHODS
+                (self._lock.acquire_write if write else self._lock.acquire_read)()
+                try:
+                    reply = ("ok", self.dispatch(method, args))
+                except Exception as e:
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                finally:
+                    (self._lock.release_write if write else self._lock.release_read)()
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve(self, host: str, port: int, authkey: str = VECTOR_SHARD_AUTHKEY):
+        with Listener((host, port), authkey=authkey.encode("utf-8")) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed handshakes (wrong authkey, port scans) must not stop the shard
+                    print(f"⚠️ Shard connection rejected: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+def spawn(count: int, base_port: int, host: str, data_dir: str, dim: int):
+    procs = []
+    for i in range(count):
+        procs.append(subprocess.Popen([
+            sys.executable, "-m", "app.shard_server", "--shard", str(i), "--port", str(base_port + i),
+            "--host", host, "--data-dir", data_dir, "--dim", str(dim)
+        ]))
+    print("VECTOR_SHARD_ADDRESSES=" + ",".join(f"{host}:{base_port + i}" for i in range(count)), flush=True)
+    # Stopping the launcher stops its shards
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face gallery shard server")
+    parser.add_argument("--shard", type=int, help="Shard number to serve")
+    parser.add_argument("--port", type=int, help="Port for --shard")
+    parser.add_argument("--spawn", type=int, help="Start this many local shard processes")
+    parser.add_argument("--base-port", type=int, default=7100, help="First port for --spawn")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--data-dir", default=VECTOR_SHARD_DIR)
+    parser.add_argument("--dim", type=int, default=512)
+    args = parser.parse_args()
+
+    if not VECTOR_SHARD_AUTHKEY:
+        raise SystemExit("VECTOR_SHARD_AUTHKEY is not set; shard servers refuse to start without a secret authkey")
+    if args.spawn:
+        spawn(args.spawn, args.base_port, args.host, args.data_dir, args.dim)
+        return
+    if args.shard is None or args.port is None:
+        parser.error("--shard and --port are required unless --spawn is given")
+
+    from app.sharded_storage import shard_dir
+    from app.storage import VectorStore
+
+    store = VectorStore(dim=args.dim, use_cosine=True, data_dir=shard_dir(args.data_dir, args.shard))
+    print(f"✅ Shard {args.shard}: {len(store)} vectors, listening on {args.host}:{args.port}")
+    ShardServer(store, args.shard).serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Face gallery partitioned into shards by hash of user_id.
+
+ShardedVectorStore has the VectorStore interface. Writes go to the shard
+that owns the user_id; search runs on every shard in parallel and the
+per-shard top-k lists are merged by score. Wallet bindings are small and
+stay with the coordinator.
+
+Shards are either in-process VectorStores (VECTOR_SHARDS=N, one directory
+each under VECTOR_SHARD_DIR) or separate shard servers reached over
+multiprocessing.connection (VECTOR_SHARD_ADDRESSES=host:port,...; see
+app.shard_server). The shard count is part of the data layout: changing it
+needs a re-import of the gallery.
+"""
+import hashlib
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+from app.storage import VectorStore
+
+load_dotenv()
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "0"))  # 0 = single unsharded VectorStore
+VECTOR_SHARD_DIR = os.getenv("VECTOR_SHARD_DIR", os.path.join("data", "shards"))
+VECTOR_SHARD_ADDRESSES = os.getenv("VECTOR_SHARD_ADDRESSES", "")
+VECTOR_SHARD_AUTHKEY = os.getenv("VECTOR_SHARD_AUTHKEY", "")  # required for remote shards
+VECTOR_SHARD_TIMEOUT = float(os.getenv("VECTOR_SHARD_TIMEOUT", "5"))
+VECTOR_SHARD_CONNECTIONS = int(os.getenv("VECTOR_SHARD_CONNECTIONS", "4"))
+
+
+class ShardUnavailable(RuntimeError):
+    pass
+
+
+def shard_for(user_id: str, shards: int) -> int:
+    """Stable shard number for a user_id (independent of PYTHONHASHSEED)."""
+    return int(hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:8], 16) % shards
+
+
+def shard_dir(base_dir: str, shard: int) -> str:
+    return os.path.join(base_dir, f"shard-{shard:02d}")
+
+
+class RemoteShard:
+    """
+    Client for one shard server, with a small pool of connections. Each new
+    connection asks the server which shard it serves and refuses to use it
+    if that is not the expected one (e.g. a reordered address list), since
+    writes would land on the wrong shard.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        shard: int,
+        authkey: str = VECTOR_SHARD_AUTHKEY,
+        connections: int = VECTOR_SHARD_CONNECTIONS,
+        timeout: float = VECTOR_SHARD_TIMEOUT
+    ):
+        if not authkey:
+            raise ValueError("VECTOR_SHARD_AUTHKEY must be set to use shard servers")
+        host, _, port = address.rpartition(":")
+        self.address = (host or "127.0.0.1", int(port))
+        self.shard = shard
+        self.authkey = authkey.encode("utf-8")
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(connections)
+
+    def _call(self, method: str, *args):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                conn.send((method, args))
+                if not conn.poll(self.timeout):
+                    raise TimeoutError(f"Shard {self.address} did not answer {method} in {self.timeout}s")
+                status, result = conn.recv()
+            except (EOFError, OSError, TimeoutError) as e:
+                conn.close()
+                raise ShardUnavailable(str(e))
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+        if status != "ok":
+            raise RuntimeError(f"Shard {self.address}: {result}")
+        return result
+
+    def _connect(self):
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+            conn.send(("ping", ()))
+            if not conn.poll(self.timeout):
+                conn.close()
+                raise ShardUnavailable(f"Shard {self.address} did not answer ping in {self.timeout}s")
+            status, result = conn.recv()
+        except (EOFError, OSError) as e:
+            raise ShardUnavailable(f"Shard {self.address} unreachable: {e}")
+        served = result.get("shard") if status == "ok" and isinstance(result, dict) else None
+        if served != self.shard:
+            conn.close()
+            metrics.incr("gallery.shard_mismatch")
+            raise RuntimeError(
+                f"Shard server {self.address} serves shard {served}, expected {self.shard}; "
+                "check the order of VECTOR_SHARD_ADDRESSES"
+            )
+        return conn
+
+    def add_vector(self, user_id: str, embedding: np.ndarray, persist: bool = True) -> str:
+        return self._call("add_vector", user_id, np.asarray(embedding, dtype=np.float32), persist)
+
+    def delete_vector(self, user_id: str, persist: bool = True) -> bool:
+        return self._call("delete_vector", user_id, persist)
+
+    def search_topk(self, query: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        return self._call("search_topk", np.asarray(query, dtype=np.float32), k)
+
+    def persist(self):
+        return self._call("persist")
+
+    def export_vectors(self, start: int = 0, count: Optional[int] = None) -> Tuple[List[str], np.ndarray]:
+        return self._call("export_vectors", start, count)
+
+    def __len__(self) -> int:
+        return self._call("count")
+
+
+class ShardedVectorStore:
+    """Scatter-gather coordinator over VectorStore-like shards."""
+
+    def __init__(self, shards: list, dim: int = 512, use_cosine: bool = True, data_dir: str = VECTOR_SHARD_DIR):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.shards = shards
+        self.dim = dim
+        self.use_cosine = use_cosine
+        self.wallets_path = os.path.join(data_dir, "wallets.json")
+        self.wallets: Dict[str, Dict[str, str]] = {}
+        self.lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard-search")
+        os.makedirs(data_dir, exist_ok=True)
+        if os.path.isfile(self.wallets_path):
+            try:
+                with open(self.wallets_path, "r", encoding="utf-8") as f:
+                    self.wallets = json.load(f)
+            except Exception:
+                self.wallets = {}
+
+    def _shard(self, user_id: str):
+        return self.shards[shard_for(user_id, len(self.shards))]
+
+    def persist(self):
+        for shard in self.shards:
+            shard.persist()
+        self._persist_wallets()
+
+    def _persist_wallets(self):
+        with self.lock:
+            tmp = self.wallets_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.wallets, f)
+            os.replace(tmp, self.wallets_path)
+
+    def add_vector(self, user_id: str, embedding: np.ndarray, persist: bool = True) -> str:
+        return self._shard(user_id).add_vector(user_id, embedding, persist=persist)
+
+    def delete_vector(self, user_id: str, persist: bool = True) -> bool:
+        return self._shard(user_id).delete_vector(user_id, persist=persist)
+
+    def search_topk(self, query: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        start = time.perf_counter()
+        query = np.asarray(query, dtype=np.float32)
+        futures = [self._executor.submit(shard.search_topk, query, k) for shard in self.shards]
+        hits = []
+        for future in futures:
+            try:
+                hits.extend(future.result())
+            except ShardUnavailable:
+                # A missing shard could hide the true match; refuse rather than answer partially
+                metrics.incr("gallery.shard_errors")
+                raise
+        metrics.observe("gallery.search", time.perf_counter() - start)
+        pick = heapq.nlargest if self.use_cosine else heapq.nsmallest
+        return pick(k, hits, key=lambda hit: hit[1])
+
+    def search(self, query: np.ndarray, k: int = 1) -> Tuple[Optional[str], float]:
+        hits = self.search_topk(query, k)
+        return hits[0] if hits else (None, 0.0)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def bind_wallet_single(self, wallet: str, user_id: str, digest: str, salt: str, persist: bool = True):
+        """Bind wallet to exactly one user_id. Overwrites previous binding."""
+        with self.lock:
+            self.wallets[wallet.lower()] = {
+                "user_id": user_id,
+                "embedding_digest": digest,
+                "salt": salt
+            }
+            if persist:
+                self._persist_wallets()
+
+    def get_wallet_record(self, wallet: str):
+        return self.wallets.get(wallet.lower())
+
+    def get_user_ids_for_wallet(self, wallet: str) -> List[str]:
+        rec = self.get_wallet_record(wallet)
+        return [rec["user_id"]] if rec and "user_id" in rec else []
+
+
+def open_vector_store(dim: int = 512, use_cosine: bool = True):
+    """The gallery configured by VECTOR_SHARD_ADDRESSES / VECTOR_SHARDS."""
+    if VECTOR_SHARD_ADDRESSES:
+        addresses = [a.strip() for a in VECTOR_SHARD_ADDRESSES.split(",") if a.strip()]
+        shards = [RemoteShard(address, shard=i) for i, address in enumerate(addresses)]
+        print(f"✅ Face gallery: {len(shards)} remote shards")
+    elif VECTOR_SHARDS > 0:
+        shards = [
+            VectorStore(dim=dim, use_cosine=use_cosine, data_dir=shard_dir(VECTOR_SHARD_DIR, i))
+            for i in range(VECTOR_SHARDS)
+        ]
+        print(f"✅ Face gallery: {len(shards)} local shards in {VECTOR_SHARD_DIR}")
+    else:
+        return VectorStore(dim=dim, use_cosine=use_cosine)
+    return ShardedVectorStore(shards, dim=dim, use_cosine=use_cosine, data_dir=VECTOR_SHARD_DIR)
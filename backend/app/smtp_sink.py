@@ -0,0 +1,73 @@
+"""
+Local SMTP stand-in for tests and benchmarks (requires aiosmtpd).
+
+    python -m app.smtp_sink --port 1025 --maildir data/mail
+    SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false uvicorn app.main:app
+
+Accepts every message without authentication and counts it. With --maildir
+each message is written to a file (OTP codes can be read back in tests);
+the latest message per recipient is also kept in memory (handler.latest).
+--latency-ms adds a delay per message to imitate a remote provider.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+
+class SinkHandler:
+    def __init__(self, maildir: str = None, latency_ms: float = 0.0):
+        self.maildir = maildir
+        self.latency = latency_ms / 1000.0
+        self.received = 0
+        self.started = time.time()
+        self.latest = {}
+        if maildir:
+            os.makedirs(maildir, exist_ok=True)
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += 1
+        for rcpt in envelope.rcpt_tos:
+            self.latest[rcpt.lower()] = envelope.content
+        if self.maildir:
+            path = os.path.join(self.maildir, f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.eml")
+            with open(path, "wb") as f:
+                f.write(envelope.content)
+        return "250 Message accepted for delivery"
+
+
+def start_sink(host: str = "127.0.0.1", port: int = 1025, maildir: str = None, latency_ms: float = 0.0):
+    """Start the sink in a background thread; returns the aiosmtpd Controller (call .stop())."""
+    from aiosmtpd.controller import Controller
+
+    handler = SinkHandler(maildir, latency_ms)
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--maildir", help="Write each message to this directory")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay per message")
+    args = parser.parse_args()
+
+    controller = start_sink(args.host, args.port, args.maildir, args.latency_ms)
+    print(f"📬 SMTP sink listening on {args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(10)
+            handler = controller.handler
+            elapsed = time.time() - handler.started
+            print(f"received={handler.received} rate={handler.received / elapsed:.1f}/s")
+    except KeyboardInterrupt:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,606 @@
+"""
+Point-in-time snapshots of the face gallery and the JSON registries.
+
+    python -m app.snapshot take [--full]
+    python -m app.snapshot list
+    python -m app.snapshot restore [ID]         # newest by default
+    python -m app.snapshot bench --users 1000000
+
+Snapshots are taken from the persisted files, never from a running
+process's memory. Every store saves by write-then-rename, so a full snapshot
+hard-links the current files (no copy, and never a half-written file) and
+keeps the captured versions when the stores write again. VectorStore.persist
+and the snapshot hold the same lock file per gallery directory while they
+touch the index and its id map, so the two are always captured as a pair.
+
+The API never writes snapshots itself. With SNAPSHOT_INTERVAL_SECONDS set,
+one worker per SNAPSHOT_DIR (whichever holds its scheduler lock) runs
+`python -m app.snapshot take` in a subprocess on that interval, and a lock
+file in SNAPSHOT_DIR allows one snapshot at a time.
+
+A full snapshot holds, per gallery part (the single store, or each local
+shard), the index and users.json, plus each registry file. An incremental
+one holds only the vectors of user_ids added since the previous snapshot,
+the user_ids removed, and the registry entries that changed, worked out by
+comparing user_ids against the chain's last state. After
+SNAPSHOT_FULL_EVERY incrementals the next one is full again.
+
+Restore hard-links (or copies) the full snapshot's files into place,
+rebuilds an index only when incrementals changed it, and writes the id maps
+and registries. With VECTOR_INDEX_MMAP=true the API then maps the restored
+index and serves immediately while it is loaded into memory in the
+background. Remote shard servers are not covered: they hold their own data.
+Keep SNAPSHOT_DIR on the data filesystem, otherwise files are copied instead
+of linked.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from app.metrics import metrics
+from app.storage import DATA_DIR, FAISS_INDEX_BIN, PERSIST_LOCK, USERS_JSON, VectorStore, file_lock, index_vectors
+
+load_dotenv()
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "0"))  # 0 = no scheduled snapshots
+SNAPSHOT_FULL_EVERY = int(os.getenv("SNAPSHOT_FULL_EVERY", "24"))
+SNAPSHOT_KEEP_FULL = int(os.getenv("SNAPSHOT_KEEP_FULL", "2"))
+SNAPSHOT_TIMEOUT_SECONDS = float(os.getenv("SNAPSHOT_TIMEOUT_SECONDS", "3600"))
+
+INDEX_FILE = os.path.basename(FAISS_INDEX_BIN)
+USERS_FILE = os.path.basename(USERS_JSON)
+_CHUNK = 65536
+
+
+class SnapshotBusy(RuntimeError):
+    pass
+
+
+def _read_json(path: str, default=None):
+    if default is not None and not os.path.isfile(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _place_file(src: str, dst: str):
+    """Put src at dst (hard link, else copy), replacing dst atomically."""
+    tmp = dst + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    _link_or_copy(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _read_ids(part_dir: str) -> List[str]:
+    return _read_json(os.path.join(part_dir, USERS_FILE), {}).get("id_map", [])
+
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def configured_sources() -> dict:
+    """Files holding the node's state under the current configuration (paths relative to the working directory)."""
+    from app.document_storage import DOCUMENTS_DB
+    from app.image_archive import ARCHIVE_INDEX_FILE
+    from app.sharded_storage import VECTOR_SHARD_ADDRESSES, VECTOR_SHARD_DIR, VECTOR_SHARDS, shard_dir
+
+    if VECTOR_SHARD_ADDRESSES:
+        raise ValueError("Snapshots cover local galleries; shard servers keep their own data")
+    if VECTOR_SHARDS > 0:
+        parts = {f"shard-{i:02d}": shard_dir(VECTOR_SHARD_DIR, i) for i in range(VECTOR_SHARDS)}
+        wallets = os.path.join(VECTOR_SHARD_DIR, "wallets.json")
+    else:
+        parts = {"gallery": DATA_DIR}
+        wallets = os.path.join(DATA_DIR, "wallets.json")
+    return {
+        "parts": parts,
+        "registries": {"wallets": wallets, "documents": DOCUMENTS_DB, "image_archive": ARCHIVE_INDEX_FILE},
+    }
+
+
+# ==================== CHAIN ====================
+
+def list_snapshots(snapshot_dir: str = SNAPSHOT_DIR) -> List[dict]:
+    """Manifests of every complete snapshot, oldest first."""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(snapshot_dir)):
+        path = os.path.join(snapshot_dir, name, "manifest.json")
+        if name.isdigit() and os.path.isfile(path):
+            manifests.append({**_read_json(path), "path": os.path.dirname(path)})
+    return manifests
+
+
+def latest_snapshot(snapshot_dir: str = SNAPSHOT_DIR) -> Optional[dict]:
+    if not os.path.isdir(snapshot_dir):
+        return None
+    for name in sorted(os.listdir(snapshot_dir), reverse=True):
+        path = os.path.join(snapshot_dir, name, "manifest.json")
+        if name.isdigit() and os.path.isfile(path):
+            return _read_json(path)
+    return None
+
+
+def chain_for(snapshot_id: Optional[str] = None, snapshot_dir: str = SNAPSHOT_DIR) -> List[dict]:
+    """The full snapshot and incrementals that make up snapshot_id (default: newest)."""
+    manifests = list_snapshots(snapshot_dir)
+    if snapshot_id is not None:
+        manifests = [m for m in manifests if m["id"] <= snapshot_id]
+        if not manifests or manifests[-1]["id"] != snapshot_id:
+            raise ValueError(f"Snapshot {snapshot_id} not found in {snapshot_dir}")
+    chain = []
+    for m in reversed(manifests):
+        chain.insert(0, m)
+        if m["kind"] == "full":
+            return chain
+    if manifests:
+        raise ValueError(f"No full snapshot under {manifests[-1]['id']}")
+    return []
+
+
+def load_chain_state(chain: List[dict]) -> dict:
+    """
+    Replay a chain's id lists and registry diffs (not the vectors).
+    parts[part][user_id] = (position in chain, row in that snapshot's vectors).
+    """
+    state = {"parts": {}, "registries": {}}
+    for pos, m in enumerate(chain):
+        for part in m["sources"]["parts"]:
+            d = os.path.join(m["path"], part)
+            if m["kind"] == "full":
+                state["parts"][part] = {uid: (pos, row) for row, uid in enumerate(_read_ids(d))}
+                continue
+            alive = state["parts"][part]
+            for uid in _read_json(os.path.join(d, "deleted_ids.json")):
+                alive.pop(uid, None)
+            for row, uid in enumerate(_read_json(os.path.join(d, "added_ids.json"))):
+                alive[uid] = (pos, row)
+        for name in m["sources"]["registries"]:
+            if m["kind"] == "full":
+                state["registries"][name] = _read_json(os.path.join(m["path"], f"{name}.json"))
+                continue
+            diff = _read_json(os.path.join(m["path"], f"{name}.diff.json"))
+            registry = state["registries"].setdefault(name, {})
+            registry.update(diff["set"])
+            for key in diff["removed"]:
+                registry.pop(key, None)
+    return state
+
+
+# ==================== WRITING ====================
+
+def _stage_part(data_dir: str, dst: str) -> float:
+    """Link a gallery directory's index and id map into dst as one pair; returns ms the lock was held."""
+    os.makedirs(dst)
+    os.makedirs(data_dir, exist_ok=True)
+    index, users = os.path.join(data_dir, INDEX_FILE), os.path.join(data_dir, USERS_FILE)
+    with file_lock(os.path.join(data_dir, PERSIST_LOCK)):
+        start = time.perf_counter()
+        if os.path.isfile(index) and os.path.isfile(users):
+            _link_or_copy(index, os.path.join(dst, INDEX_FILE))
+            _link_or_copy(users, os.path.join(dst, USERS_FILE))
+        return 1000 * (time.perf_counter() - start)
+
+
+def _write_snapshot(path: str, kind: str, sources: dict, root: str, chain: List[dict]) -> dict:
+    """Write one snapshot of the files under root into path."""
+    counts = {"parts": {}, "registries": {}}
+    lock_ms = 0.0
+    previous = load_chain_state(chain) if kind == "incremental" else None
+
+    for part, data_dir in sources["parts"].items():
+        d = os.path.join(path, part)
+        lock_ms += _stage_part(os.path.join(root, data_dir), d)
+        ids = _read_ids(d)
+        if kind == "full":
+            counts["parts"][part] = {"vectors": len(ids)}
+            continue
+        before = previous["parts"].get(part, {})
+        current = set(ids)
+        rows = [i for i, uid in enumerate(ids) if uid not in before]
+        deleted = [uid for uid in before if uid not in current]
+        added = np.zeros((0, 0), dtype=np.float32)
+        if rows:
+            staged = faiss.read_index(os.path.join(d, INDEX_FILE), faiss.IO_FLAG_MMAP_IFC)
+            added = index_vectors(staged)[rows]
+            del staged
+        np.save(os.path.join(d, "added.npy"), added)
+        _write_json(os.path.join(d, "added_ids.json"), [ids[i] for i in rows])
+        _write_json(os.path.join(d, "deleted_ids.json"), deleted)
+        for name in (INDEX_FILE, USERS_FILE):
+            if os.path.exists(os.path.join(d, name)):
+                os.remove(os.path.join(d, name))
+        counts["parts"][part] = {"vectors": len(ids), "added": len(rows), "deleted": len(deleted)}
+
+    for name, src in sources["registries"].items():
+        src = os.path.join(root, src)
+        if kind == "full":
+            dst = os.path.join(path, f"{name}.json")
+            if os.path.isfile(src):
+                _link_or_copy(src, dst)
+            else:
+                _write_json(dst, {})
+            counts["registries"][name] = {"entries": len(_read_json(dst))}
+            continue
+        registry = _read_json(src, {})
+        before = previous["registries"].get(name, {})
+        changed = {k: v for k, v in registry.items() if before.get(k) != v}
+        removed = [k for k in before if k not in registry]
+        _write_json(os.path.join(path, f"{name}.diff.json"), {"set": changed, "removed": removed})
+        counts["registries"][name] = {"entries": len(registry), "changed": len(changed), "removed": len(removed)}
+
+    return {"counts": counts, "lock_ms": round(lock_ms, 2), "bytes": _dir_bytes(path)}
+
+
+class Snapshotter:
+    """Takes full and incremental snapshots of the persisted state, and schedules them from the API."""
+
+    def __init__(
+        self,
+        snapshot_dir: str = SNAPSHOT_DIR,
+        sources: Optional[dict] = None,
+        root: str = ".",
+        full_every: int = SNAPSHOT_FULL_EVERY,
+        keep_full: int = SNAPSHOT_KEEP_FULL,
+        interval: float = SNAPSHOT_INTERVAL_SECONDS
+    ):
+        self.snapshot_dir = snapshot_dir
+        self.sources = sources  # None: configured_sources() at snapshot time
+        self.root = root
+        self.full_every = full_every
+        self.keep_full = keep_full
+        self.interval = interval
+        self.last: Optional[dict] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._scheduler_lock = None
+
+    def take(self, full: bool = False) -> dict:
+        """Write the next snapshot; returns its manifest. SnapshotBusy if one is already running."""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with ExitStack() as held:
+            try:
+                held.enter_context(file_lock(os.path.join(self.snapshot_dir, ".lock"), blocking=False))
+            except BlockingIOError:
+                raise SnapshotBusy(f"Another snapshot of {self.snapshot_dir} is in progress")
+            manifest = self._take(full)
+
+        self.last = manifest
+        metrics.observe(f"snapshot.{manifest['kind']}", manifest["seconds"])
+        metrics.set_gauge("snapshot.last_bytes", manifest["bytes"])
+        return manifest
+
+    def _take(self, full: bool) -> dict:
+        sources = self.sources or configured_sources()
+        manifests = list_snapshots(self.snapshot_dir)
+        chain = chain_for(snapshot_dir=self.snapshot_dir) if manifests else []
+        if full or not chain or len(chain) > self.full_every or chain[0]["sources"] != sources:
+            kind, chain = "full", []
+        else:
+            kind = "incremental"
+        snapshot_id = f"{int(manifests[-1]['id']) + 1 if manifests else 1:06d}"
+        path = os.path.join(self.snapshot_dir, snapshot_id)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        start = time.perf_counter()
+        try:
+            stats = _write_snapshot(tmp, kind, sources, self.root, chain)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            metrics.incr("snapshot.failed")
+            raise
+        manifest = {
+            "id": snapshot_id,
+            "kind": kind,
+            "base": chain[-1]["id"] if chain else None,
+            "sources": sources,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.perf_counter() - start, 3),
+            **stats,
+        }
+        _write_json(os.path.join(tmp, "manifest.json"), manifest)
+        os.rename(tmp, path)
+        if kind == "full":
+            self._prune()
+        return manifest
+
+    def _prune(self):
+        """Drop chains older than the newest keep_full full snapshots."""
+        manifests = list_snapshots(self.snapshot_dir)
+        fulls = [m["id"] for m in manifests if m["kind"] == "full"]
+        if len(fulls) <= self.keep_full:
+            return
+        oldest_kept = fulls[-self.keep_full]
+        for m in manifests:
+            if m["id"] < oldest_kept:
+                shutil.rmtree(m["path"], ignore_errors=True)
+
+    # ---- schedule (API) ----
+
+    def _is_scheduler(self) -> bool:
+        """One process per SNAPSHOT_DIR schedules; it keeps the lock for its lifetime."""
+        if self._scheduler_lock is None:
+            import fcntl
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            f = open(os.path.join(self.snapshot_dir, ".scheduler"), "a+")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            self._scheduler_lock = f
+        return True
+
+    def _run_take(self):
+        """Snapshot in a separate process, so the API's memory, threads and GIL are not involved."""
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-m", "app.snapshot", "--snapshot-dir", self.snapshot_dir, "take"],
+            cwd=self.root, capture_output=True, text=True, timeout=SNAPSHOT_TIMEOUT_SECONDS
+        )
+        if proc.returncode != 0:
+            metrics.incr("snapshot.errors")
+            detail = (proc.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"⚠️ Snapshot failed: {detail}")
+            return
+        self.last = latest_snapshot(self.snapshot_dir)
+        metrics.observe("snapshot.process", time.perf_counter() - start)
+        if self.last:
+            print(f"✅ Snapshot {self.last['id']} ({self.last['kind']}): {self.last['seconds']}s, {self.last['bytes']} bytes")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            if not self._is_scheduler():
+                continue
+            try:
+                self._run_take()
+            except Exception as e:
+                metrics.incr("snapshot.errors")
+                print(f"⚠️ Snapshot failed: {e}")
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="snapshot-scheduler", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> dict:
+        last = self.last or latest_snapshot(self.snapshot_dir)
+        keys = ("id", "kind", "created_at", "seconds", "bytes")
+        return {
+            "interval": self.interval,
+            "scheduler": self._scheduler_lock is not None,
+            "last": {k: last[k] for k in keys} if last else None,
+        }
+
+
+# ==================== RESTORE ====================
+
+def _rebuild_part(chain: List[dict], part: str, alive: Dict[str, tuple], target: str) -> List[str]:
+    """Write the part's index from the chain's vectors (memory-mapped); returns the id map."""
+    full_path = os.path.join(chain[0]["path"], part, INDEX_FILE)
+    full = faiss.read_index(full_path, faiss.IO_FLAG_MMAP_IFC) if os.path.isfile(full_path) else None
+    sources = [index_vectors(full) if full is not None else None] + [
+        np.load(os.path.join(m["path"], part, "added.npy"), mmap_mode="r") for m in chain[1:]
+    ]
+    dim = full.d if full is not None else next(v.shape[1] for v in sources[1:] if v.size)
+    metric = full.metric_type if full is not None else faiss.METRIC_INNER_PRODUCT
+    rows_by_source: Dict[int, List[tuple]] = {}
+    for uid, (pos, row) in alive.items():
+        rows_by_source.setdefault(pos, []).append((row, uid))
+
+    index = faiss.IndexFlat(dim, metric)
+    ids: List[str] = []
+    for pos in sorted(rows_by_source):
+        picked = sorted(rows_by_source[pos])
+        rows = np.fromiter((row for row, _ in picked), dtype=np.int64, count=len(picked))
+        for i in range(0, len(rows), _CHUNK):
+            index.add(np.ascontiguousarray(sources[pos][rows[i:i + _CHUNK]], dtype=np.float32))
+        ids.extend(uid for _, uid in picked)
+    tmp = os.path.join(target, INDEX_FILE + ".tmp")
+    faiss.write_index(index, tmp)
+    os.replace(tmp, os.path.join(target, INDEX_FILE))
+    return ids
+
+
+def restore(snapshot_id: Optional[str] = None, snapshot_dir: str = SNAPSHOT_DIR, root: str = ".") -> dict:
+    """
+    Put a snapshot in place under root (the node's working directory).
+    Stop the API first; start it with VECTOR_INDEX_MMAP=true to serve at once.
+    """
+    start = time.perf_counter()
+    chain = chain_for(snapshot_id, snapshot_dir)
+    if not chain:
+        raise ValueError(f"No snapshots in {snapshot_dir}")
+    full, sources = chain[0], chain[-1]["sources"]
+    state = load_chain_state(chain)
+    timings = {"replay": round(time.perf_counter() - start, 3)}
+
+    t0 = time.perf_counter()
+    rebuilt = []
+    for part, alive in state["parts"].items():
+        target = os.path.join(root, sources["parts"][part])
+        os.makedirs(target, exist_ok=True)
+        full_dir = os.path.join(full["path"], part)
+        unchanged = len(alive) == len(_read_ids(full_dir)) and all(pos == 0 for pos, _ in alive.values())
+        if not alive:
+            if os.path.exists(os.path.join(target, INDEX_FILE)):
+                os.remove(os.path.join(target, INDEX_FILE))
+            _write_json(os.path.join(target, USERS_FILE), {"id_map": []})
+        elif unchanged:
+            # Unchanged since the full snapshot: its files are usable as they are
+            _place_file(os.path.join(full_dir, INDEX_FILE), os.path.join(target, INDEX_FILE))
+            _place_file(os.path.join(full_dir, USERS_FILE), os.path.join(target, USERS_FILE))
+        else:
+            ids = _rebuild_part(chain, part, alive, target)
+            _write_json(os.path.join(target, USERS_FILE), {"id_map": ids})
+            rebuilt.append(part)
+    timings["gallery"] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    for name, registry in state["registries"].items():
+        path = os.path.join(root, sources["registries"][name])
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if len(chain) == 1:
+            _place_file(os.path.join(full["path"], f"{name}.json"), path)
+        else:
+            _write_json(path, registry)
+    timings["registries"] = round(time.perf_counter() - t0, 3)
+    timings["total"] = round(time.perf_counter() - start, 3)
+
+    return {
+        "snapshot": chain[-1]["id"],
+        "chain": [m["id"] for m in chain],
+        "vectors": sum(len(alive) for alive in state["parts"].values()),
+        "rebuilt_parts": rebuilt,
+        "seconds": timings,
+    }
+
+
+# ==================== BENCHMARK ====================
+
+def bench(users: int, dim: int = 512, changes: float = 0.01, deletes: int = 2, workdir: Optional[str] = None) -> dict:
+    """Full + incremental snapshot, restore and mapped start-up on a synthetic gallery."""
+    import app.storage as storage_module
+    from app.document_storage import DocumentStorage
+
+    workdir = workdir or tempfile.mkdtemp(prefix="snapshot-bench-")
+    live = os.path.join(workdir, "live")
+    rng = np.random.default_rng(0)
+    report = {"users": users, "dim": dim, "workdir": workdir}
+
+    t0 = time.perf_counter()
+    store = VectorStore(dim=dim, use_cosine=True, data_dir=os.path.join(live, DATA_DIR))
+    docs = DocumentStorage(os.path.join(live, "documents_db.json"))
+    for base in range(0, users, 100000):
+        n = min(100000, users - base)
+        ids = [f"user-{base + i:08d}" for i in range(n)]
+        store.add_vectors(ids, rng.standard_normal((n, dim), dtype=np.float32), persist=False)
+        for i, uid in enumerate(ids):
+            wallet = f"0x{base + i:040x}"
+            store.wallets[wallet] = {"user_id": uid, "embedding_digest": uid, "salt": "00"}
+            if (base + i) % 2 == 0:
+                docs.documents[wallet] = [{"ipfs_cid": f"cid-{base + i}", "document_type": "pan card"}]
+    store.persist()
+    docs.save()
+    report["build_seconds"] = round(time.perf_counter() - t0, 1)
+
+    sources = {
+        "parts": {"gallery": DATA_DIR},
+        "registries": {"wallets": os.path.join(DATA_DIR, "wallets.json"), "documents": "documents_db.json"},
+    }
+    snapshotter = Snapshotter(os.path.join(workdir, "snapshots"), sources=sources, root=live)
+    full = snapshotter.take(full=True)
+    report["full"] = {k: full[k] for k in ("seconds", "lock_ms", "bytes")}
+
+    added = max(1, int(users * changes))
+    ids = [f"new-{i:08d}" for i in range(added)]
+    store.add_vectors(ids, rng.standard_normal((added, dim), dtype=np.float32), persist=False)
+    for i, uid in enumerate(ids):
+        store.wallets[f"0x{users + i:040x}"] = {"user_id": uid, "embedding_digest": uid, "salt": "00"}
+    for i in range(deletes):
+        store.delete_vector(f"user-{i:08d}")
+    t0 = time.perf_counter()
+    store.persist()
+    report["persist_seconds"] = round(time.perf_counter() - t0, 3)
+    incremental = snapshotter.take()
+    report["incremental"] = {k: incremental[k] for k in ("seconds", "lock_ms", "bytes")}
+    report["incremental"]["added"] = added
+
+    restore_root = os.path.join(workdir, "restored")
+    report["restore"] = restore(snapshot_dir=snapshotter.snapshot_dir, root=restore_root)["seconds"]
+    report["restore_full_only"] = restore(
+        full["id"], snapshot_dir=snapshotter.snapshot_dir, root=os.path.join(workdir, "restored-full")
+    )["seconds"]
+
+    # Start-up from the restored files: mapped vs read into memory
+    query = rng.standard_normal(dim, dtype=np.float32)
+    for mode in ("mmap", "read"):
+        storage_module.VECTOR_INDEX_MMAP = mode == "mmap"
+        t0 = time.perf_counter()
+        node = VectorStore(dim=dim, use_cosine=True, data_dir=os.path.join(restore_root, DATA_DIR))
+        node.search(query)
+        ready = time.perf_counter() - t0
+        node.hydrate()
+        report[f"startup_{mode}"] = {"serving_seconds": round(ready, 3), "in_memory_seconds": round(time.perf_counter() - t0, 3)}
+    storage_module.VECTOR_INDEX_MMAP = False
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gallery and registry snapshots")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    take = sub.add_parser("take", help="Snapshot the persisted files (safe while the API runs)")
+    take.add_argument("--full", action="store_true")
+    sub.add_parser("list")
+    rst = sub.add_parser("restore", help="Restore a snapshot into the working directory (API stopped)")
+    rst.add_argument("snapshot_id", nargs="?")
+    rst.add_argument("--root", default=".")
+    b = sub.add_parser("bench", help="Time snapshot and restore on a synthetic gallery")
+    b.add_argument("--users", type=int, default=100000)
+    b.add_argument("--dim", type=int, default=512)
+    b.add_argument("--changes", type=float, default=0.01, help="Fraction of users added before the incremental")
+    b.add_argument("--deletes", type=int, default=2, help="Users deleted before the incremental (each rebuilds the index)")
+    b.add_argument("--workdir")
+    b.add_argument("--keep", action="store_true", help="Keep the benchmark directory")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for m in list_snapshots(args.snapshot_dir):
+            print(f"{m['id']}  {m['kind']:<11}  {m['created_at']}  {m['bytes']:>14,} bytes  {m['seconds']}s")
+    elif args.command == "take":
+        try:
+            manifest = Snapshotter(args.snapshot_dir).take(full=args.full)
+        except SnapshotBusy as e:
+            raise SystemExit(str(e))
+        print(json.dumps(manifest, indent=2))
+    elif args.command == "restore":
+        print(json.dumps(restore(args.snapshot_id, args.snapshot_dir, args.root), indent=2))
+    else:
+        report = bench(args.users, args.dim, args.changes, args.deletes, args.workdir)
+        if not args.keep and not args.workdir:
+            shutil.rmtree(report["workdir"], ignore_errors=True)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
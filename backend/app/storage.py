@@ -1,15 +1,26 @@
 import json
 import os
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from typing import Optional, Tuple, List, Dict
 
 import faiss
 import numpy as np
+from dotenv import load_dotenv
 
+load_dotenv()
 DATA_DIR = "data"
 USERS_JSON = os.path.join(DATA_DIR, "users.json")
 FAISS_INDEX_BIN = os.path.join(DATA_DIR, "faiss_index.bin")
 WALLETS_JSON = os.path.join(DATA_DIR, "wallets.json")
+# Lock file in each gallery directory; persist() and snapshots hold it so the
+# index and its id map are always read from disk as a pair
+PERSIST_LOCK = ".persist.lock"
+# Map the index file instead of reading it (fast start after a snapshot
+# restore); it is copied into memory in the background before the first write.
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "false").lower() in ("1", "true", "yes")
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -23,28 +34,68 @@ def _l2_normalize_rows(vec: np.ndarray) -> np.ndarray:
     norms = np.maximum(norms, 1e-12)
     return vec / norms
 
+def index_vectors(index) -> np.ndarray:
+    """Zero-copy (ntotal, d) view of a flat index's vectors."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+
+def _write_json_atomic(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True):
+    """Exclusive advisory lock across processes; BlockingIOError if busy and not blocking."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
 class VectorStore:
-    def __init__(self, dim: int = 512, use_cosine: bool = True):
+    def __init__(self, dim: int = 512, use_cosine: bool = True, data_dir: str = DATA_DIR):
         self.dim = dim
         self.use_cosine = use_cosine
-        self.index = faiss.IndexFlatIP(dim) if use_cosine else faiss.IndexFlatL2(dim)
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.index_path = os.path.join(data_dir, os.path.basename(FAISS_INDEX_BIN))
+        self.users_path = os.path.join(data_dir, os.path.basename(USERS_JSON))
+        self.wallets_path = os.path.join(data_dir, os.path.basename(WALLETS_JSON))
+        self.index = self._new_index()
         self.id_map: List[str] = []
         self.wallets: Dict[str, Dict[str, str]] = {}
         self._uid_to_idx: Dict[str, int] = {}  # user_id -> index in id_map
+        # Held by every mutation and by persist()
+        self.lock = threading.RLock()
+        self._mapped = False
 
         # Load persisted index/id_map
-        if os.path.isfile(FAISS_INDEX_BIN) and os.path.isfile(USERS_JSON):
+        if os.path.isfile(self.index_path) and os.path.isfile(self.users_path):
             try:
-                self.index = faiss.read_index(FAISS_INDEX_BIN)
-                with open(USERS_JSON, "r", encoding="utf-8") as f:
+                if VECTOR_INDEX_MMAP:
+                    self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP_IFC)
+                    self._mapped = True
+                else:
+                    self.index = faiss.read_index(self.index_path)
+                with open(self.users_path, "r", encoding="utf-8") as f:
                     self.id_map = json.load(f).get("id_map", [])
             except Exception:
-                self.index = faiss.IndexFlatIP(dim) if use_cosine else faiss.IndexFlatL2(dim)
+                self.index = self._new_index()
                 self.id_map = []
+                self._mapped = False
 
-        if os.path.isfile(WALLETS_JSON):
+        if os.path.isfile(self.wallets_path):
             try:
-                with open(WALLETS_JSON, "r", encoding="utf-8") as f:
+                with open(self.wallets_path, "r", encoding="utf-8") as f:
                     self.wallets = json.load(f)
             except Exception:
                 self.wallets = {}
@@ -53,24 +104,53 @@ class VectorStore:
         for i, uid in enumerate(self.id_map):
             self._uid_to_idx[uid] = i
 
+        if self._mapped:
+            threading.Thread(target=self.hydrate, name="index-hydrate", daemon=True).start()
+
+    def _new_index(self):
+        return faiss.IndexFlatIP(self.dim) if self.use_cosine else faiss.IndexFlatL2(self.dim)
+
+    def hydrate(self):
+        """Replace a memory-mapped (read-only) index with an in-memory copy."""
+        with self.lock:
+            if not self._mapped:
+                return
+            start = time.perf_counter()
+            mapped, owned = self.index, self._new_index()
+            vectors = index_vectors(mapped)
+            for i in range(0, len(vectors), 65536):
+                owned.add(np.ascontiguousarray(vectors[i:i + 65536]))
+            self.index = owned
+            self._mapped = False
+            print(f"✅ Face index loaded into memory ({owned.ntotal} vectors, {time.perf_counter() - start:.1f}s)")
+
     def persist(self):
-        faiss.write_index(self.index, FAISS_INDEX_BIN)
-        with open(USERS_JSON, "w", encoding="utf-8") as f:
-            json.dump({"id_map": self.id_map}, f)
-        with open(WALLETS_JSON, "w", encoding="utf-8") as f:
-            json.dump(self.wallets, f)
+        # Write-then-rename: readers and snapshots never see a half-written
+        # file, and a snapshot's hard link keeps the version it captured
+        with self.lock, file_lock(os.path.join(self.data_dir, PERSIST_LOCK)):
+            tmp = self.index_path + ".tmp"
+            faiss.write_index(self.index, tmp)
+            os.replace(tmp, self.index_path)
+            _write_json_atomic(self.users_path, {"id_map": self.id_map})
+            _write_json_atomic(self.wallets_path, self.wallets)
 
-    def _rebuild_index_from_arrays(self, vectors: np.ndarray, ids: List[str]):
+    def _rebuild_index_from_arrays(self, vectors: np.ndarray, ids: List[str], persist: bool = True):
         """Internal: rebuild index from normalized float32 vectors and aligned ids."""
-        self.index = faiss.IndexFlatIP(self.dim) if self.use_cosine else faiss.IndexFlatL2(self.dim)
+        self.index = self._new_index()
         if vectors.size:
             self.index.add(vectors)
         self.id_map = ids[:]
         # Rebuild reverse map
         self._uid_to_idx = {uid: i for i, uid in enumerate(self.id_map)}
-        self.persist()
+        if persist:
+            self.persist()
 
-    def delete_vector(self, user_id: str) -> bool:
+    def delete_vector(self, user_id: str, persist: bool = True) -> bool:
+        with self.lock:
+            self.hydrate()
+            return self._delete_vector(user_id, persist)
+
+    def _delete_vector(self, user_id: str, persist: bool = True) -> bool:
         if user_id not in self._uid_to_idx:
             return False
         idx_to_remove = self._uid_to_idx[user_id]
@@ -95,10 +175,10 @@ class VectorStore:
             arr = np.zeros((0, self.dim), dtype='float32')
 
         # Rebuild index with the kept vectors
-        self._rebuild_index_from_arrays(arr, kept_ids)
+        self._rebuild_index_from_arrays(arr, kept_ids, persist)
         return True
 
-    def add_vector(self, user_id: str, embedding: np.ndarray) -> str:
+    def add_vector(self, user_id: str, embedding: np.ndarray, persist: bool = True) -> str:
         raw = _ensure_float32_2d(embedding)
         if raw.shape[1] != self.dim:
             raise ValueError(f"Expected embedding dim {self.dim}, got {raw.shape}")
@@ -106,15 +186,38 @@ class VectorStore:
         vec = _l2_normalize_rows(raw) if self.use_cosine else raw
 
         # Add to index
-        self.index.add(vec)
-        self.id_map.append(user_id)
-        self._uid_to_idx[user_id] = len(self.id_map) - 1
-        self.persist()
+        with self.lock:
+            self.hydrate()
+            self.index.add(vec)
+            self.id_map.append(user_id)
+            self._uid_to_idx[user_id] = len(self.id_map) - 1
+            if persist:
+                self.persist()
 
         digest = hashlib.sha256(embedding.astype("float32", copy=False).tobytes()).hexdigest()
         return digest
 
+    def add_vectors(self, user_ids: List[str], embeddings: np.ndarray, persist: bool = True):
+        """Bulk add (imports, restores, benchmarks); one index call for all rows."""
+        raw = _ensure_float32_2d(np.asarray(embeddings))
+        if raw.shape != (len(user_ids), self.dim):
+            raise ValueError(f"Expected {len(user_ids)} x {self.dim} embeddings, got {raw.shape}")
+        vec = _l2_normalize_rows(raw) if self.use_cosine else raw
+        with self.lock:
+            self.hydrate()
+            base = len(self.id_map)
+            self.index.add(np.ascontiguousarray(vec, dtype="float32"))
+            self.id_map.extend(user_ids)
+            self._uid_to_idx.update((uid, base + i) for i, uid in enumerate(user_ids))
+            if persist:
+                self.persist()
+
     def search(self, query: np.ndarray, k: int = 1) -> Tuple[Optional[str], float]:
+        hits = self.search_topk(query, k)
+        return hits[0] if hits else (None, 0.0)
+
+    def search_topk(self, query: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        """Up to k (user_id, score) pairs, best first."""
         raw = _ensure_float32_2d(query)
         if raw.shape[1] != self.dim:
             raise ValueError(f"Expected embedding dim {self.dim}, got {raw.shape}")
@@ -122,23 +225,35 @@ class VectorStore:
         vec = _l2_normalize_rows(raw) if self.use_cosine else raw
 
         if self.index.ntotal == 0:
-            return None, 0.0
+            return []
 
         scores, idxs = self.index.search(vec, k)
-        top_idx = int(idxs)
-        top_score = float(scores)
-        if top_idx == -1 or top_idx >= len(self.id_map):
-            return None, 0.0
-        return self.id_map[top_idx], top_score
+        return [
+            (self.id_map[int(i)], float(s))
+            for s, i in zip(scores[0], idxs[0])
+            if 0 <= i < len(self.id_map)
+        ]
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def export_vectors(self, start: int = 0, count: Optional[int] = None) -> Tuple[List[str], np.ndarray]:
+        """(user_ids, vectors) for positions start..start+count, for offline jobs."""
+        end = self.index.ntotal if count is None else min(self.index.ntotal, start + count)
+        if start >= end:
+            return [], np.zeros((0, self.dim), dtype="float32")
+        return self.id_map[start:end], self.index.reconstruct_n(start, end - start)
 
-    def bind_wallet_single(self, wallet: str, user_id: str, digest: str, salt: str):
+    def bind_wallet_single(self, wallet: str, user_id: str, digest: str, salt: str, persist: bool = True):
         """Bind wallet to exactly one user_id. Overwrites previous binding."""
-        self.wallets[wallet.lower()] = {
-            "user_id": user_id,
-            "embedding_digest": digest,
-            "salt": salt
-        }
-        self.persist()
+        with self.lock:
+            self.wallets[wallet.lower()] = {
+                "user_id": user_id,
+                "embedding_digest": digest,
+                "salt": salt
+            }
+            if persist:
+                self.persist()
 
     def get_wallet_record(self, wallet: str):
         return self.wallets.get(wallet.lower())
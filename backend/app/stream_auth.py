@@ -0,0 +1,212 @@
+import os
+import time
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.face_quality import quality_failure_message
+from app.metrics import metrics
+
+load_dotenv()
+SIM_THRESHOLD = float(os.getenv("SIM_THRESHOLD", "0.6"))
+STREAM_MAX_FRAMES = int(os.getenv("STREAM_MAX_FRAMES", "10"))
+# Anti-spoofing runs on every Nth tracked frame, on the face region only
+STREAM_LIVENESS_EVERY = int(os.getenv("STREAM_LIVENESS_EVERY", "2"))
+STREAM_MIN_LIVE_FRAMES = int(os.getenv("STREAM_MIN_LIVE_FRAMES", "2"))
+STREAM_LIVE_RATIO = float(os.getenv("STREAM_LIVE_RATIO", "0.66"))
+STREAM_MIN_MATCH_FRAMES = int(os.getenv("STREAM_MIN_MATCH_FRAMES", "2"))
+# Every tracked frame must look like the same person as the frames matched so far
+STREAM_MIN_FRAME_SIMILARITY = float(os.getenv("STREAM_MIN_FRAME_SIMILARITY", "0.5"))
+# A WebSocket stream holds an admission slot; close it after this long without a message
+STREAM_IDLE_SECONDS = float(os.getenv("STREAM_IDLE_SECONDS", "10"))
+
+# Search region around the previous face box, and the context kept for liveness
+TRACK_MARGIN = 0.6
+LIVENESS_MARGIN = 0.4
+
+
+def _expand(box, margin: float, shape) -> tuple:
+    h, w = shape[:2]
+    x0, y0, x1, y1 = box
+    dx, dy = (x1 - x0) * margin, (y1 - y0) * margin
+    return (
+        max(0, int(x0 - dx)), max(0, int(y0 - dy)),
+        min(w, int(x1 + dx)), min(h, int(y1 + dy))
+    )
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+class StreamAuthSession:
+    """
+    Authenticate a wallet from a short burst of frames.
+
+    The face is detected once on the full frame and then tracked inside a
+    window around the previous box. Anti-spoofing runs on a subsample of
+    frames, and only frames that passed it feed the running mean embedding
+    that is matched against the gallery. Every other tracked frame must
+    still agree with that mean, so a photo shown between live frames fails
+    the session instead of steering the match. The session finishes as soon as both liveness and match are decided, or
+    when liveness can no longer reach the required ratio. Frames that fail
+    the quality gate keep the face tracked but skip liveness and embedding.
+    """
+
+    def __init__(self, pipeline, store, wallet: str, max_frames: int = STREAM_MAX_FRAMES):
+        self.pipeline = pipeline
+        self.store = store
+        self.wallet = wallet
+        self.max_frames = max_frames
+        self.frames = 0
+        self.tracked = 0
+        self.box = None
+        self.quality_rejects: List[dict] = []
+        self.live_checks: List[bool] = []
+        self.live_confidence: List[float] = []
+        self.match_scores: List[float] = []
+        self.matched_users: List[Optional[str]] = []
+        self._emb_sum = None
+        self.result: Optional[dict] = None
+        self.started = time.perf_counter()
+
+    # ---- per-frame work ----
+
+    def _track(self, image_bgr: np.ndarray):
+        if self.box is not None:
+            x0, y0, x1, y1 = _expand(self.box, TRACK_MARGIN, image_bgr.shape)
+            aligned, box, _prob, landmarks = self.pipeline.detect_face(image_bgr[y0:y1, x0:x1])
+            if aligned is not None:
+                metrics.incr("stream_auth.tracked_frames")
+                if landmarks is not None:
+                    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(5, 2) + (x0, y0)
+                return aligned, [box[0] + x0, box[1] + y0, box[2] + x0, box[3] + y0], landmarks
+            metrics.incr("stream_auth.track_lost")
+        aligned, box, _prob, landmarks = self.pipeline.detect_face(image_bgr)
+        return aligned, box, landmarks
+
+    def feed(self, image_bgr: np.ndarray) -> Optional[dict]:
+        """Process one frame; returns the final result once decided, else None."""
+        if self.result is not None:
+            return self.result
+        self.frames += 1
+        metrics.incr("stream_auth.frames")
+
+        aligned, box, landmarks = self._track(image_bgr)
+        if aligned is None:
+            self.box = None
+            return self._decide()
+        # Keep tracking the face even when this frame is unusable
+        self.box = box
+        quality = self.pipeline.assess_quality(image_bgr, box, landmarks)
+        if not quality["ok"]:
+            self.quality_rejects.append(quality)
+            metrics.incr("stream_auth.quality_rejected")
+            return self._decide()
+        self.tracked += 1
+
+        is_live = False
+        if (self.tracked - 1) % STREAM_LIVENESS_EVERY == 0:
+            x0, y0, x1, y1 = _expand(box, LIVENESS_MARGIN, image_bgr.shape)
+            liveness = self.pipeline.check_liveness_from_bgr(image_bgr[y0:y1, x0:x1], enforce_detection=False)
+            is_live = bool(liveness["is_live"])
+            self.live_checks.append(is_live)
+            self.live_confidence.append(float(liveness["confidence"]))
+            metrics.incr("stream_auth.liveness_checks")
+
+        emb = _unit(np.asarray(self.pipeline.embed(aligned), dtype=np.float32))
+        if self._emb_sum is not None and float(emb @ _unit(self._emb_sum)) < STREAM_MIN_FRAME_SIMILARITY:
+            metrics.incr("stream_auth.face_changed")
+            return self._finish(False, "Face changed during session")
+        if not is_live:
+            return self._decide()
+        self._emb_sum = emb if self._emb_sum is None else self._emb_sum + emb
+        user, score = self.store.search(_unit(self._emb_sum), k=1)
+        self.matched_users.append(user)
+        self.match_scores.append(float(score))
+
+        return self._decide()
+
+    # ---- decisions ----
+
+    def _liveness_state(self) -> Optional[bool]:
+        checks = len(self.live_checks)
+        live = sum(self.live_checks)
+        if checks and live >= STREAM_MIN_LIVE_FRAMES and live / checks >= STREAM_LIVE_RATIO:
+            return True
+        # Checks still possible in the remaining frames
+        remaining = (self.max_frames - self.frames + STREAM_LIVENESS_EVERY - 1) // STREAM_LIVENESS_EVERY
+        best_live, best_checks = live + remaining, checks + remaining
+        if best_live < STREAM_MIN_LIVE_FRAMES or (best_checks and best_live / best_checks < STREAM_LIVE_RATIO):
+            return False
+        return None
+
+    def _match_state(self) -> Optional[str]:
+        recent = list(zip(self.matched_users, self.match_scores))[-STREAM_MIN_MATCH_FRAMES:]
+        if len(recent) < STREAM_MIN_MATCH_FRAMES:
+            return None
+        users = {u for u, _ in recent}
+        if len(users) == 1 and None not in users and all(s >= SIM_THRESHOLD for _, s in recent):
+            return recent[-1][0]
+        return None
+
+    def _decide(self) -> Optional[dict]:
+        live = self._liveness_state()
+        matched = self._match_state()
+        if live is False:
+            if not self.tracked:
+                return self._finish(False, self._no_face_message())
+            if all(self.live_checks):
+                return self._finish(False, "Liveness not confirmed")
+            return self._finish(False, "Liveness check failed: Spoof detected")
+        if live and matched:
+            rec = self.store.get_wallet_record(self.wallet)
+            if rec and rec["user_id"] != matched:
+                return self._finish(False, "Face matches another enrolled user", matched)
+            return self._finish(True, "Authenticated", matched)
+        if self.frames >= self.max_frames:
+            if not self.tracked:
+                return self._finish(False, self._no_face_message())
+            if not live:
+                return self._finish(False, "Liveness not confirmed")
+            return self._finish(False, "Not matched", self.matched_users[-1] if self.matched_users else None)
+        return None
+
+    def _no_face_message(self) -> str:
+        if not self.quality_rejects:
+            return "No face detected"
+        # A face was there in bad conditions; tell the client the most frequent problem
+        reason = Counter(q["reason"] for q in self.quality_rejects).most_common(1)[0][0]
+        return quality_failure_message(next(q for q in self.quality_rejects if q["reason"] == reason))
+
+    def _finish(self, passed: bool, message: str, user_id: Optional[str] = None) -> dict:
+        elapsed = time.perf_counter() - self.started
+        metrics.observe("stream_auth.session", elapsed)
+        metrics.incr("stream_auth.passed" if passed else "stream_auth.failed")
+        metrics.set_gauge("stream_auth.last_frames_used", self.frames)
+        self.result = {
+            "user_id": user_id,
+            "score": self.match_scores[-1] if self.match_scores else 0.0,
+            "passed": passed,
+            "message": message,
+            "frames_used": self.frames,
+            "frames_tracked": self.tracked,
+            "frames_low_quality": len(self.quality_rejects),
+            "liveness_checks": len(self.live_checks),
+            "liveness_passed": sum(self.live_checks),
+            "liveness_confidence": float(np.mean(self.live_confidence)) if self.live_confidence else 0.0,
+            "elapsed_ms": round(1000 * elapsed, 1),
+        }
+        return self.result
+
+    def finish(self) -> dict:
+        """Final result when the client runs out of frames before a decision."""
+        if self.result is not None:
+            return self.result
+        if not self.tracked:
+            return self._finish(False, self._no_face_message())
+        if not self._liveness_state():
+            return self._finish(False, "Liveness not confirmed")
+        return self._finish(False, "Not matched", self.matched_users[-1] if self.matched_users else None)
@@ -6,8 +6,10 @@ Requires: NVIDIA GPU, CUDA, cuDNN, TensorRT 8.6+
 Fixed for dynamic batch sizes with optimization profile
 """
 
+import os
 import platform
 import sys
+import urllib.request
 from typing import Optional, Tuple
 import numpy as np
 import torch
@@ -17,6 +19,19 @@ from deepface import DeepFace
 from facenet_pytorch import MTCNN, InceptionResnetV1
 import onnx
 
+from app.model_registry import (
+    DETECTOR_PARITY_MIN_COSINE, ModelRegistry, file_sha256, fingerprint, parity_report, weights_sha256
+)
+
+# Single-shot face detector with 5-point landmarks (OpenCV zoo, MIT licence).
+# The download must be pinned: a URL at a fixed commit, e.g.
+# https://github.com/opencv/opencv_zoo/raw/<commit>/models/face_detection_yunet/face_detection_yunet_2023mar.onnx
+# and the SHA-256 of that file; nothing is fetched without both.
+YUNET_URL = os.getenv("YUNET_URL", "")
+YUNET_SHA256 = os.getenv("YUNET_SHA256", "").lower()
+# Face photos used to compare the ONNX detector's crops with MTCNN's
+FACE_DETECTOR_PARITY_DIR = os.getenv("FACE_DETECTOR_PARITY_DIR", "")
+
 
 class ModelConverter:
     """Convert PyTorch models to TensorRT for 30-40% speedup"""
@@ -24,14 +39,21 @@ class ModelConverter:
     @staticmethod
     def pytorch_to_onnx(
         model_name: str = "embedder",
-        output_dir: str = "./models"
+        output_dir: str = "./models",
+        opset: int = 13,
+        force: bool = False
     ) -> str:
         """
         Convert InceptionResnetV1 PyTorch model to ONNX format
         
+        Skipped when the registry already has an intact export of the same
+        weights at the same opset (unless force=True). CPU only.
+        
         Args:
             model_name: "embedder" (InceptionResnetV1)
             output_dir: Directory to save ONNX file
+            opset: ONNX opset version
+            force: Rebuild even if a cached artefact is up to date
             
         Returns:
             Path to ONNX file
@@ -49,6 +71,13 @@ class ModelConverter:
         else:
             raise ValueError(f"Unknown model: {model_name}")
         
+        registry = ModelRegistry(output_dir)
+        source_hash = weights_sha256(model)
+        cached = registry.lookup(model_name, "onnx", "fp32", source_hash, opset=opset)
+        if cached and not force:
+            print(f"♻️  Up-to-date ONNX cached: {onnx_path}")
+            return onnx_path
+        
         # Step 2: Export to ONNX
         torch.onnx.export(
             model,
@@ -60,7 +89,7 @@ class ModelConverter:
                 input_names[0]: {0: "batch_size"},
                 output_names[0]: {0: "batch_size"}
             },
-            opset_version=13,
+            opset_version=opset,
             do_constant_folding=True,
             verbose=False
         )
@@ -72,15 +101,166 @@ class ModelConverter:
         onnx.checker.check_model(onnx_model)
         print(f"✅ ONNX model verified")
         
+        # Step 4: Record it
+        registry.register({
+            "path": onnx_path,
+            "model": model_name,
+            "format": "onnx",
+            "precision": "fp32",
+            "opset": opset,
+            "batch_profile": {"min": 1, "opt": 1, "max": None},
+            "source_hash": source_hash,
+            "fingerprint": fingerprint("onnx"),
+        })
+        
+        return onnx_path
+
+    @staticmethod
+    def face_detector_to_onnx(
+        output_dir: str = "./models",
+        source: Optional[str] = None,
+        input_size: int = 640
+    ) -> str:
+        """
+        Prepare the single-shot face detector for onnxruntime / TensorRT
+
+        Takes the YuNet ONNX graph (downloaded from YUNET_URL and checked
+        against YUNET_SHA256 unless a local source path is given), pins its
+        input to a static 1x3xSxS so the runtime can plan memory once,
+        verifies it and saves it as face_detector.onnx.
+        
+        Args:
+            output_dir: Directory to save ONNX file
+            source: Local YuNet .onnx (default: download from the OpenCV zoo)
+            input_size: Square input side, multiple of 32
+            
+        Returns:
+            Path to ONNX file
+        """
+        print(f"\n🔄 Preparing face detector ONNX ({input_size}x{input_size})...")
+        if input_size % 32:
+            raise ValueError("input_size must be a multiple of 32")
+        
+        # Step 1: Fetch the model
+        if source is None:
+            if not YUNET_SHA256:
+                raise ValueError("YUNET_SHA256 must be set to fetch the face detector (or pass a local source)")
+            source = os.path.join(output_dir, "face_detection_yunet.onnx")
+            if not os.path.exists(source):
+                if not YUNET_URL:
+                    raise ValueError("YUNET_URL must be set to a commit-pinned URL (or pass a local source)")
+                print(f"⬇️  Downloading {YUNET_URL}")
+                partial = source + ".part"
+                urllib.request.urlretrieve(YUNET_URL, partial)
+                os.replace(partial, source)
+            digest = file_sha256(source)
+            if digest != YUNET_SHA256:
+                os.remove(source)
+                raise ValueError(f"Face detector checksum mismatch: got {digest}, expected {YUNET_SHA256}")
+        
+        # Step 2: Static input shape
+        model = onnx.load(source)
+        dims = model.graph.input[0].type.tensor_type.shape.dim
+        for dim, value in zip(dims, (1, 3, input_size, input_size)):
+            dim.ClearField("dim_param")
+            dim.dim_value = value
+        
+        # Step 3: Verify outputs the runtime decodes
+        names = {o.name for o in model.graph.output}
+        expected = {f"{kind}_{stride}" for kind in ("cls", "obj", "bbox", "kps") for stride in (8, 16, 32)}
+        if not expected <= names:
+            raise ValueError(f"Unexpected detector outputs: {sorted(names)}")
+        onnx.checker.check_model(model)
+        
+        onnx_path = f"{output_dir}/face_detector.onnx"
+        onnx.save(model, onnx_path)
+        print(f"✅ Face detector exported: {onnx_path}")
+        
+        ModelRegistry(output_dir).register({
+            "path": onnx_path,
+            "model": "face_detector",
+            "format": "onnx",
+            "precision": "fp32",
+            "opset": model.opset_import[0].version if model.opset_import else None,
+            "batch_profile": {"min": 1, "opt": 1, "max": 1},
+            "source_hash": file_sha256(source),
+            "fingerprint": fingerprint("onnx"),
+        })
+        
         return onnx_path
 
+    @staticmethod
+    def face_detector_parity(
+        onnx_path: str,
+        sample_dir: str = FACE_DETECTOR_PARITY_DIR,
+        output_dir: str = "./models"
+    ) -> Optional[dict]:
+        """
+        Compare the ONNX detector with MTCNN on real face photos: both crops
+        of each photo are embedded with the PyTorch embedder and compared by
+        cosine. The ONNX detector boxes faces differently, so a low score
+        means faces enrolled with MTCNN need re-enrollment after switching.
+        A photo where only one detector finds a face counts as 0.
+        
+        Returns:
+            Parity report (also recorded in the registry), or None without samples
+        """
+        from app.face_detector import ONNXFaceDetector
+        
+        paths = []
+        if sample_dir and os.path.isdir(sample_dir):
+            paths = sorted(
+                os.path.join(sample_dir, name) for name in os.listdir(sample_dir)
+                if name.lower().endswith((".jpg", ".jpeg", ".png"))
+            )
+        if not paths:
+            print("⚠️  No FACE_DETECTOR_PARITY_DIR photos; detector parity not checked")
+            return None
+        
+        detector = ONNXFaceDetector(onnx_path)
+        mtcnn = MTCNN(image_size=160, margin=20, post_process=True)
+        embedder = InceptionResnetV1(pretrained="vggface2").eval()
+        cosines, missed = [], 0
+        with torch.no_grad():
+            for path in paths:
+                image_bgr = cv2.imread(path)
+                if image_bgr is None:
+                    continue
+                reference = mtcnn(Image.fromarray(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)))
+                aligned = detector.detect_and_crop(image_bgr)[0]
+                if reference is None and aligned is None:
+                    continue
+                if reference is None or aligned is None:
+                    missed += 1
+                    cosines.append(0.0)
+                    continue
+                # The embedder's outputs are L2-normalised
+                pair = embedder(torch.stack([reference, torch.from_numpy(aligned)])).numpy()
+                cosines.append(float(pair[0] @ pair[1]))
+        if not cosines:
+            print("⚠️  No faces found in FACE_DETECTOR_PARITY_DIR; detector parity not checked")
+            return None
+        cos = np.asarray(cosines)
+        parity = {
+            "samples": int(len(cos)),
+            "missed": missed,
+            "mean_cosine": round(float(cos.mean()), 6),
+            "min_cosine": round(float(cos.min()), 6),
+            "passed": bool(cos.min() >= DETECTOR_PARITY_MIN_COSINE),
+        }
+        ModelRegistry(output_dir).set_parity(onnx_path, parity)
+        return parity
+
     @staticmethod
     def onnx_to_tensorrt(
         onnx_path: str,
         output_dir: str = "./models",
         fp16: bool = True,
         int8: bool = False,
-        max_workspace_size: int = 1 << 30  # 1GB
+        max_workspace_size: int = 1 << 30,  # 1GB
+        input_shape: Tuple[int, int, int] = (3, 160, 160),
+        max_batch: int = 16,
+        force: bool = False
     ) -> str:
         """
         Convert ONNX model to TensorRT engine (TensorRT 8.6+ compatible)
@@ -92,6 +272,9 @@ class ModelConverter:
             fp16: Enable FP16 precision (40% speedup, minimal accuracy loss)
             int8: Enable INT8 quantization (60% speedup, more accuracy loss)
             max_workspace_size: GPU memory for optimization (bytes)
+            input_shape: (C, H, W) of the model input
+            max_batch: Largest batch in the optimization profile
+            force: Rebuild even if a cached engine for this GPU is up to date
             
         Returns:
             Path to TensorRT engine file (.trt)
@@ -108,8 +291,28 @@ class ModelConverter:
         # Step 1: Create logger
         logger = trt.Logger(trt.Logger.WARNING)
         
-        # Step 2: Create builder
+        # Step 2: Create builder; it decides which precision can be enabled
         builder = trt.Builder(logger)
+        precision = "fp32"
+        if fp16 and builder.platform_has_fast_fp16:
+            precision = "fp16"
+        if int8 and builder.platform_has_fast_int8:
+            precision = "int8"
+        
+        # Reuse an engine built from the same ONNX on this GPU / TensorRT,
+        # registered under the precision this GPU actually enables
+        registry = ModelRegistry(output_dir)
+        onnx_file = os.path.basename(onnx_path)
+        source = next((a for a in registry.artefacts if a["file"] == onnx_file), None)
+        source_hash = source["source_hash"] if source else file_sha256(onnx_path)
+        model_name = source["model"] if source else os.path.splitext(onnx_file)[0]
+        batch_profile = {"min": 1, "opt": 1, "max": max_batch}
+        cached = registry.lookup(model_name, "tensorrt", precision, source_hash, batch_profile=batch_profile)
+        if cached and not force:
+            engine_path = registry.path_of(cached)
+            print(f"♻️  Up-to-date TensorRT engine cached: {engine_path}")
+            return engine_path
+        
         network = builder.create_network(
             1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH)
         )
@@ -138,23 +341,23 @@ class ModelConverter:
         input_name = input_tensor.name
         
         # Define min, opt, max batch sizes for the input
-        # Format: (batch_size, 3, 160, 160)
+        # Format: (batch_size, C, H, W)
         profile.set_shape(
             input_name,
-            min=(1, 3, 160, 160),      # Minimum batch size = 1
-            opt=(1, 3, 160, 160),      # Optimal batch size = 1
-            max=(16, 3, 160, 160)      # Maximum batch size = 16
+            min=(1, *input_shape),          # Minimum batch size = 1
+            opt=(1, *input_shape),          # Optimal batch size = 1
+            max=(max_batch, *input_shape)   # Maximum batch size
         )
         config.add_optimization_profile(profile)
         
-        print(f"📊 Optimization profile: batch size 1-16")
+        print(f"📊 Optimization profile: batch size 1-{max_batch}")
         
         # Step 5: Enable optimizations
         if fp16 and builder.platform_has_fast_fp16:
             config.set_flag(trt.BuilderFlag.FP16)
             print("⚡ FP16 enabled (40% speedup)")
         
-        if int8 and builder.platform_has_fast_int8:
+        if precision == "int8":
             config.set_flag(trt.BuilderFlag.INT8)
             print("⚡ INT8 enabled (60% speedup)")
         
@@ -185,14 +388,22 @@ class ModelConverter:
             print("❌ Engine creation failed")
             return None
         
-        # Step 7: Serialize engine
-        engine_path = onnx_path.replace(".onnx", "_fp16.trt" if fp16 else ".trt")
-        if int8:
-            engine_path = onnx_path.replace(".onnx", "_int8.trt")
+        # Step 7: Serialize engine (named after the precision actually enabled)
+        engine_path = onnx_path.replace(".onnx", f"_{precision}.trt")
         
         with open(engine_path, "wb") as f:
             f.write(engine.serialize())
         
+        registry.register({
+            "path": engine_path,
+            "model": model_name,
+            "format": "tensorrt",
+            "precision": precision,
+            "opset": source.get("opset") if source else None,
+            "batch_profile": batch_profile,
+            "source_hash": source_hash,
+            "fingerprint": fingerprint("tensorrt"),
+        })
         print(f"✅ TensorRT engine saved: {engine_path}")
         
         return engine_path
@@ -201,15 +412,21 @@ class ModelConverter:
     def full_conversion_pipeline(
         output_dir: str = "./models",
         fp16: bool = True,
-        int8: bool = False
+        int8: bool = False,
+        include_detector: bool = True,
+        force: bool = False
     ) -> dict:
         """
-        Complete conversion: PyTorch → ONNX → TensorRT
+        Complete conversion: PyTorch → ONNX → TensorRT, with a parity report
+        of each artefact against PyTorch. Runs CPU-only up to the ONNX step;
+        the TensorRT step is skipped when TensorRT is not installed.
         
         Returns:
-            {"embedder_trt": "/path/to/embedder_fp16.trt"}
+            {"embedder_onnx": "/path/to/embedder.onnx",
+             "embedder_trt": "/path/to/embedder_fp16.trt",
+             "detector_onnx": "/path/to/face_detector.onnx",
+             "parity": {"embedder.onnx": {...}, ...}}
         """
-        import os
         os.makedirs(output_dir, exist_ok=True)
         
         print(f"\n{'='*60}")
@@ -217,20 +434,51 @@ class ModelConverter:
         print(f"{'='*60}")
         
         # Step 1: PyTorch → ONNX
-        onnx_path = ModelConverter.pytorch_to_onnx("embedder", output_dir)
+        onnx_path = ModelConverter.pytorch_to_onnx("embedder", output_dir, force=force)
+        result = {"embedder_onnx": onnx_path, "parity": {}}
         
         # Step 2: ONNX → TensorRT
-        trt_path = ModelConverter.onnx_to_tensorrt(
-            onnx_path,
-            output_dir,
-            fp16=fp16,
-            int8=int8
-        )
-        
-        if trt_path:
-            print(f"\n✅ CONVERSION COMPLETE")
-            print(f"📦 TensorRT engine: {trt_path}")
-            return {"embedder_trt": trt_path}
+        trt_path = None
+        if torch.cuda.is_available():
+            trt_path = ModelConverter.onnx_to_tensorrt(
+                onnx_path,
+                output_dir,
+                fp16=fp16,
+                int8=int8,
+                force=force
+            )
+            if trt_path:
+                result["embedder_trt"] = trt_path
         else:
-            print(f"\n❌ CONVERSION FAILED")
-            return None
+            print("ℹ️  No CUDA device; skipping TensorRT (ONNX runs on CPU)")
+        
+        # Step 3: Parity against PyTorch
+        registry = ModelRegistry(output_dir)
+        model = InceptionResnetV1(pretrained="vggface2").eval()
+        for path, fmt in ((onnx_path, "onnx"), (trt_path, "tensorrt")):
+            if not path:
+                continue
+            parity = parity_report(model, path, fmt)
+            registry.set_parity(path, parity)
+            result["parity"][os.path.basename(path)] = parity
+            status = "✅" if parity["passed"] else "❌"
+            print(f"{status} Parity {os.path.basename(path)}: mean cos {parity['mean_cosine']}, min {parity['min_cosine']}")
+        
+        # Step 4: Face detector (runs through onnxruntime like the embedder)
+        if include_detector:
+            try:
+                result["detector_onnx"] = ModelConverter.face_detector_to_onnx(output_dir)
+            except Exception as e:
+                print(f"⚠️  Face detector export failed: {e}")
+            if "detector_onnx" in result:
+                parity = ModelConverter.face_detector_parity(result["detector_onnx"], output_dir=output_dir)
+                if parity:
+                    result["parity"][os.path.basename(result["detector_onnx"])] = parity
+                    status = "✅" if parity["passed"] else "❌"
+                    print(f"{status} Parity face_detector.onnx vs MTCNN: mean cos {parity['mean_cosine']}, min {parity['min_cosine']}")
+        
+        print(f"\n✅ CONVERSION COMPLETE")
+        for key in ("embedder_onnx", "embedder_trt", "detector_onnx"):
+            if key in result:
+                print(f"📦 {key}: {result[key]}")
+        return result
@@ -1,24 +1,30 @@
-from tensorrt_pipeline import ModelConverter
+# Run from backend/:  python -m app.tensort [--force] [--int8]
+from app.tensorrt_pipeline import ModelConverter
 import os
+import sys
 
 # Create models directory
 os.makedirs("./models", exist_ok=True)
 
 print("\n" + "="*60)
-print("CONVERTING PYTORCH -> TENSORRT")
+print("CONVERTING PYTORCH -> ONNX -> TENSORRT")
 print("="*60)
 
-# Convert (takes 3-5 minutes)
+# Convert (takes 3-5 minutes; cached artefacts are reused unless --force)
 result = ModelConverter.full_conversion_pipeline(
     output_dir="./models",
     fp16=True,
-    int8=False
+    int8="--int8" in sys.argv,
+    force="--force" in sys.argv
 )
 
 if result:
     print("\n✅ CONVERSION SUCCESSFUL!")
-    print(f"📦 Your files:")
-    print(f"   - ./models/embedder.onnx (90MB)")
-    print(f"   - ./models/embedder_fp16.trt (30MB)")
+    print(f"📦 Your files (recorded in ./models/registry.json):")
+    for key in ("embedder_onnx", "embedder_trt", "detector_onnx"):
+        if key in result:
+            print(f"   - {result[key]}")
+    for name, parity in result["parity"].items():
+        print(f"   parity {name}: min cosine {parity['min_cosine']} ({'ok' if parity['passed'] else 'FAILED'})")
 else:
     print("\n❌ Conversion failed. Check errors above.")
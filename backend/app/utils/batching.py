@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+
+class MicroBatcher:
+    """
+    Collect submitted items into small batches and run them on a bounded pool.
+
+    A dispatcher thread waits up to `max_wait_ms` for up to `max_batch` items,
+    then hands the batch to one of `workers` threads. When every worker is
+    busy the dispatcher blocks, so batches grow under load instead of work
+    piling up in parallel. `process_batch` receives (item, enqueued_at) pairs
+    and must return one result (or exception instance) per item.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch: int = 8,
+        max_wait_ms: float = 10.0,
+        workers: int = 1,
+        max_queue: int = 64,
+        name: str = "batcher"
+    ):
+        self.process_batch = process_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = max(1, workers)
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._slots = threading.Semaphore(self.workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._dispatcher is not None:
+            return
+        with self._start_lock:
+            if self._dispatcher is not None:
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-worker")
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name=f"{self.name}-dispatch", daemon=True)
+            self._dispatcher.start()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Future:
+        """Queue an item; raises queue.Full if the queue stays full past timeout."""
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((item, fut, time.perf_counter()), timeout=timeout)
+        return fut
+
+    def _dispatch_loop(self):
+        while True:
+            # Wait for a free worker first so items accumulate meanwhile.
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            items = [(item, enqueued) for item, _, enqueued in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                return
+            for (_, fut, _), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+        finally:
+            self._slots.release()
@@ -1,5 +1,6 @@
 import os
 import json
+from typing import List, Tuple
 from web3 import Web3
 
 def build_commitment(embedding_digest: str):
@@ -11,3 +12,36 @@ def build_commitment(embedding_digest: str):
     canonical = json.dumps(payload, sort_keys=True).encode()
     commitment = Web3.keccak(canonical).hex()
     return commitment, salt
+
+
+def _hash_pair(a: bytes, b: bytes) -> bytes:
+    # Sorted pairs, so proofs need no left/right flags
+    return bytes(Web3.keccak(a + b if a <= b else b + a))
+
+
+def merkle_root_and_proofs(leaves: List[bytes]) -> Tuple[bytes, List[List[str]]]:
+    """
+    Keccak Merkle tree over 32-byte leaves.
+    Returns the root and, for every leaf, its proof as hex sibling hashes.
+    """
+    if not leaves:
+        raise ValueError("No leaves to commit")
+
+    proofs: List[List[str]] = [[] for _ in leaves]
+    positions = list(range(len(leaves)))  # leaf -> index in current level
+    level = [bytes(leaf) for leaf in leaves]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        for leaf, pos in enumerate(positions):
+            proofs[leaf].append(level[pos ^ 1].hex())
+            positions[leaf] = pos // 2
+        level = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0], proofs
+
+
+def verify_merkle_proof(leaf: bytes, proof: List[str], root: bytes) -> bool:
+    node = bytes(leaf)
+    for sibling in proof:
+        node = _hash_pair(node, bytes.fromhex(sibling))
+    return node == bytes(root)
@@ -217,6 +217,8 @@ async function addDocu() {
                 <option value="aadhar card">Aadhaar Card</option>
                 <option value="Pan Card">PAN Card</option>
                 <option value="Driver's License">Driver's License</option>
+                <option value="Voter ID">Voter ID</option>
+                <option value="auto">Detect automatically</option>
               </select>
 
               <input